@@ -0,0 +1,215 @@
+from typing import Any, List, Optional, Union
+
+import orjson
+
+from app.models.main import CachedSearch, ConversionResult, Playlist, PlaylistSource, Track
+
+# bump when the layout of encoded values changes, values of another version
+# are treated as cache misses
+CODEC_VERSION = 1
+
+# order of the track fields in an encoded track
+TRACK_FIELDS = (
+    "id",
+    "title",
+    "url",
+    "artists",
+    "duration",
+    "thumbnail",
+    "album",
+    "is_explicit",
+    "spotify_search_query",
+    "youtube_search_query",
+)
+# field names as pydantic records them on a constructed track
+TRACK_FIELDS_SET = frozenset((*TRACK_FIELDS, "platform"))
+PLATFORMS = {platform.value: platform for platform in PlaylistSource}
+
+Encoded = Union[bytes, str]
+
+
+def pack_track(track: Track) -> List[Any]:
+    """turn a track into a list of its field values, the platform last
+
+    Args:
+        track (Track): track to pack
+
+    Returns:
+        List[Any]: packed track
+    """
+    values: List[Any] = [getattr(track, field) for field in TRACK_FIELDS]
+    values.append(track.platform.value)
+    return values
+
+
+def unpack_track(values: List[Any]) -> Track:
+    """build a track from its packed values without validating them again
+
+    Only values written by `pack_track` are trusted this way, they were
+    validated when the track was first built. This does what
+    `Track.model_construct` does without its per-field default handling, which
+    costs more than validating the track.
+
+    Args:
+        values (List[Any]): packed track
+
+    Returns:
+        Track: track
+    """
+    fields = dict(zip(TRACK_FIELDS, values))
+    fields["platform"] = PLATFORMS[values[len(TRACK_FIELDS)]]
+    track = Track.__new__(Track)
+    object.__setattr__(track, "__dict__", fields)
+    object.__setattr__(track, "__pydantic_fields_set__", set(TRACK_FIELDS_SET))
+    object.__setattr__(track, "__pydantic_extra__", None)
+    object.__setattr__(track, "__pydantic_private__", {"_fingerprint": None})
+    return track
+
+
+def _load(value: Encoded) -> Optional[List[Any]]:
+    # values written before the codec are JSON objects, their caller falls back
+    # to validating them
+    decoded = orjson.loads(value)
+    if isinstance(decoded, list) and len(decoded) > 0 and decoded[0] == CODEC_VERSION:
+        return decoded
+    return None
+
+
+def _is_legacy(value: Encoded) -> bool:
+    return value[:1] in (b"{", "{")
+
+
+def encode_track(track: Track) -> bytes:
+    return orjson.dumps([CODEC_VERSION, *pack_track(track)])
+
+
+def decode_track(value: Encoded) -> Optional[Track]:
+    """decode a cached track
+
+    Args:
+        value (Encoded): value written by `encode_track`, or a track JSON object
+
+    Returns:
+        Optional[Track]: the track, None if it was encoded by another codec version
+    """
+    if _is_legacy(value):
+        return Track.model_validate_json(value)
+    decoded = _load(value)
+    if decoded is None:
+        return None
+    return unpack_track(decoded[1:])
+
+
+def encode_search(search: CachedSearch) -> bytes:
+    """encode a cached search, a track with its similarity score appended or no track
+
+    Args:
+        search (CachedSearch): search outcome
+
+    Returns:
+        bytes: encoded search
+    """
+    if search.track is None:
+        return orjson.dumps([CODEC_VERSION, None, search.similarity])
+    return orjson.dumps([CODEC_VERSION, *pack_track(search.track), search.similarity])
+
+
+def decode_search(value: Encoded) -> Optional[CachedSearch]:
+    """decode a cached search
+
+    Args:
+        value (Encoded): value written by `encode_search` or `encode_track`, or a track JSON object
+
+    Returns:
+        Optional[CachedSearch]: the search, None if it was encoded by another codec version
+    """
+    if _is_legacy(value):
+        return CachedSearch(Track.model_validate_json(value))
+    decoded = _load(value)
+    if decoded is None:
+        return None
+    if decoded[1] is None:
+        return CachedSearch(None, decoded[2])
+    # the similarity follows the track values, tracks cached by `encode_track` have none
+    similarity_index = len(TRACK_FIELDS) + 2
+    similarity = decoded[similarity_index] if len(decoded) > similarity_index else None
+    return CachedSearch(unpack_track(decoded[1:similarity_index]), similarity)
+
+
+def encode_playlist(playlist: Playlist) -> bytes:
+    return orjson.dumps([
+        CODEC_VERSION,
+        playlist.id,
+        playlist.title,
+        playlist.description,
+        playlist.thumbnail,
+        playlist.author,
+        playlist.duration,
+        playlist.track_count,
+        [pack_track(track) for track in playlist.tracks],
+        playlist.platform.value,
+        playlist.similarity,
+        playlist.snapshot_id,
+    ])
+
+
+def decode_playlist(value: Encoded) -> Optional[Playlist]:
+    """decode a cached playlist
+
+    Args:
+        value (Encoded): value written by `encode_playlist`, or a playlist JSON object
+
+    Returns:
+        Optional[Playlist]: the playlist, None if it was encoded by another codec version
+    """
+    if _is_legacy(value):
+        return Playlist.model_validate_json(value)
+    decoded = _load(value)
+    if decoded is None:
+        return None
+    (_, playlist_id, title, description, thumbnail, author, duration,
+     track_count, tracks, platform, similarity, snapshot_id) = decoded
+    return Playlist.model_construct(
+        id=playlist_id,
+        title=title,
+        description=description,
+        thumbnail=thumbnail,
+        author=author,
+        duration=duration,
+        track_count=track_count,
+        tracks=[unpack_track(track) for track in tracks],
+        platform=PLATFORMS[platform],
+        similarity=similarity,
+        snapshot_id=snapshot_id,
+    )
+
+
+def encode_conversion(conversion: ConversionResult) -> bytes:
+    return orjson.dumps([
+        CODEC_VERSION,
+        conversion.version,
+        conversion.source_keys,
+        [pack_track(track) if track is not None else None for track in conversion.matches],
+    ])
+
+
+def decode_conversion(value: Encoded) -> Optional[ConversionResult]:
+    """decode a cached conversion
+
+    Args:
+        value (Encoded): value written by `encode_conversion`, or a conversion JSON object
+
+    Returns:
+        Optional[ConversionResult]: the conversion, None if it was encoded by another codec version
+    """
+    if _is_legacy(value):
+        return ConversionResult.model_validate_json(value)
+    decoded = _load(value)
+    if decoded is None:
+        return None
+    _, version, source_keys, matches = decoded
+    return ConversionResult.model_construct(
+        version=version,
+        source_keys=source_keys,
+        matches=[unpack_track(track) if track is not None else None for track in matches],
+    )
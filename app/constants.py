@@ -1,2 +1,101 @@
+import os
+from dotenv import load_dotenv
+
+# setup environment variables
+load_dotenv()
+
 SONG_CACHE_EXPIRY = 24 * 60 * 60 * 2  # 48 hours in seconds (TTL)
 DEFAULT_THUMBNAIL = "https://placehold.co/640x640.png"
+# max number of track searches running at the same time for one conversion
+SEARCH_CONCURRENCY = int(os.getenv("SEARCH_CONCURRENCY") or 10)
+# spotify web api connection pool
+SPOTIFY_MAX_CONNECTIONS = int(os.getenv("SPOTIFY_MAX_CONNECTIONS") or 20)
+SPOTIFY_MAX_KEEPALIVE_CONNECTIONS = int(
+    os.getenv("SPOTIFY_MAX_KEEPALIVE_CONNECTIONS") or 10)
+SPOTIFY_TIMEOUT = float(os.getenv("SPOTIFY_TIMEOUT") or 10)
+# refresh the spotify access token this many seconds before it expires
+SPOTIFY_TOKEN_REFRESH_MARGIN = 60
+# redis connection pool
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS") or 50)
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT") or 5)
+REDIS_CONNECT_TIMEOUT = float(os.getenv("REDIS_CONNECT_TIMEOUT") or 5)
+REDIS_HEALTH_CHECK_INTERVAL = 30
+# in-memory (L1) track cache in front of redis
+TRACK_MEMORY_CACHE_SIZE = int(os.getenv("TRACK_MEMORY_CACHE_SIZE") or 10_000)
+TRACK_MEMORY_CACHE_EXPIRY = min(
+    int(os.getenv("TRACK_MEMORY_CACHE_EXPIRY") or 10 * 60), SONG_CACHE_EXPIRY)
+# parsed source playlists, spotify ones are revalidated with their snapshot id
+SPOTIFY_PLAYLIST_CACHE_EXPIRY = 24 * 60 * 60  # 24 hours in seconds (TTL)
+YOUTUBE_PLAYLIST_CACHE_EXPIRY = int(
+    os.getenv("YOUTUBE_PLAYLIST_CACHE_EXPIRY") or 60)
+CONVERSION_CACHE_EXPIRY = SONG_CACHE_EXPIRY
+# max number of playlist pages fetched at the same time
+PLAYLIST_PAGE_CONCURRENCY = int(os.getenv("PLAYLIST_PAGE_CONCURRENCY") or 4)
+# background conversion jobs
+JOB_BACKEND = os.getenv("JOB_BACKEND") or "redis"  # "redis" or "memory"
+JOB_WORKERS = int(os.getenv("JOB_WORKERS") or 2)
+JOB_EXPIRY = 24 * 60 * 60  # 24 hours in seconds (TTL)
+# save the partial result of a job every N resolved tracks
+JOB_PROGRESS_INTERVAL = 50
+# cross-worker lock held while searching for a query
+SEARCH_LOCK_TIMEOUT = 10  # seconds
+SEARCH_LOCK_POLL_INTERVAL = 0.05  # seconds
+# upstream calls started per second
+SPOTIFY_RATE_LIMIT = float(os.getenv("SPOTIFY_RATE_LIMIT") or 10)
+YOUTUBE_RATE_LIMIT = float(os.getenv("YOUTUBE_RATE_LIMIT") or 5)
+# longest Retry-After waited for, calls asked to wait longer fail straight away;
+# kept below SEARCH_LOCK_TIMEOUT so that other workers do not search again meanwhile
+UPSTREAM_MAX_RETRY_AFTER = float(os.getenv("UPSTREAM_MAX_RETRY_AFTER") or 5)  # seconds
+# only reuse a known track id mapping that scored at least this (out of 4), matches
+# scoring less are low similarity ones that `retry_unmatched` searches for again
+TRACK_MAP_MIN_SIMILARITY = 2
+# track id mappings (and youtube music tracks stored with them) expire unless matched again
+TRACK_MAP_EXPIRY = int(os.getenv("TRACK_MAP_EXPIRY") or 30 * 24 * 60 * 60)  # 30 days in seconds (TTL)
+# searches that found nothing are cached for a shorter time
+NEGATIVE_CACHE_EXPIRY = min(
+    int(os.getenv("NEGATIVE_CACHE_EXPIRY") or 6 * 60 * 60), SONG_CACHE_EXPIRY)
+# number of search results scored to pick the best match
+SEARCH_CANDIDATES = int(os.getenv("SEARCH_CANDIDATES") or 5)
+# token guarding the admin endpoints, they are disabled without one
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+# share of requests profiled without asking for it (0 to 1)
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE") or 0)
+# number of profiles kept, the oldest ones are dropped
+PROFILE_BUFFER_SIZE = int(os.getenv("PROFILE_BUFFER_SIZE") or 20)
+PROFILE_MAX_EVENTS = 10_000
+PROFILE_TOP_FUNCTIONS = 40
+# seconds between attempts to warm up a client that failed to on startup
+WARMUP_RETRY_INTERVAL = 5
+# most playlists converted by one batch request
+BATCH_MAX_PLAYLISTS = int(os.getenv("BATCH_MAX_PLAYLISTS") or 50)
+# playlists of a batch request (or a prewarm) fetched at the same time
+BATCH_PLAYLIST_CONCURRENCY = int(os.getenv("BATCH_PLAYLIST_CONCURRENCY") or 4)
+# refresh-ahead of popular cached searches and conversions, 0 disables the refresher
+REFRESH_INTERVAL = float(os.getenv("REFRESH_INTERVAL") or 60)  # seconds
+# refresh popular entries expiring within this many seconds
+REFRESH_AHEAD = int(os.getenv("REFRESH_AHEAD") or 6 * 60 * 60)
+# accesses (decayed) an entry needs to be refreshed
+REFRESH_MIN_HITS = float(os.getenv("REFRESH_MIN_HITS") or 3)
+# most popular entries of each kind looked at per refresh
+REFRESH_BATCH_SIZE = int(os.getenv("REFRESH_BATCH_SIZE") or 100)
+# only refresh while an upstream has less than this share of its window in flight
+REFRESH_IDLE_SHARE = 0.5
+# access counts are halved this often, entries left with less than one access are dropped
+POPULARITY_DECAY_INTERVAL = 24 * 60 * 60  # 24 hours in seconds
+POPULARITY_MAX_ENTRIES = int(os.getenv("POPULARITY_MAX_ENTRIES") or 100_000)
+# distinct entries whose accesses are counted in memory between two flushes to redis
+POPULARITY_BUFFER_SIZE = 10_000
+# responses smaller than this many bytes are not compressed
+COMPRESSION_MINIMUM_SIZE = int(os.getenv("COMPRESSION_MINIMUM_SIZE") or 1024)
+# fast settings, responses are compressed on every request
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4
+# most tracks in one page of a playlist
+TRACKS_PAGE_MAX_SIZE = 500
+# local full-text index of the tracks seen, searched before searching upstream,
+# disabled without a path, e.g. "/data/track_index.db" on a mounted volume
+TRACK_INDEX_PATH = os.getenv("TRACK_INDEX_PATH")
+# only serve a track from the index when it scored at least this (out of 4)
+TRACK_INDEX_MIN_SIMILARITY = float(os.getenv("TRACK_INDEX_MIN_SIMILARITY") or 3)
+# number of index results scored to pick the best match
+TRACK_INDEX_CANDIDATES = 10
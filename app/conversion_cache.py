@@ -0,0 +1,79 @@
+import hashlib
+from typing import Optional
+from redis.asyncio import Redis
+
+from app.codec import decode_conversion, encode_conversion
+from app.constants import CONVERSION_CACHE_EXPIRY
+from app.metrics import CACHE_GET, CACHE_SET, count_cache_lookups, time_stage
+from app.models.main import ConversionResult, Playlist, PlaylistSource, Track
+from app.utils.fingerprint import get_fingerprint
+
+
+def get_track_key(track: Track) -> str:
+    """get a stable key of a source track
+
+    Args:
+        track (Track): track from the source playlist
+
+    Returns:
+        str: platform track id, the track fingerprint for tracks without one
+    """
+    return track.id or get_fingerprint(track).key
+
+
+def get_playlist_version(playlist: Playlist) -> str:
+    """get the version of a source playlist
+
+    Args:
+        playlist (Playlist): source playlist
+
+    Returns:
+        str: spotify snapshot id, a digest of the track ids otherwise
+    """
+    if playlist.snapshot_id:
+        return playlist.snapshot_id
+    digest = hashlib.sha1()
+    for track in playlist.tracks:
+        digest.update(get_track_key(track).encode())
+        digest.update(b"\n")
+    return digest.hexdigest()
+
+
+def get_conversion_cache_key(playlist: Playlist, convert_to: PlaylistSource) -> str:
+    return f"conversion:{playlist.platform.value}:{playlist.id}:{convert_to.value}"
+
+
+async def get_cached_conversion(cache: Redis, playlist: Playlist, convert_to: PlaylistSource) -> Optional[ConversionResult]:
+    """get the last conversion of a source playlist, whatever its version
+
+    Args:
+        cache (Redis): redis connection
+        playlist (Playlist): source playlist
+        convert_to (PlaylistSource): platform the playlist was converted to
+
+    Returns:
+        Optional[ConversionResult]: cached conversion if any
+    """
+    with time_stage(CACHE_GET):
+        cached_conversion = await cache.get(get_conversion_cache_key(playlist, convert_to))
+    count_cache_lookups("conversion", int(cached_conversion is not None), int(cached_conversion is None))
+    if cached_conversion is None:
+        return None
+    return decode_conversion(cached_conversion)
+
+
+async def cache_conversion(cache: Redis, playlist: Playlist, convert_to: PlaylistSource, conversion: ConversionResult) -> None:
+    """cache the conversion of a source playlist
+
+    Args:
+        cache (Redis): redis connection
+        playlist (Playlist): source playlist
+        convert_to (PlaylistSource): platform the playlist was converted to
+        conversion (ConversionResult): matched tracks of the playlist
+    """
+    with time_stage(CACHE_SET):
+        await cache.setex(
+            name=get_conversion_cache_key(playlist, convert_to),
+            time=CONVERSION_CACHE_EXPIRY,
+            value=encode_conversion(conversion),
+        )
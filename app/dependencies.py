@@ -1,13 +1,17 @@
-import os
-import redis
+import redis.asyncio as redis
 from typing import List
-from app.constants import SONG_CACHE_EXPIRY
-from app.utils.parse_track import parse_spotify_track_data, parse_youtube_track_data
+from app.constants import SPOTIFY_PLAYLIST_CACHE_EXPIRY, YOUTUBE_PLAYLIST_CACHE_EXPIRY
+from app.utils.parse_track import get_search_query, parse_spotify_track_data, parse_youtube_track_data
 
 from app.utils.parser import get_playlist_source
+from app.metrics import PARSE, PLAYLIST_FETCH, time_stage
+from app.services.cache import redis_pool
 from app.services.spotify import spotify, SpotifyException
-from app.services.youtube import ytmusic
+from app.services import youtube
 from app.models.main import Playlist, PlaylistSource, Track
+from app.playlist_cache import cache_playlist, get_cached_playlist
+from app.track_cache import cache_tracks
+from app.track_index import track_index
 
 
 class PlaylistNotFound(Exception):
@@ -32,18 +36,136 @@ class InvalidPlaylistUrl(Exception):
 
 
 def create_redis() -> redis.Redis:
-    """connect to redis
+    """connect to redis using the shared connection pool
 
     Returns:
         _type_: Redis
     """
-    pool = redis.ConnectionPool.from_url(os.getenv("REDIS_URL"))
-    return redis.Redis(connection_pool=pool)
+    return redis_pool.client()
 
 
-def fetch_playlist_from_url(url: str) -> Playlist:
+async def fetch_spotify_playlist(cache: redis.Redis, playlist_id: str) -> Playlist:
+    """fetch and parse a spotify playlist
+
+    Args:
+        cache (redis.Redis): redis connection
+        playlist_id (str): spotify playlist id
+
+    Raises:
+        PlaylistNotFound: playlist does not exist on spotify
+
+    Returns:
+        Playlist: Playlist object
+    """
+    try:
+        spotify_playlist = await spotify.playlist(playlist_id=playlist_id)
+    except SpotifyException:
+        raise PlaylistNotFound(PlaylistSource.SPOTIFY)
+    if spotify_playlist is None:
+        raise PlaylistNotFound(PlaylistSource.SPOTIFY)
+    first_page = spotify_playlist.get("tracks")
+    parsed_tracks: List[Track] = []
+    duration = 0
+
+    def parse_page(tracks: List[dict]) -> None:
+        nonlocal duration
+        with time_stage(PARSE):
+            for track in tracks:
+                song = track.get("track")
+                if song is not None:
+                    parsed_song = parse_spotify_track_data(song)
+                    duration += parsed_song.duration
+                    parsed_tracks.append(parsed_song)
+
+    # the playlist only comes with its first page of items
+    parse_page(first_page.get("items"))
+    try:
+        async for tracks in spotify.iter_playlist_item_pages(
+            playlist_id, total=first_page.get("total"), start=len(first_page.get("items"))
+        ):
+            parse_page(tracks)
+    except SpotifyException:
+        raise PlaylistNotFound(PlaylistSource.SPOTIFY)
+
+    await cache_tracks(cache, [
+        (get_search_query(track, PlaylistSource.SPOTIFY), track) for track in parsed_tracks
+    ])
+    track_index.add_later(parsed_tracks)
+
+    return Playlist(
+        id=spotify_playlist.get("id"),
+        title=spotify_playlist.get("name"),
+        description=spotify_playlist.get("description"),
+        thumbnail=spotify_playlist.get("images")[0].get("url"),
+        author=spotify_playlist.get("owner").get("display_name"),
+        duration=duration,
+        track_count=spotify_playlist.get("tracks").get("total"),
+        tracks=parsed_tracks,
+        platform=PlaylistSource.SPOTIFY,
+        similarity=0,
+        snapshot_id=spotify_playlist.get("snapshot_id"),
+    )
+
+
+async def fetch_youtube_playlist(cache: redis.Redis, playlist_id: str) -> Playlist:
+    """fetch and parse a youtube music playlist
+
+    Args:
+        cache (redis.Redis): redis connection
+        playlist_id (str): youtube music playlist id
+
+    Raises:
+        PlaylistNotFound: playlist does not exist on youtube music
+
+    Returns:
+        Playlist: Playlist object
+    """
+    try:
+        # limit=None follows every continuation instead of stopping at 100 tracks
+        youtube_playlist = await youtube.get_playlist(playlist_id, limit=None)
+    except Exception:
+        raise PlaylistNotFound(PlaylistSource.YOUTUBE)
+    if youtube_playlist is None:
+        raise PlaylistNotFound(PlaylistSource.YOUTUBE)
+
+    tracks = youtube_playlist.get("tracks")
+    parsed_tracks: List[Track] = []
+
+    if tracks:
+        with time_stage(PARSE):
+            for track in tracks:
+                parsed_song = parse_youtube_track_data(track)
+                parsed_tracks.append(parsed_song)
+
+    await cache_tracks(cache, [
+        (get_search_query(track, PlaylistSource.YOUTUBE), track) for track in parsed_tracks
+    ])
+    track_index.add_later(parsed_tracks)
+
+    thumbnails = youtube_playlist.get("thumbnails") or [{"url": ""}]
+    author = youtube_playlist.get("author") or {"name": ""}
+
+    return Playlist(
+        id=youtube_playlist.get("id") or "",
+        title=youtube_playlist.get("title") or "",
+        description=youtube_playlist.get("description") or "",
+        thumbnail=thumbnails[0].get("url"),
+        author=author.get("name") or "",
+        duration=(youtube_playlist.get(
+            "duration_seconds") or 0) * 1000,
+        track_count=youtube_playlist.get("trackCount") or 0,
+        tracks=parsed_tracks,
+        platform=PlaylistSource.YOUTUBE,
+        similarity=0,
+    )
+
+
+async def fetch_playlist_from_url(url: str) -> Playlist:
     """fetch playlist from url
 
+    Parsed playlists are cached, a cached spotify playlist is only served while
+    its `snapshot_id` is unchanged and a cached youtube playlist for a short TTL.
+
     Args:
         url (str): either spotify or youtube playlist url
 
@@ -60,83 +182,30 @@ def fetch_playlist_from_url(url: str) -> Playlist:
     if playlist_info is None:
         raise InvalidPlaylistUrl()
 
+    playlist_id = playlist_info.playlist_id
+    cached_playlist = await get_cached_playlist(cache, playlist_info.source, playlist_id)
+
     match playlist_info.source:
         case PlaylistSource.SPOTIFY:
-            try:
-                spotify_playlist = spotify.playlist(
-                    playlist_id=playlist_info.playlist_id
-                )
-            except SpotifyException:
-                raise PlaylistNotFound(PlaylistSource.SPOTIFY)
-            if spotify_playlist is None:
-                raise PlaylistNotFound(PlaylistSource.SPOTIFY)
-            tracks = spotify_playlist.get("tracks").get("items")
-            parsed_tracks: List[Track] = []
-            duration = 0
-
-            for track in tracks:
-                song = track.get("track")
-                if song is not None:
-                    parsed_song = parse_spotify_track_data(song)
-                    duration += parsed_song.duration
-                    parsed_tracks.append(parsed_song)
-
-                    cache.setex(
-                        name=parsed_song.spotify_search_query,
-                        time=SONG_CACHE_EXPIRY,
-                        value=parsed_song.model_dump_json(),
-                    )
-
-            return Playlist(
-                id=spotify_playlist.get("id"),
-                title=spotify_playlist.get("name"),
-                description=spotify_playlist.get("description"),
-                thumbnail=spotify_playlist.get("images")[0].get("url"),
-                author=spotify_playlist.get("owner").get("display_name"),
-                duration=duration,
-                track_count=spotify_playlist.get("tracks").get("total"),
-                tracks=parsed_tracks,
-                platform=PlaylistSource.SPOTIFY,
-                similarity=0,
-            )
+            if cached_playlist is not None:
+                try:
+                    snapshot = await spotify.playlist(
+                        playlist_id=playlist_id, fields="snapshot_id")
+                except SpotifyException:
+                    raise PlaylistNotFound(PlaylistSource.SPOTIFY)
+                if snapshot.get("snapshot_id") == cached_playlist.snapshot_id:
+                    return cached_playlist
+
+            with time_stage(PLAYLIST_FETCH, playlist_id):
+                playlist = await fetch_spotify_playlist(cache, playlist_id)
+            await cache_playlist(cache, playlist_id, playlist, SPOTIFY_PLAYLIST_CACHE_EXPIRY)
+            return playlist
 
         case PlaylistSource.YOUTUBE:
-            try:
-                youtube_playlist = ytmusic.get_playlist(
-                    playlistId=playlist_info.playlist_id
-                )
-            except Exception:
-                raise PlaylistNotFound(PlaylistSource.YOUTUBE)
-            if youtube_playlist is None:
-                raise PlaylistNotFound(PlaylistSource.YOUTUBE)
-
-            tracks = youtube_playlist.get("tracks")
-            parsed_tracks: List[Track] = []
-
-            if tracks:
-                for track in tracks:
-                    parsed_song = parse_youtube_track_data(track)
-                    parsed_tracks.append(parsed_song)
+            if cached_playlist is not None:
+                return cached_playlist
 
-                    cache.setex(
-                        name=parsed_song.youtube_search_query,
-                        time=SONG_CACHE_EXPIRY,
-                        value=parsed_song.model_dump_json(),
-                    )
-
-            thumbnails = youtube_playlist.get("thumbnails") or [{"url": ""}]
-            author = youtube_playlist.get("author") or {"name": ""}
-
-            return Playlist(
-                id=youtube_playlist.get("id") or "",
-                title=youtube_playlist.get("title") or "",
-                description=youtube_playlist.get("description") or "",
-                thumbnail=thumbnails[0].get("url"),
-                author=author.get("name") or "",
-                duration=(youtube_playlist.get(
-                    "duration_seconds") or 0) * 1000,
-                track_count=youtube_playlist.get("trackCount") or 0,
-                tracks=parsed_tracks,
-                platform=PlaylistSource.YOUTUBE,
-                similarity=0,
-            )
+            with time_stage(PLAYLIST_FETCH, playlist_id):
+                playlist = await fetch_youtube_playlist(cache, playlist_id)
+            await cache_playlist(cache, playlist_id, playlist, YOUTUBE_PLAYLIST_CACHE_EXPIRY)
+            return playlist
@@ -0,0 +1,217 @@
+import asyncio
+import uuid
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional
+from redis.asyncio import Redis
+
+from app.constants import JOB_BACKEND, JOB_EXPIRY, JOB_PROGRESS_INTERVAL, JOB_WORKERS
+from app.dependencies import create_redis, fetch_playlist_from_url
+from app.models.main import ConvertPlaylist, Job, JobStatus, Track
+from app.resolver import build_converted_playlist, iter_converted_tracks
+
+
+class JobStore(ABC):
+    """Where the state of conversion jobs is kept
+
+    """
+
+    @abstractmethod
+    async def get(self, job_id: str) -> Optional[Job]:
+        ...
+
+    @abstractmethod
+    async def save(self, job: Job) -> None:
+        ...
+
+    async def close(self) -> None:
+        """release the connections of the store
+
+        """
+
+
+class InMemoryJobStore(JobStore):
+    """Job store for local runs and tests, jobs are only visible to this process
+
+    """
+
+    def __init__(self) -> None:
+        self.jobs: Dict[str, Job] = {}
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        return self.jobs.get(job_id)
+
+    async def save(self, job: Job) -> None:
+        self.jobs[job.id] = job
+
+
+class RedisJobStore(JobStore):
+    """Job store shared by every app process through redis
+
+    """
+
+    def __init__(self, cache: Redis) -> None:
+        self.cache = cache
+
+    @staticmethod
+    def get_key(job_id: str) -> str:
+        return f"job:{job_id}"
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        cached_job = await self.cache.get(self.get_key(job_id))
+        if cached_job is None:
+            return None
+        return Job.model_validate_json(cached_job)
+
+    async def save(self, job: Job) -> None:
+        await self.cache.setex(
+            name=self.get_key(job.id),
+            time=JOB_EXPIRY,
+            value=job.model_dump_json(),
+        )
+
+    async def close(self) -> None:
+        # the shared connection pool is left open
+        await self.cache.aclose()
+
+
+class JobManager:
+    """Queue of conversion jobs processed by a pool of background workers
+
+    The queue lives in this process, a job only runs in the process it was
+    submitted to even though the redis store lets every process poll it. Jobs
+    not finished when the process stops are marked as failed, jobs of a process
+    that crashed stay pending or running until they expire.
+    """
+
+    def __init__(self, store: Optional[JobStore] = None, workers: int = JOB_WORKERS) -> None:
+        self._store = store
+        self.workers = workers
+        self._queue: "asyncio.Queue[str]" = asyncio.Queue()
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def store(self) -> JobStore:
+        if self._store is None:
+            raise RuntimeError("the job manager is not started")
+        return self._store
+
+    def start(self) -> None:
+        """create the job store, unless one was given, and start the worker pool
+
+        """
+        if self._store is None:
+            self._store = create_job_store()
+        if len(self._tasks) == 0:
+            self._tasks = [asyncio.create_task(self._work())
+                           for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        """stop the worker pool, marking the jobs it did not finish as failed, and
+        close the job store
+
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._store is None:
+            return
+        try:
+            while not self._queue.empty():
+                job = await self.store.get(self._queue.get_nowait())
+                self._queue.task_done()
+                if job is not None:
+                    await self.store.save(interrupt(job))
+        finally:
+            await self.store.close()
+
+    async def submit(self, data: ConvertPlaylist) -> Job:
+        """queue a conversion
+
+        Args:
+            data (ConvertPlaylist): playlist to convert
+
+        Returns:
+            Job: the pending job
+        """
+        job = Job(
+            id=uuid.uuid4().hex,
+            status=JobStatus.PENDING,
+            playlist_url=data.playlist_url,
+            convert_to=data.convert_to,
+            retry_unmatched=data.retry_unmatched,
+        )
+        await self.store.save(job)
+        await self._queue.put(job.id)
+        return job
+
+    async def _work(self) -> None:
+        while True:
+            job_id = await self._queue.get()
+            try:
+                job = await self.store.get(job_id)
+                if job is not None:
+                    await self.run(job)
+            finally:
+                self._queue.task_done()
+
+    async def run(self, job: Job) -> Job:
+        """convert the playlist of a job, saving its progress along the way
+
+        Args:
+            job (Job): job to run
+
+        Returns:
+            Job: the finished job
+        """
+        cache = create_redis()
+        platform = job.convert_to
+        try:
+            playlist = await fetch_playlist_from_url(job.playlist_url)
+
+            matches: List[Optional[Track]] = [None] * len(playlist.tracks)
+            job = job.model_copy(update={
+                "status": JobStatus.RUNNING,
+                "total": len(playlist.tracks),
+            })
+            await self.store.save(job)
+
+            async for index, track in iter_converted_tracks(cache, playlist, platform, job.retry_unmatched):
+                matches[index] = track
+                job.resolved += 1
+                if job.resolved % JOB_PROGRESS_INTERVAL == 0:
+                    job.playlist = build_converted_playlist(
+                        playlist.tracks, matches, platform)
+                    await self.store.save(job)
+
+            job.playlist = build_converted_playlist(
+                playlist.tracks, matches, platform)
+            job.status = JobStatus.COMPLETED
+        except asyncio.CancelledError:
+            # the process is stopping, no other process picks the job up
+            await self.store.save(interrupt(job))
+            raise
+        except Exception as e:
+            job = job.model_copy(update={
+                "status": JobStatus.FAILED,
+                "error": str(e) or type(e).__name__,
+            })
+        await self.store.save(job)
+        return job
+
+
+def interrupt(job: Job) -> Job:
+    return job.model_copy(update={
+        "status": JobStatus.FAILED,
+        "error": "the conversion was interrupted by a restart, submit it again",
+    })
+
+
+def create_job_store() -> JobStore:
+    if JOB_BACKEND == "memory":
+        return InMemoryJobStore()
+    return RedisJobStore(create_redis())
+
+
+# the job store is created on startup
+job_manager = JobManager()
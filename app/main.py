@@ -1,32 +1,82 @@
 import os
-import json
-from time import time
+import asyncio
+from time import perf_counter
+from typing import AsyncIterator, Iterator, List, Optional, Union
+from contextlib import asynccontextmanager, contextmanager
 
 
-from typing import List, Optional
-from redis import Redis
-from fastapi import Depends, FastAPI, HTTPException, Request
+import orjson
+from redis.asyncio import Redis
+from fastapi import Depends, FastAPI, Header, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from dotenv import load_dotenv
+from fastapi.responses import StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 
+from app.compression import CompressionMiddleware
+from app.conversion_cache import get_playlist_version
 from app.dependencies import InvalidPlaylistUrl, PlaylistNotFound, create_redis, fetch_playlist_from_url
-from app.constants import SONG_CACHE_EXPIRY
+from app.constants import BATCH_MAX_PLAYLISTS, BATCH_PLAYLIST_CONCURRENCY, REFRESH_INTERVAL
+from app.resolver import ConversionTotals, build_converted_playlist, convert_playlists, convert_tracks, iter_converted_tracks
+from app.utils.concurrency import gather_with_concurrency
 from app.utils.parser import get_playlist_source
-from app.utils.parse_track import calculate_similarity, parse_spotify_track_data, parse_youtube_track_data
-from app.models.main import GeneratePlaylist, GetPlaylist, Playlist, PlaylistSource, Track
+from app.jobs import job_manager
+from app.metrics import SERIALIZE, TimedORJSONResponse, request_latency, requests_in_flight, time_stage
+from app.models.main import (
+    BatchConversion,
+    BatchPlaylistResult,
+    ConvertPlaylist,
+    GeneratePlaylist,
+    GeneratePlaylistStream,
+    GeneratePlaylists,
+    GetPlaylist,
+    Job,
+    Playlist,
+    PlaylistPage,
+    Prewarm,
+    PrewarmResult,
+    PlaylistView,
+    Profile,
+)
+from app.playlist_view import InvalidCursor, StaleCursor, project_track, render_playlist
+from app.refresh import prewarm, run_refresher
+from app.profiling import PROFILE_HEADER, get_profile, is_admin_token, profile, profiles, should_profile
+from app.services.cache import redis_pool
 from app.services.spotify import spotify
-from app.services.youtube import ytmusic
-
+from app.track_cache import track_memory_cache
+from app.track_index import track_index
+from app.warmup import warmup
 
-# setup environment variables
-load_dotenv()
 
 # CORS
 cors_origins_str = os.getenv("CORS_ORIGINS")
 origins = cors_origins_str.split() if cors_origins_str else []
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open shared clients on startup and close them on shutdown
+
+    The clients are warmed up in the background, requests are served meanwhile.
+    Popular cache entries are refreshed in the background too.
+    """
+    redis_pool.open()
+    job_manager.start()
+    background_tasks = [asyncio.create_task(warmup.run())]
+    if REFRESH_INTERVAL > 0:
+        background_tasks.append(asyncio.create_task(run_refresher()))
+    yield
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    await job_manager.stop()
+    await spotify.close()
+    await redis_pool.close()
+    await track_index.wait_for_writes()
+    track_index.close()
+
+
 # FASTApi app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan, default_response_class=TimedORJSONResponse)
 
 # Middlewares
 app.add_middleware(
@@ -36,18 +86,30 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(CompressionMiddleware)
 
 
 @app.middleware("http")
-async def print_process_time(request: Request, call_next):
-    """Middleware to print the time taken to process the request and return response
+async def record_request_metrics(request: Request, call_next):
+    """Middleware to record the time taken to process the request by route and status
 
     """
-    start_time = time()
-    response = await call_next(request)
-    print("Time took to process the request and return response is {} sec".format(
-        time() - start_time))
-    return response
+    start_time = perf_counter()
+    status = 500
+    requests_in_flight.inc()
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        requests_in_flight.dec()
+        # the route template keeps the number of label values bounded
+        route = request.scope.get("route")
+        request_latency.labels(
+            method=request.method,
+            route=route.path if route is not None else "unmatched",
+            status=status,
+        ).observe(perf_counter() - start_time)
 
 
 @app.get("/")
@@ -55,15 +117,87 @@ async def index():
     return {"message": "Application is running :)"}
 
 
-@app.post("/get-playlist", response_model=Playlist)
-async def get_playlist(data: GetPlaylist) -> Playlist:
-    """Get playlist from url
+@app.get("/health")
+async def health():
+    """Check that the app can reach redis
+
+    """
+    if not await redis_pool.ping():
+        raise HTTPException(status_code=503, detail="redis is unreachable")
+    return {"redis": "ok"}
+
+
+@app.get("/ready")
+async def ready() -> Response:
+    """Check that every client finished warming up (redis connection, spotify token, youtube music client)
+
+    """
+    return TimedORJSONResponse(
+        {"ready": warmup.ready, "clients": warmup.status()},
+        status_code=200 if warmup.ready else 503,
+    )
+
+
+@app.get("/metrics")
+async def metrics() -> Response:
+    """Prometheus metrics of this process
+
+    """
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.get("/cache-stats")
+async def cache_stats():
+    """Hit, miss and eviction counters of the in-memory track cache
+
+    """
+    return track_memory_cache.stats()
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)) -> None:
+    """Only let requests with the admin token through
+
+    """
+    if not is_admin_token(x_admin_token):
+        raise HTTPException(status_code=403, detail="admin token is missing or invalid")
+
+
+@contextmanager
+def profile_request(name: str, request: Request, response: Response) -> Iterator[None]:
+    """Profile the request if it asked for it or was sampled, the profile id is sent back
+    in the `X-Profile-Id` header
+
+    """
+    with profile(name, should_profile(request.headers.get(PROFILE_HEADER))) as recorder:
+        if recorder is not None:
+            response.headers["X-Profile-Id"] = recorder.id
+        yield
+
+
+def playlist_response(playlist: Playlist, version: str, view: PlaylistView, response: Response) -> Response:
+    """Respond with the page of the playlist and the track fields the request asked for
 
     """
     try:
-        playlist = fetch_playlist_from_url(data.url)
+        content = render_playlist(playlist, version, view)
+    except StaleCursor as e:
+        raise HTTPException(status_code=409, detail=e.message)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=e.message)
+    # headers set on `response` are dropped when returning another response
+    return TimedORJSONResponse(content, headers=response.headers)
+
 
-        return playlist
+@app.post("/get-playlist", response_model=PlaylistPage)
+async def get_playlist(data: GetPlaylist, request: Request, response: Response) -> Response:
+    """Get playlist from url
+
+    A page of its tracks is returned with `limit`, the next page is fetched with the
+    `next_cursor` of the previous one. `fields` picks the track fields returned.
+    """
+    try:
+        with profile_request("get_playlist", request, response):
+            playlist = await fetch_playlist_from_url(data.url)
     except InvalidPlaylistUrl:
         raise HTTPException(status_code=400, detail="playlist url is invalid")
     except PlaylistNotFound:
@@ -71,114 +205,170 @@ async def get_playlist(data: GetPlaylist) -> Playlist:
     except Exception:
         raise HTTPException(status_code=500, detail="Internal server error")
 
+    return playlist_response(playlist, get_playlist_version(playlist), data, response)
 
-@app.post("/generate-playlist", response_model=Playlist)
-async def generate_playlist(data: GeneratePlaylist, cache: Redis = Depends(create_redis)) -> Playlist:
-    """Generate playlist from url (spotify -> youtube or youtube -> spotify)
 
-    """
-    url = data.playlist_url
-    platform = data.convert_to
+def validate_conversion(data: ConvertPlaylist) -> None:
+    """Check that the playlist url is valid and not from the platform to convert to
 
-    playlist_source_from_url = get_playlist_source(url)
-    if playlist_source_from_url is None or playlist_source_from_url.source == platform:
+    """
+    playlist_source_from_url = get_playlist_source(data.playlist_url)
+    if playlist_source_from_url is None or playlist_source_from_url.source == data.convert_to:
         raise HTTPException(
             status_code=400, detail="either playlist url is invalid or you are trying yo convert to the same platform")
 
+
+async def fetch_source_playlist(data: ConvertPlaylist) -> Playlist:
+    """Fetch the playlist to convert, raising the matching HTTP error
+
+    """
+    url = data.playlist_url
+    validate_conversion(data)
+
     try:
-        playlist = fetch_playlist_from_url(url)
+        return await fetch_playlist_from_url(url)
     except InvalidPlaylistUrl:
         raise HTTPException(status_code=400, detail="playlist url is invalid")
     except PlaylistNotFound:
         raise HTTPException(status_code=404, detail="playlist does not exist")
-    except Exception as e:
+    except Exception:
         raise HTTPException(status_code=500, detail="Internal server error")
 
-    tracks: List[Track] = []
-    total_duration = 0
-    track_count = 0
-    total_similarity = 0
-
-    match platform:
-        case PlaylistSource.SPOTIFY:
-
-            for gotten_track in playlist.tracks:
-                track: Optional[Track] = None
-                cached_song = cache.get(gotten_track.spotify_search_query)
-                if cached_song is not None:
-                    track_json = json.loads(cached_song)  # type: ignore
-                    track = Track(**track_json)
-                else:
-                    search_result = spotify.search(
-                        gotten_track.spotify_search_query, type="track", limit=1)
-                    if search_result:
-                        related_tracks = search_result.get(
-                            "tracks").get("items")
-                        if len(related_tracks) > 0:
-                            found_track = related_tracks[0]
-                            track = parse_spotify_track_data(found_track)
-                            cache.setex(
-                                name=gotten_track.spotify_search_query,
-                                time=SONG_CACHE_EXPIRY,
-                                value=track.model_dump_json(),
-                            )
-                if track is not None:
-                    tracks.append(track)
-                    total_similarity += calculate_similarity(
-                        gotten_track, track)
-                    total_duration += track.duration
-                    track_count += 1
-
-            similarity = total_similarity / track_count if track_count > 0 else 0
-
-            return Playlist(
-                id="",
-                title="",
-                description="",
-                thumbnail="",
-                author="",
-                duration=total_duration,
-                track_count=track_count,
-                tracks=tracks,
-                platform=platform,
-                similarity=(similarity / 4) * 100,
-            )
-        case PlaylistSource.YOUTUBE:
-            for gotten_track in playlist.tracks:
-                track: Optional[Track] = None
-
-                cached_song = cache.get(gotten_track.youtube_search_query)
-                if cached_song is not None:
-                    track_json = json.loads(cached_song)  # type: ignore
-                    track = Track(**track_json)
-                else:
-                    search_result = ytmusic.search(
-                        gotten_track.youtube_search_query, "songs", limit=1)
-                    if search_result:
-                        track = parse_youtube_track_data(search_result[0])
-                        cache.setex(
-                            name=gotten_track.youtube_search_query,
-                            time=SONG_CACHE_EXPIRY,
-                            value=track.model_dump_json(),
-                        )
-                if track is not None:
-                    tracks.append(track)
-                    total_similarity += calculate_similarity(
-                        gotten_track, track)
-                    total_duration += track.duration
-                    track_count += 1
-
-            similarity = total_similarity / track_count if track_count > 0 else 0
-
-            return Playlist(
-                id="",
-                title="",
-                description="",
-                thumbnail="",
-                author="",
-                duration=total_duration,
-                track_count=track_count,
-                tracks=tracks,
-                platform=platform,
-                similarity=(similarity / 4) * 100,
-            )
+
+@app.post("/generate-playlist", response_model=PlaylistPage)
+async def generate_playlist(
+    data: GeneratePlaylist, request: Request, response: Response, cache: Redis = Depends(create_redis)
+) -> Response:
+    """Generate playlist from url (spotify -> youtube or youtube -> spotify)
+
+    Takes `limit`, `cursor` and `fields` like `/get-playlist`, the pages are pages of the
+    converted playlist.
+    """
+    with profile_request("generate_playlist", request, response):
+        playlist = await fetch_source_playlist(data)
+
+        tracks = await convert_tracks(cache, playlist, data.convert_to, data.retry_unmatched)
+
+        converted_playlist = build_converted_playlist(playlist.tracks, tracks, data.convert_to)
+        return playlist_response(converted_playlist, get_playlist_version(playlist), data, response)
+
+
+@app.post("/generate-playlists", response_model=BatchConversion)
+async def generate_playlists(data: GeneratePlaylists, cache: Redis = Depends(create_redis)) -> BatchConversion:
+    """Generate several playlists at once, tracks found in more than one playlist are only looked up once
+
+    A playlist that can not be converted gets an `error` instead of failing the whole batch.
+    """
+    if len(data.playlist_urls) > BATCH_MAX_PLAYLISTS:
+        raise HTTPException(
+            status_code=400, detail=f"at most {BATCH_MAX_PLAYLISTS} playlists can be converted at once")
+
+    async def fetch(url: str) -> Union[Playlist, str]:
+        try:
+            return await fetch_source_playlist(ConvertPlaylist(playlist_url=url, convert_to=data.convert_to))
+        except HTTPException as e:
+            return e.detail
+
+    results = [BatchPlaylistResult(playlist_url=url) for url in data.playlist_urls]
+    sources = await gather_with_concurrency(data.playlist_urls, fetch, BATCH_PLAYLIST_CONCURRENCY)
+    playlists: List[Playlist] = []
+    for result, source in zip(results, sources):
+        if isinstance(source, str):
+            result.error = source
+        else:
+            playlists.append(source)
+
+    conversions, unique_track_count = await convert_playlists(
+        cache, playlists, data.convert_to, data.retry_unmatched)
+    converted = iter(zip(playlists, conversions))
+    for result in results:
+        if result.error is None:
+            playlist, tracks = next(converted)
+            result.playlist = build_converted_playlist(playlist.tracks, tracks, data.convert_to)
+
+    return BatchConversion(playlists=results, unique_track_count=unique_track_count)
+
+
+@app.post("/generate-playlist/stream")
+async def generate_playlist_stream(data: GeneratePlaylistStream, cache: Redis = Depends(create_redis)) -> StreamingResponse:
+    """Generate playlist from url, streaming each track as newline delimited JSON as soon as it is found
+
+    Every line is either `{"type": "track", "index": ..., "track": ...}` where `index` is the
+    position of the source track (`track` is null when no match was found), or the final
+    `{"type": "summary", "duration": ..., "track_count": ..., "similarity": ...}`.
+    `fields` picks the track fields of every line.
+    """
+    playlist = await fetch_source_playlist(data)
+
+    async def stream_tracks() -> AsyncIterator[bytes]:
+        totals = ConversionTotals()
+        async for index, track in iter_converted_tracks(cache, playlist, data.convert_to, data.retry_unmatched):
+            if track is not None:
+                totals.add(playlist.tracks[index], track)
+            with time_stage(SERIALIZE):
+                line = orjson.dumps({
+                    "type": "track",
+                    "index": index,
+                    "track": project_track(track, data.fields) if track is not None else None,
+                }, option=orjson.OPT_APPEND_NEWLINE)
+            yield line
+        yield orjson.dumps({
+            "type": "summary",
+            "platform": data.convert_to.value,
+            "duration": totals.duration,
+            "track_count": totals.track_count,
+            "similarity": totals.similarity,
+        }, option=orjson.OPT_APPEND_NEWLINE)
+
+    return StreamingResponse(stream_tracks(), media_type="application/x-ndjson")
+
+
+@app.post("/jobs", response_model=Job, status_code=202)
+async def create_job(data: ConvertPlaylist) -> Job:
+    """Convert a playlist in the background, poll `/jobs/{job_id}` for its progress and result
+
+    """
+    validate_conversion(data)
+    return await job_manager.submit(data)
+
+
+@app.get("/jobs/{job_id}", response_model=Job)
+async def get_job(job_id: str) -> Job:
+    """Get the progress, partial result or final result of a conversion job
+
+    """
+    job = await job_manager.store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="job does not exist")
+    return job
+
+
+@app.get("/admin/profiles", dependencies=[Depends(require_admin)])
+async def list_profiles() -> List[dict]:
+    """Latest request profiles, newest first, without their trace and call stack breakdown
+
+    """
+    return [stored_profile.model_dump(include={"id", "name", "started_at", "duration"})
+            for stored_profile in reversed(profiles)]
+
+
+@app.get("/admin/profiles/{profile_id}", response_model=Profile, dependencies=[Depends(require_admin)])
+async def read_profile(profile_id: str) -> Profile:
+    """Call stack breakdown and per-track trace of a profiled request
+
+    """
+    stored_profile = get_profile(profile_id)
+    if stored_profile is None:
+        raise HTTPException(status_code=404, detail="profile does not exist")
+    return stored_profile
+
+
+@app.post("/admin/prewarm", response_model=List[PrewarmResult], dependencies=[Depends(require_admin)])
+async def prewarm_playlists(data: Prewarm, cache: Redis = Depends(create_redis)) -> List[PrewarmResult]:
+    """Convert playlists ahead of their first request, they are then kept fresh while they are popular
+
+    """
+    if len(data.playlist_urls) > BATCH_MAX_PLAYLISTS:
+        raise HTTPException(
+            status_code=400, detail=f"at most {BATCH_MAX_PLAYLISTS} playlists can be prewarmed at once")
+    return await prewarm(cache, data.playlist_urls, data.convert_to)
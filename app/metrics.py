@@ -0,0 +1,114 @@
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Any, Iterator
+
+from fastapi.responses import ORJSONResponse
+from prometheus_client import Counter, Gauge, Histogram
+
+from app.profiling import record_stage
+
+# buckets from a cache hit in memory to a playlist conversion
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+request_latency = Histogram(
+    "http_request_duration_seconds",
+    "Time to process a request until its response starts",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+requests_in_flight = Gauge(
+    "http_requests_in_flight",
+    "Requests being processed",
+)
+stage_latency = Histogram(
+    "stage_duration_seconds",
+    "Time spent in each stage of a request",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+cache_lookups = Counter(
+    "cache_lookups_total",
+    "Cache lookups by cache and result",
+    ["cache", "result"],
+)
+upstream_in_flight = Gauge(
+    "upstream_calls_in_flight",
+    "Calls to an upstream API in flight",
+    ["upstream"],
+)
+upstream_concurrency = Gauge(
+    "upstream_concurrency_window",
+    "Calls to an upstream API allowed at the same time",
+    ["upstream"],
+)
+unmatched_searches = Counter(
+    "upstream_unmatched_searches_total",
+    "Upstream searches that found no match",
+    ["platform"],
+)
+cache_refreshes = Counter(
+    "cache_refreshes_total",
+    "Popular cache entries refreshed before they expire, by kind and result",
+    ["kind", "result"],
+)
+refresher_errors = Counter(
+    "refresher_errors_total",
+    "Background cache refreshes that failed",
+)
+searches_in_flight = Gauge(
+    "searches_in_flight",
+    "Distinct track searches in flight in this process",
+)
+
+# stages of `stage_latency`
+PLAYLIST_FETCH = "playlist_fetch"
+SEARCH = "search"
+CACHE_GET = "cache_get"
+CACHE_SET = "cache_set"
+PARSE = "parse"
+SCORE = "score"
+SERIALIZE = "serialize"
+COMPRESS = "compress"
+
+
+@contextmanager
+def time_stage(stage: str, detail: str = "") -> Iterator[None]:
+    """time a block of code as a stage of the request, the stage is also added
+    to the trace of the request when it is profiled
+
+    Args:
+        stage (str): stage name e.g. `SEARCH`
+        detail (str, optional): what the stage works on e.g. the search query.
+    """
+    started_at = perf_counter()
+    try:
+        yield
+    finally:
+        duration = perf_counter() - started_at
+        stage_latency.labels(stage=stage).observe(duration)
+        record_stage(stage, detail, started_at, duration)
+
+
+def count_cache_lookups(cache: str, hits: int, misses: int) -> None:
+    """count the hits and misses of a batch of cache lookups
+
+    Args:
+        cache (str): cache name e.g. "redis"
+        hits (int): number of hits
+        misses (int): number of misses
+    """
+    if hits:
+        cache_lookups.labels(cache=cache, result="hit").inc(hits)
+    if misses:
+        cache_lookups.labels(cache=cache, result="miss").inc(misses)
+
+
+class TimedORJSONResponse(ORJSONResponse):
+    """ORJSONResponse recording how long rendering the body takes
+
+    """
+
+    def render(self, content: Any) -> bytes:
+        with time_stage(SERIALIZE):
+            return super().render(content)
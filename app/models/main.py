@@ -1,7 +1,9 @@
-from pydantic import BaseModel
-from typing import List, Optional
+from pydantic import BaseModel, Field, PrivateAttr, field_validator
+from typing import Any, Dict, List, NamedTuple, Optional
 import enum
 
+from app.constants import TRACKS_PAGE_MAX_SIZE
+
 
 class PlaylistSource(enum.Enum):
     YOUTUBE = 'YOUTUBE'
@@ -29,6 +31,29 @@ class Track(BaseModel):
     spotify_search_query: str
     youtube_search_query: str
     platform: PlaylistSource
+    # normalized track used for matching, see `app.utils.fingerprint`
+    _fingerprint: Any = PrivateAttr(default=None)
+
+    def model_copy(self, *, update: Optional[Dict[str, Any]] = None, deep: bool = False) -> "Track":
+        copy = super().model_copy(update=update, deep=deep)
+        if update:
+            # the fingerprint of the original track may no longer match
+            copy._fingerprint = None
+        return copy
+
+    def __eq__(self, other: Any) -> bool:
+        # tracks are equal whether or not their fingerprint was built yet
+        if not isinstance(other, Track):
+            return NotImplemented
+        return self.__dict__ == other.__dict__
+
+
+class CachedSearch(NamedTuple):
+    """Cached outcome of a search"""
+    # best match, None when the search found nothing (negative entry)
+    track: Optional[Track]
+    # score of the match against the track it was searched for, None when unknown
+    similarity: Optional[float] = None
 
 
 class Playlist(BaseModel):
@@ -42,12 +67,154 @@ class Playlist(BaseModel):
     tracks: List[Track]
     platform: PlaylistSource
     similarity: Optional[float]
+    # version of the source playlist (spotify snapshot id)
+    snapshot_id: Optional[str] = None
+    # cursor of the next page of tracks, None on the last page
+    next_cursor: Optional[str] = None
+
+
+class ConversionResult(BaseModel):
+    """Cached conversion of a source playlist to another platform"""
+    # version of the source playlist that was converted
+    version: str
+    # key of each source track and the track it was matched to
+    source_keys: List[str]
+    matches: List[Optional[Track]]
+
+
+class TrackView(BaseModel):
+    """Track with only the fields a request asked for"""
+    id: Optional[str] = None
+    title: Optional[str] = None
+    url: Optional[str] = None
+    artists: Optional[str] = None
+    duration: Optional[int] = None
+    thumbnail: Optional[str] = None
+    album: Optional[str] = None
+    is_explicit: Optional[bool] = None
+    spotify_search_query: Optional[str] = None
+    youtube_search_query: Optional[str] = None
+    platform: Optional[PlaylistSource] = None
+
+
+class PlaylistPage(Playlist):
+    """Page of a playlist's tracks, with the track fields a request asked for"""
+    tracks: List[TrackView]
+
 
+class TrackFields(BaseModel):
+    """Track fields to respond with"""
+    # track fields to include, every field when not set
+    fields: Optional[List[str]] = None
 
-class GetPlaylist(BaseModel):
+    @field_validator("fields")
+    @classmethod
+    def check_fields(cls, fields: Optional[List[str]]) -> Optional[List[str]]:
+        if fields is not None:
+            unknown = [field for field in fields if field not in Track.model_fields]
+            if unknown:
+                raise ValueError(f"unknown track fields: {', '.join(unknown)}")
+        return fields
+
+
+class PlaylistView(TrackFields):
+    """Page of a playlist's tracks, and the track fields, to respond with"""
+    # `next_cursor` of the previous page, the first page when not set
+    cursor: Optional[str] = None
+    # tracks per page, every track when not set
+    limit: Optional[int] = Field(default=None, ge=1, le=TRACKS_PAGE_MAX_SIZE)
+
+
+class GetPlaylist(PlaylistView):
     url: str
 
 
-class GeneratePlaylist(BaseModel):
+class ConvertPlaylist(BaseModel):
     playlist_url: str
     convert_to: PlaylistSource
+    # search again for tracks that found no match or a low similarity one last time
+    retry_unmatched: bool = False
+
+
+class GeneratePlaylist(PlaylistView, ConvertPlaylist):
+    pass
+
+
+class GeneratePlaylistStream(TrackFields, ConvertPlaylist):
+    pass
+
+
+class GeneratePlaylists(BaseModel):
+    playlist_urls: List[str]
+    convert_to: PlaylistSource
+    retry_unmatched: bool = False
+
+
+class BatchPlaylistResult(BaseModel):
+    playlist_url: str
+    # converted playlist, None when the source playlist could not be fetched
+    playlist: Optional[Playlist] = None
+    error: Optional[str] = None
+
+
+class BatchConversion(BaseModel):
+    playlists: List[BatchPlaylistResult]
+    # distinct tracks across every playlist, each one was resolved once
+    unique_track_count: int
+
+
+class Prewarm(BaseModel):
+    playlist_urls: List[str]
+    # the other platform of each playlist when not set
+    convert_to: Optional[PlaylistSource] = None
+
+
+class PrewarmResult(BaseModel):
+    playlist_url: str
+    convert_to: Optional[PlaylistSource] = None
+    track_count: int = 0
+    # why the playlist could not be converted
+    error: Optional[str] = None
+
+
+class JobStatus(enum.Enum):
+    PENDING = 'PENDING'
+    RUNNING = 'RUNNING'
+    COMPLETED = 'COMPLETED'
+    FAILED = 'FAILED'
+
+
+class Job(BaseModel):
+    id: str
+    status: JobStatus
+    playlist_url: str
+    convert_to: PlaylistSource
+    retry_unmatched: bool = False
+    # number of source tracks, and how many of them were looked up so far
+    total: int = 0
+    resolved: int = 0
+    # converted playlist so far, complete once the job is COMPLETED
+    playlist: Optional[Playlist] = None
+    error: Optional[str] = None
+
+
+class TraceEvent(BaseModel):
+    stage: str
+    # what the stage worked on e.g. the search query
+    detail: str
+    # seconds since the start of the profile
+    start: float
+    duration: float
+
+
+class Profile(BaseModel):
+    id: str
+    name: str
+    # unix timestamp
+    started_at: float
+    duration: float
+    # call stack breakdown (cProfile), None when another profile was running
+    stats: Optional[str] = None
+    trace: List[TraceEvent] = []
+    # trace events dropped once the trace was full
+    dropped_events: int = 0
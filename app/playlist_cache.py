@@ -0,0 +1,46 @@
+from typing import Optional
+from redis.asyncio import Redis
+
+from app.codec import decode_playlist, encode_playlist
+from app.metrics import CACHE_GET, CACHE_SET, count_cache_lookups, time_stage
+from app.models.main import Playlist, PlaylistSource
+
+
+def get_playlist_cache_key(platform: PlaylistSource, playlist_id: str) -> str:
+    return f"playlist:{platform.value}:{playlist_id}"
+
+
+async def get_cached_playlist(cache: Redis, platform: PlaylistSource, playlist_id: str) -> Optional[Playlist]:
+    """get a previously fetched source playlist
+
+    Args:
+        cache (Redis): redis connection
+        platform (PlaylistSource): platform of the playlist
+        playlist_id (str): playlist id from the url
+
+    Returns:
+        Optional[Playlist]: cached playlist if any
+    """
+    with time_stage(CACHE_GET):
+        cached_playlist = await cache.get(get_playlist_cache_key(platform, playlist_id))
+    count_cache_lookups("playlist", int(cached_playlist is not None), int(cached_playlist is None))
+    if cached_playlist is None:
+        return None
+    return decode_playlist(cached_playlist)
+
+
+async def cache_playlist(cache: Redis, playlist_id: str, playlist: Playlist, expiry: int) -> None:
+    """cache a fetched source playlist
+
+    Args:
+        cache (Redis): redis connection
+        playlist_id (str): playlist id from the url
+        playlist (Playlist): parsed playlist
+        expiry (int): seconds to keep the playlist
+    """
+    with time_stage(CACHE_SET):
+        await cache.setex(
+            name=get_playlist_cache_key(playlist.platform, playlist_id),
+            time=expiry,
+            value=encode_playlist(playlist),
+        )
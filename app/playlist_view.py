@@ -0,0 +1,116 @@
+import base64
+import binascii
+from typing import Any, Dict, List, Optional
+
+import orjson
+
+from app.metrics import SERIALIZE, time_stage
+from app.models.main import Playlist, PlaylistView, Track
+
+
+class InvalidCursor(Exception):
+    """Exception raised when a page cursor can not be decoded
+
+    """
+
+    def __init__(self, message: str = "cursor is invalid") -> None:
+        self.message = message
+        super().__init__(self.message)
+
+
+class StaleCursor(InvalidCursor):
+    """Exception raised when the playlist changed since the cursor was handed out
+
+    """
+
+    def __init__(self) -> None:
+        super().__init__("playlist changed since the cursor was handed out, start from the first page")
+
+
+def encode_cursor(offset: int, version: str) -> str:
+    """encode the cursor of the page of a playlist starting at `offset`
+
+    Args:
+        offset (int): index of the first track of the page
+        version (str): version of the playlist, see `get_playlist_version`
+
+    Returns:
+        str: opaque url-safe cursor
+    """
+    return base64.urlsafe_b64encode(orjson.dumps([offset, version])).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, version: str) -> int:
+    """decode a page cursor
+
+    Args:
+        cursor (str): cursor from `encode_cursor`
+        version (str): current version of the playlist
+
+    Raises:
+        InvalidCursor: the cursor can not be decoded
+        StaleCursor: the cursor is from another version of the playlist
+
+    Returns:
+        int: index of the first track of the page
+    """
+    try:
+        offset, cursor_version = orjson.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (binascii.Error, orjson.JSONDecodeError, TypeError, ValueError):
+        raise InvalidCursor()
+    if not isinstance(offset, int) or offset < 0:
+        raise InvalidCursor()
+    if cursor_version != version:
+        raise StaleCursor()
+    return offset
+
+
+def get_page(playlist: Playlist, version: str, cursor: Optional[str], limit: Optional[int]) -> Playlist:
+    """get a page of the tracks of a playlist, `track_count` stays the number of tracks of
+    the whole playlist
+
+    Args:
+        playlist (Playlist): whole playlist
+        version (str): version of the playlist, cursors of other versions are stale
+        cursor (Optional[str]): cursor of the page, the first page when None
+        limit (Optional[int]): tracks per page, every track from the cursor on when None
+
+    Raises:
+        InvalidCursor: the cursor can not be decoded or is stale
+
+    Returns:
+        Playlist: the playlist with the tracks of the page and the cursor of the next one
+    """
+    offset = decode_cursor(cursor, version) if cursor is not None else 0
+    if offset == 0 and limit is None:
+        return playlist
+    end = len(playlist.tracks) if limit is None else offset + limit
+    return playlist.model_copy(update={
+        "tracks": playlist.tracks[offset:end],
+        "next_cursor": encode_cursor(end, version) if end < len(playlist.tracks) else None,
+    })
+
+
+def project_track(track: Track, fields: Optional[List[str]]) -> Dict[str, Any]:
+    return track.model_dump(mode="json", include=set(fields) if fields is not None else None)
+
+
+def render_playlist(playlist: Playlist, version: str, view: PlaylistView) -> Dict[str, Any]:
+    """render the page of a playlist and the track fields asked for by a request
+
+    Args:
+        playlist (Playlist): whole playlist
+        version (str): version of the playlist, see `get_page`
+        view (PlaylistView): page and track fields asked for
+
+    Raises:
+        InvalidCursor: the cursor can not be decoded or is stale
+
+    Returns:
+        Dict[str, Any]: JSON-serializable playlist
+    """
+    page = get_page(playlist, version, view.cursor, view.limit)
+    with time_stage(SERIALIZE, f"{len(page.tracks)} tracks"):
+        rendered = page.model_dump(mode="json", exclude={"tracks"})
+        rendered["tracks"] = [project_track(track, view.fields) for track in page.tracks]
+    return rendered
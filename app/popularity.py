@@ -0,0 +1,143 @@
+from typing import Dict, List, Optional, Tuple
+from redis.asyncio import Redis
+
+from app.codec import encode_track
+from app.constants import (
+    POPULARITY_BUFFER_SIZE,
+    POPULARITY_MAX_ENTRIES,
+    SONG_CACHE_EXPIRY,
+)
+from app.conversion_cache import get_conversion_cache_key
+from app.metrics import CACHE_SET, time_stage
+from app.models.main import Playlist, PlaylistSource, Track
+
+# kinds of cache entries whose accesses are counted
+SEARCHES = "searches"
+CONVERSIONS = "conversions"
+POPULARITY_KINDS = (SEARCHES, CONVERSIONS)
+
+
+def get_popularity_key(kind: str) -> str:
+    return f"popularity:{kind}"
+
+
+def get_search_member(query: str, platform: PlaylistSource) -> str:
+    return f"{platform.value}:{query}"
+
+
+def parse_search_member(member: str) -> Tuple[PlaylistSource, str]:
+    """split the popularity member of a search, see `get_search_member`
+
+    Args:
+        member (str): popularity member
+
+    Returns:
+        Tuple[PlaylistSource, str]: platform searched on and search query
+    """
+    platform, query = member.split(":", 1)
+    return PlaylistSource(platform), query
+
+
+def get_refresh_source_key(member: str) -> str:
+    return f"refresh:source:{member}"
+
+
+class AccessLog:
+    """Access counts of cache entries kept in memory until they are flushed to redis
+
+    Counting costs nothing on the request path, the refresher flushes the counts
+    to one sorted set per kind of entry in a single round-trip. Searches also keep
+    the track they were searched for, it is needed to search for them again.
+    """
+
+    def __init__(self, max_entries: int = POPULARITY_BUFFER_SIZE) -> None:
+        self.max_entries = max_entries
+        self.counts: Dict[Tuple[str, str], int] = {}
+        self.sources: Dict[str, Track] = {}
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    def add(self, kind: str, member: str) -> None:
+        key = (kind, member)
+        if key in self.counts:
+            self.counts[key] += 1
+        elif len(self.counts) < self.max_entries:
+            # accesses of new entries are dropped until the next flush once full
+            self.counts[key] = 1
+
+    def record_search(self, query: str, platform: PlaylistSource, source_track: Optional[Track] = None) -> None:
+        """count an access of a cached search that found a match
+
+        Args:
+            query (str): search query
+            platform (PlaylistSource): platform searched on
+            source_track (Optional[Track], optional): track the query was just searched for.
+        """
+        member = get_search_member(query, platform)
+        self.add(SEARCHES, member)
+        if source_track is not None and len(self.sources) < self.max_entries:
+            self.sources[member] = source_track
+
+    def record_conversion(self, playlist: Playlist, platform: PlaylistSource) -> None:
+        self.add(CONVERSIONS, get_conversion_cache_key(playlist, platform))
+
+    async def flush(self, cache: Redis) -> None:
+        """add the access counts to redis and reset them
+
+        Args:
+            cache (Redis): redis connection
+        """
+        counts, self.counts = self.counts, {}
+        sources, self.sources = self.sources, {}
+        pipeline = cache.pipeline(transaction=False)
+        for (kind, member), count in counts.items():
+            pipeline.zincrby(get_popularity_key(kind), count, member)
+        for member, source_track in sources.items():
+            # kept as long as the search it was searched for
+            pipeline.setex(get_refresh_source_key(member), SONG_CACHE_EXPIRY, encode_track(source_track))
+        if len(pipeline) > 0:
+            with time_stage(CACHE_SET, f"{len(pipeline)} commands"):
+                await pipeline.execute()
+
+
+async def get_popular(cache: Redis, kind: str, min_hits: float, count: int) -> List[str]:
+    """get the most accessed entries of a kind
+
+    Args:
+        cache (Redis): redis connection
+        kind (str): `SEARCHES` or `CONVERSIONS`
+        min_hits (float): fewest (decayed) accesses
+        count (int): most entries returned
+
+    Returns:
+        List[str]: popularity members, most accessed first
+    """
+    members = await cache.zrevrangebyscore(get_popularity_key(kind), "+inf", min_hits, start=0, num=count)
+    return [member.decode() if isinstance(member, bytes) else member for member in members]
+
+
+async def forget(cache: Redis, kind: str, member: str) -> None:
+    await cache.zrem(get_popularity_key(kind), member)
+
+
+async def decay_popularity(cache: Redis, max_entries: int = POPULARITY_MAX_ENTRIES) -> None:
+    """halve every access count so that entries no longer used stop being refreshed,
+    entries left with less than one access are dropped
+
+    Args:
+        cache (Redis): redis connection
+        max_entries (int, optional): most entries kept of each kind, the least
+            accessed ones are dropped.
+    """
+    pipeline = cache.pipeline(transaction=False)
+    for kind in POPULARITY_KINDS:
+        key = get_popularity_key(kind)
+        pipeline.zunionstore(key, {key: 0.5})
+        pipeline.zremrangebyscore(key, "-inf", "(1")
+        pipeline.zremrangebyrank(key, 0, -max_entries - 1)
+    with time_stage(CACHE_SET, f"{len(pipeline)} commands"):
+        await pipeline.execute()
+
+
+access_log = AccessLog()
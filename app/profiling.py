@@ -0,0 +1,153 @@
+import cProfile
+import io
+import pstats
+import random
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from hmac import compare_digest
+from time import perf_counter, time
+from typing import Deque, Iterator, List, Optional
+
+from app.constants import (
+    ADMIN_TOKEN,
+    PROFILE_BUFFER_SIZE,
+    PROFILE_MAX_EVENTS,
+    PROFILE_SAMPLE_RATE,
+    PROFILE_TOP_FUNCTIONS,
+)
+from app.models.main import Profile, TraceEvent
+
+# request header asking for a profile, its value must be the admin token
+PROFILE_HEADER = "X-Profile"
+
+
+class Recorder:
+    """Trace of the stages run while a profile is active
+
+    """
+
+    def __init__(self, name: str) -> None:
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.started_at = time()
+        self.perf_started_at = perf_counter()
+        self.trace: List[TraceEvent] = []
+        self.dropped_events = 0
+
+    def add(self, stage: str, detail: str, started_at: float, duration: float) -> None:
+        if len(self.trace) >= PROFILE_MAX_EVENTS:
+            self.dropped_events += 1
+            return
+        self.trace.append(TraceEvent(
+            stage=stage,
+            detail=detail,
+            start=started_at - self.perf_started_at,
+            duration=duration,
+        ))
+
+
+# profile of the current request, tasks started by the request inherit it
+active_recorder: ContextVar[Optional[Recorder]] = ContextVar(
+    "active_recorder", default=None)
+# latest profiles, oldest first
+profiles: Deque[Profile] = deque(maxlen=PROFILE_BUFFER_SIZE)
+# only one cProfile profiler can run at a time
+_profiler_running = False
+
+
+def is_admin_token(token: Optional[str]) -> bool:
+    """check a token against the admin token, always False without an admin token
+
+    Args:
+        token (Optional[str]): token sent by the client
+
+    Returns:
+        bool: True if the token is the admin token
+    """
+    # compare_digest raises on str with non-ASCII characters, bytes never do
+    return bool(ADMIN_TOKEN) and token is not None and compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+
+def should_profile(header: Optional[str], sample_rate: float = PROFILE_SAMPLE_RATE) -> bool:
+    """decide whether to profile a request
+
+    Args:
+        header (Optional[str]): value of the `X-Profile` header
+        sample_rate (float, optional): share of requests profiled anyway.
+
+    Returns:
+        bool: True if the request asked for a profile with the admin token or was sampled
+    """
+    return is_admin_token(header) or random.random() < sample_rate
+
+
+def record_stage(stage: str, detail: str, started_at: float, duration: float) -> None:
+    """add a stage to the trace of the active profile, if any
+
+    Args:
+        stage (str): stage name
+        detail (str): what the stage worked on
+        started_at (float): `perf_counter` when the stage started
+        duration (float): seconds the stage took
+    """
+    recorder = active_recorder.get()
+    if recorder is not None:
+        recorder.add(stage, detail, started_at, duration)
+
+
+@contextmanager
+def profile(name: str, enabled: bool = True) -> Iterator[Optional[Recorder]]:
+    """profile a block of code, keeping the result in the `profiles` ring buffer
+
+    cProfile profiles the whole thread, so calls of concurrent requests show up
+    in the call stack breakdown. The trace only holds the stages of this block.
+
+    Args:
+        name (str): name of the profiled operation e.g. "generate_playlist"
+        enabled (bool, optional): when False the block runs unprofiled.
+
+    Yields:
+        Optional[Recorder]: the trace recorder, None when not profiling
+    """
+    global _profiler_running
+    if not enabled:
+        yield None
+        return
+
+    recorder = Recorder(name)
+    token = active_recorder.set(recorder)
+    profiler: Optional[cProfile.Profile] = None
+    if not _profiler_running:
+        _profiler_running = True
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        yield recorder
+    finally:
+        stats = None
+        if profiler is not None:
+            profiler.disable()
+            _profiler_running = False
+            output = io.StringIO()
+            pstats.Stats(profiler, stream=output).sort_stats(
+                "cumulative").print_stats(PROFILE_TOP_FUNCTIONS)
+            stats = output.getvalue()
+        active_recorder.reset(token)
+        profiles.append(Profile(
+            id=recorder.id,
+            name=name,
+            started_at=recorder.started_at,
+            duration=perf_counter() - recorder.perf_started_at,
+            stats=stats,
+            trace=recorder.trace,
+            dropped_events=recorder.dropped_events,
+        ))
+
+
+def get_profile(profile_id: str) -> Optional[Profile]:
+    for stored_profile in profiles:
+        if stored_profile.id == profile_id:
+            return stored_profile
+    return None
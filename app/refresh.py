@@ -0,0 +1,281 @@
+"""Refresh popular cache entries before they expire and pre-warm the cache
+
+Usage: python -m app.refresh urls.txt [--convert-to SPOTIFY]
+"""
+import argparse
+import asyncio
+import logging
+import sys
+from typing import Dict, List, Optional, Union
+from redis.asyncio import Redis
+
+from app.codec import decode_track
+from app.constants import (
+    BATCH_PLAYLIST_CONCURRENCY,
+    CONVERSION_CACHE_EXPIRY,
+    POPULARITY_DECAY_INTERVAL,
+    REFRESH_AHEAD,
+    REFRESH_BATCH_SIZE,
+    REFRESH_IDLE_SHARE,
+    REFRESH_INTERVAL,
+    REFRESH_MIN_HITS,
+    SONG_CACHE_EXPIRY,
+)
+from app.conversion_cache import get_conversion_cache_key
+from app.dependencies import InvalidPlaylistUrl, PlaylistNotFound, create_redis, fetch_playlist_from_url
+from app.metrics import cache_refreshes, refresher_errors
+from app.models.main import Playlist, PlaylistSource, PrewarmResult
+from app.popularity import (
+    CONVERSIONS,
+    SEARCHES,
+    access_log,
+    decay_popularity,
+    forget,
+    get_popular,
+    get_popularity_key,
+    get_refresh_source_key,
+    parse_search_member,
+)
+from app.resolver import convert_playlists, convert_tracks, search_and_cache_track
+from app.services.cache import redis_pool
+from app.services.scheduler import UpstreamScheduler
+from app.services.spotify import spotify, spotify_scheduler
+from app.services.youtube import youtube_scheduler
+from app.utils.concurrency import gather_with_concurrency
+from app.utils.parser import get_playlist_url
+
+logger = logging.getLogger(__name__)
+
+schedulers: Dict[PlaylistSource, UpstreamScheduler] = {
+    PlaylistSource.SPOTIFY: spotify_scheduler,
+    PlaylistSource.YOUTUBE: youtube_scheduler,
+}
+
+
+def is_idle(*platforms: PlaylistSource) -> bool:
+    return all(schedulers[platform].is_idle(REFRESH_IDLE_SHARE) for platform in platforms)
+
+
+async def refresh_search(cache: Redis, member: str) -> bool:
+    """search again for a popular query, replacing its cached search
+
+    Args:
+        cache (Redis): redis connection
+        member (str): popularity member of the search
+
+    Returns:
+        bool: True if the search was refreshed, False if it was dropped from the
+            popular entries
+    """
+    platform, query = parse_search_member(member)
+    source_key = get_refresh_source_key(member)
+    cached_source = await cache.get(source_key)
+    source_track = decode_track(cached_source) if cached_source is not None else None
+    if source_track is None:
+        # searched before access counting started, or too long ago
+        await forget(cache, SEARCHES, member)
+        return False
+
+    track = await search_and_cache_track(cache, query, platform, source_track)
+    if track is None:
+        # the search now caches a negative entry, which is not refreshed
+        await forget(cache, SEARCHES, member)
+        return False
+    await cache.expire(source_key, SONG_CACHE_EXPIRY)
+    return True
+
+
+async def refresh_conversion(cache: Redis, member: str) -> bool:
+    """convert a popular playlist again, reusing its cached conversion while the
+    playlist is unchanged
+
+    Args:
+        cache (Redis): redis connection
+        member (str): popularity member of the conversion, its cache key
+
+    Returns:
+        bool: True if the conversion was refreshed, False if it was dropped from the
+            popular entries
+    """
+    _, source, playlist_id, convert_to = member.split(":")
+    try:
+        playlist = await fetch_playlist_from_url(get_playlist_url(PlaylistSource(source), playlist_id))
+    except (InvalidPlaylistUrl, PlaylistNotFound):
+        await forget(cache, CONVERSIONS, member)
+        return False
+    await convert_tracks(cache, playlist, PlaylistSource(convert_to))
+    # an unchanged conversion is not written again
+    await cache.expire(member, CONVERSION_CACHE_EXPIRY)
+    return True
+
+
+def get_platforms(kind: str, member: str) -> List[PlaylistSource]:
+    # upstreams called to refresh an entry
+    if kind == SEARCHES:
+        return [parse_search_member(member)[0]]
+    _, source, _, convert_to = member.split(":")
+    return [PlaylistSource(source), PlaylistSource(convert_to)]
+
+
+async def refresh_popular(
+    cache: Redis,
+    ahead: int = REFRESH_AHEAD,
+    min_hits: float = REFRESH_MIN_HITS,
+    batch_size: int = REFRESH_BATCH_SIZE,
+) -> int:
+    """refresh the popular cached conversions and searches that expire soon, one at
+    a time and only while the upstreams they call are idle
+
+    Conversions go first, refreshing one covers all of its tracks.
+
+    Args:
+        cache (Redis): redis connection
+        ahead (int, optional): refresh entries expiring within this many seconds.
+        min_hits (float, optional): fewest (decayed) accesses of a popular entry.
+        batch_size (int, optional): most popular entries of each kind looked at.
+
+    Returns:
+        int: number of entries refreshed
+    """
+    refreshed = 0
+    for kind, refresh in ((CONVERSIONS, refresh_conversion), (SEARCHES, refresh_search)):
+        members = await get_popular(cache, kind, min_hits, batch_size)
+        if len(members) == 0:
+            continue
+        pipeline = cache.pipeline(transaction=False)
+        for member in members:
+            pipeline.ttl(member if kind == CONVERSIONS else parse_search_member(member)[1])
+        ttls = await pipeline.execute()
+
+        for member, ttl in zip(members, ttls):
+            # -1: the entry does not expire, -2: it already expired
+            if ttl == -1 or ttl > ahead:
+                continue
+            if not is_idle(*get_platforms(kind, member)):
+                # the next refresh picks up where this one stopped
+                return refreshed
+            try:
+                result = "refreshed" if await refresh(cache, member) else "dropped"
+            except Exception:
+                # left for the next refresh
+                result = "failed"
+            cache_refreshes.labels(kind=kind, result=result).inc()
+            if result == "refreshed":
+                refreshed += 1
+    return refreshed
+
+
+async def refresh_once(cache: Redis, interval: float = REFRESH_INTERVAL) -> int:
+    """flush the access counts of this worker, then refresh popular entries unless
+    another worker already did within `interval`
+
+    Args:
+        cache (Redis): redis connection
+        interval (float, optional): seconds between two refreshes.
+
+    Returns:
+        int: number of entries refreshed
+    """
+    await access_log.flush(cache)
+    if not await cache.set("lock:refresh", 1, nx=True, px=int(interval * 1000)):
+        return 0
+    if await cache.set("lock:popularity-decay", 1, nx=True, px=POPULARITY_DECAY_INTERVAL * 1000):
+        await decay_popularity(cache)
+    return await refresh_popular(cache)
+
+
+async def run_refresher(interval: float = REFRESH_INTERVAL) -> None:
+    """refresh popular entries every `interval` seconds, until cancelled
+
+    A failed refresh is logged and counted, the next one runs as planned.
+
+    Args:
+        interval (float, optional): seconds between two refreshes.
+    """
+    cache = create_redis()
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await refresh_once(cache, interval)
+            except Exception:
+                # counts not flushed are lost
+                refresher_errors.inc()
+                logger.exception("cache refresh failed")
+    finally:
+        await cache.aclose()
+
+
+async def prewarm(
+    cache: Redis, playlist_urls: List[str], convert_to: Optional[PlaylistSource] = None
+) -> List[PrewarmResult]:
+    """convert playlists ahead of their first request and mark them popular, so that
+    they are refreshed before they expire while they keep being requested
+
+    Args:
+        cache (Redis): redis connection
+        playlist_urls (List[str]): playlists to convert
+        convert_to (Optional[PlaylistSource], optional): platform to convert the
+            playlists to, the other platform of each playlist by default.
+
+    Returns:
+        List[PrewarmResult]: outcome for each playlist
+    """
+    async def fetch(url: str) -> Union[Playlist, str]:
+        try:
+            return await fetch_playlist_from_url(url)
+        except InvalidPlaylistUrl:
+            return "playlist url is invalid"
+        except PlaylistNotFound:
+            return "playlist does not exist"
+        except Exception as e:
+            return str(e) or type(e).__name__
+
+    results = [PrewarmResult(playlist_url=url) for url in playlist_urls]
+    sources = await gather_with_concurrency(playlist_urls, fetch, BATCH_PLAYLIST_CONCURRENCY)
+    playlists_by_platform: Dict[PlaylistSource, List[Playlist]] = {}
+    for result, source in zip(results, sources):
+        if isinstance(source, str):
+            result.error = source
+            continue
+        target = convert_to or (PlaylistSource.YOUTUBE if source.platform == PlaylistSource.SPOTIFY
+                                else PlaylistSource.SPOTIFY)
+        if target == source.platform:
+            result.error = "playlist is already on that platform"
+            continue
+        result.convert_to = target
+        result.track_count = len(source.tracks)
+        playlists_by_platform.setdefault(target, []).append(source)
+
+    for platform, playlists in playlists_by_platform.items():
+        await convert_playlists(cache, playlists, platform)
+    # prewarmed playlists stay popular for a decay interval without being requested
+    popular = {get_conversion_cache_key(playlist, platform): 2 * REFRESH_MIN_HITS
+               for platform, playlists in playlists_by_platform.items()
+               for playlist in playlists if playlist.id}
+    if len(popular) > 0:
+        await cache.zadd(get_popularity_key(CONVERSIONS), popular, gt=True)
+    return results
+
+
+async def main(args: argparse.Namespace) -> None:
+    urls = [line.strip() for line in args.urls if line.strip()]
+    try:
+        for result in await prewarm(create_redis(), urls, args.convert_to):
+            print(result.model_dump_json())
+    finally:
+        await spotify.close()
+        await redis_pool.close()
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("urls", type=argparse.FileType("r"), nargs="?", default=sys.stdin,
+                        help="file with one playlist url per line, stdin by default")
+    parser.add_argument("--convert-to", type=PlaylistSource, choices=list(PlaylistSource), metavar="PLATFORM",
+                        help="platform to convert the playlists to, the other one by default")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
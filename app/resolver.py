@@ -0,0 +1,480 @@
+import asyncio
+from time import monotonic
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from redis.asyncio import Redis
+
+from app.constants import (
+    SEARCH_CANDIDATES,
+    SEARCH_CONCURRENCY,
+    SEARCH_LOCK_POLL_INTERVAL,
+    SEARCH_LOCK_TIMEOUT,
+    TRACK_MAP_MIN_SIMILARITY,
+)
+from app.popularity import access_log
+from app.metrics import PARSE, SCORE, SEARCH, searches_in_flight, time_stage, unmatched_searches
+from app.track_cache import cache_searches, get_cached_searches, track_memory_cache
+from app.track_index import track_index
+from app.track_map import get_mapped_tracks, map_tracks
+from app.utils.concurrency import iter_with_concurrency
+from app.utils.singleflight import SingleFlight
+from app.utils.scoring import best_match, score_pairs
+from app.utils.parse_track import calculate_similarity, get_search_query, parse_spotify_track_data, parse_youtube_track_data
+from app.conversion_cache import cache_conversion, get_cached_conversion, get_playlist_version, get_track_key
+from app.models.main import CachedSearch, ConversionResult, Playlist, PlaylistSource, Track
+from app.services.spotify import spotify
+from app.services import youtube
+
+
+async def search_track(query: str, platform: PlaylistSource, source_track: Optional[Track] = None) -> Optional[Track]:
+    """search for the best matching track on a platform
+
+    The top `SEARCH_CANDIDATES` results are scored against the source track at
+    once and the most similar one is picked, ties go to the higher ranked result.
+
+    Args:
+        query (str): search query
+        platform (PlaylistSource): platform to search on
+        source_track (Optional[Track], optional): track being matched, the first
+            search result is picked without it.
+
+    Returns:
+        Optional[Track]: best search result if any
+    """
+    candidates: List[Track] = []
+    match platform:
+        case PlaylistSource.SPOTIFY:
+            with time_stage(SEARCH, query):
+                search_result = await spotify.search(query, type="track", limit=SEARCH_CANDIDATES)
+            if search_result:
+                related_tracks = search_result.get("tracks").get("items")
+                with time_stage(PARSE, query):
+                    candidates = [parse_spotify_track_data(related_track)
+                                  for related_track in related_tracks]
+        case PlaylistSource.YOUTUBE:
+            with time_stage(SEARCH, query):
+                search_result = await youtube.search(query, "songs", limit=SEARCH_CANDIDATES)
+            if search_result:
+                # ytmusicapi may return more results than the limit
+                with time_stage(PARSE, query):
+                    candidates = [parse_youtube_track_data(related_track)
+                                  for related_track in search_result[:SEARCH_CANDIDATES]]
+    if len(candidates) == 0:
+        return None
+    if source_track is None:
+        return candidates[0]
+    with time_stage(SCORE, query):
+        return best_match(source_track, candidates).track
+
+
+def needs_retry(search: CachedSearch) -> bool:
+    """whether `retry_unmatched` searches for a query again
+
+    Args:
+        search (CachedSearch): cached search of the query
+
+    Returns:
+        bool: True if the search found nothing or a low similarity match
+    """
+    return search.track is None or (
+        search.similarity is not None and search.similarity < TRACK_MAP_MIN_SIMILARITY)
+
+
+async def wait_for_search(cache: Redis, query: str, lock_key: str, retry_unmatched: bool = False) -> Optional[CachedSearch]:
+    """wait for another worker holding the search lock of a query to cache its result
+
+    Args:
+        cache (Redis): redis connection
+        query (str): search query
+        lock_key (str): key of the search lock
+        retry_unmatched (bool, optional): the query is already cached and searched
+            again, only the search cached once the lock is released is new.
+
+    Returns:
+        Optional[CachedSearch]: the search cached by the other worker, None if the lock
+            was released or expired without a result
+    """
+    deadline = monotonic() + SEARCH_LOCK_TIMEOUT
+    while monotonic() < deadline:
+        await asyncio.sleep(SEARCH_LOCK_POLL_INTERVAL)
+        if not retry_unmatched:
+            cached_search = (await get_cached_searches(cache, [query]))[0]
+            if cached_search is not None:
+                return cached_search
+        if not await cache.exists(lock_key):
+            if retry_unmatched:
+                # the other worker's search replaced the one in memory
+                track_memory_cache.delete(query)
+                return (await get_cached_searches(cache, [query]))[0]
+            return None
+    return None
+
+
+async def search_and_cache_track(
+    cache: Redis, query: str, platform: PlaylistSource, source_track: Track, retry_unmatched: bool = False
+) -> Optional[Track]:
+    """search for a track and cache it along with its similarity, at most one worker searches
+    for a query at a time
+
+    The local track index is looked up first, see `TrackIndex.find`. Searches that
+    find nothing are cached too (negative entries), see `cache_searches`.
+
+    Args:
+        cache (Redis): redis connection
+        query (str): search query
+        platform (PlaylistSource): platform to search on
+        source_track (Track): track being matched
+        retry_unmatched (bool, optional): the query is searched again, see `needs_retry`.
+
+    Returns:
+        Optional[Track]: matching track if any
+    """
+    lock_key = f"lock:search:{platform.value}:{query}"
+    locked = await cache.set(lock_key, 1, nx=True, px=SEARCH_LOCK_TIMEOUT * 1000)
+    if not locked:
+        cached_search = await wait_for_search(cache, query, lock_key, retry_unmatched)
+        if cached_search is not None:
+            return cached_search.track
+
+    released = not locked
+    try:
+        track = await track_index.find(source_track, platform)
+        if track is None:
+            track = await search_track(query, platform, source_track)
+            if track is None:
+                unmatched_searches.labels(platform=platform.value).inc()
+            else:
+                track_index.add_later([track])
+        similarity = calculate_similarity(source_track, track) if track is not None else None
+        # the result must be cached before the lock is released for waiting workers to see it,
+        # a lock that expired and was taken by another worker may be deleted, which only costs
+        # a duplicate search
+        await cache_searches(cache, [(query, CachedSearch(track, similarity))],
+                             delete=[] if released else [lock_key])
+        released = True
+    finally:
+        if not released:
+            # the search failed, waiting workers stop waiting instead of timing out
+            await cache.delete(lock_key)
+    return track
+
+
+# searches in flight in this worker, keyed by platform, query and whether unmatched
+# queries are searched again
+search_flight: SingleFlight[Optional[Track]] = SingleFlight()
+searches_in_flight.set_function(lambda: len(search_flight))
+
+
+async def search_track_once(
+    cache: Redis, query: str, platform: PlaylistSource, source_track: Track, retry_unmatched: bool = False
+) -> Optional[Track]:
+    """search for a track, sharing one search with every concurrent caller of the same query
+
+    Callers that search unmatched queries again do not share the search of callers
+    that accept a cached negative entry, and the other way around.
+
+    Args:
+        cache (Redis): redis connection
+        query (str): search query
+        platform (PlaylistSource): platform to search on
+        source_track (Track): track being matched, the candidates are scored against
+            the track of the first caller of a shared search
+        retry_unmatched (bool, optional): the query is searched again, see `needs_retry`.
+
+    Returns:
+        Optional[Track]: matching track if any
+    """
+    return await search_flight.do(
+        f"{platform.value}:{retry_unmatched}:{query}",
+        lambda: search_and_cache_track(cache, query, platform, source_track, retry_unmatched))
+
+
+async def iter_resolved_tracks(
+    cache: Redis,
+    tracks: List[Track],
+    platform: PlaylistSource,
+    concurrency: int = SEARCH_CONCURRENCY,
+    retry_unmatched: bool = False,
+) -> AsyncIterator[Tuple[int, Optional[Track]]]:
+    """find the matching track of every track, yielding each one as soon as it is found
+
+    Tracks already matched before are taken from the track id index, every other
+    search query is looked up in the cache at once and only the cache misses are
+    searched for (concurrently), see `search_track_once`. Queries cached as not
+    found are not searched for again until their negative entry expires. New
+    matches are added to the track id index.
+
+    Args:
+        cache (Redis): redis connection
+        tracks (List[Track]): tracks from the source playlist
+        platform (PlaylistSource): platform to find the tracks on
+        concurrency (int, optional): maximum number of searches in flight.
+        retry_unmatched (bool, optional): search again for queries cached as not found
+            or with a low similarity match.
+
+    Yields:
+        Tuple[int, Optional[Track]]: index of the source track and its matching track
+    """
+    indexes_by_query: Dict[str, List[int]] = {}
+    mapped_tracks = await get_mapped_tracks(cache, tracks, platform)
+    for index, (track, mapped_track) in enumerate(zip(tracks, mapped_tracks)):
+        if mapped_track is not None:
+            yield index, mapped_track
+        else:
+            indexes_by_query.setdefault(
+                get_search_query(track, platform), []).append(index)
+
+    new_matches: List[Tuple[Track, Track]] = []
+    unique_queries = list(indexes_by_query)
+    cached_searches = await get_cached_searches(cache, unique_queries)
+    missed_queries: List[str] = []
+    for query, cached_search in zip(unique_queries, cached_searches):
+        if cached_search is None or (retry_unmatched and needs_retry(cached_search)):
+            missed_queries.append(query)
+        elif cached_search.track is None:
+            for index in indexes_by_query[query]:
+                yield index, None
+        else:
+            access_log.record_search(query, platform)
+            for index in indexes_by_query[query]:
+                new_matches.append((tracks[index], cached_search.track))
+                yield index, cached_search.track
+
+    async def search(query: str) -> Optional[Track]:
+        # tracks sharing a search query are matched against the first of them
+        source_track = tracks[indexes_by_query[query][0]]
+        return await search_track_once(cache, query, platform, source_track, retry_unmatched)
+
+    async for query_index, track in iter_with_concurrency(missed_queries, search, concurrency):
+        query = missed_queries[query_index]
+        if track is not None:
+            access_log.record_search(query, platform, tracks[indexes_by_query[query][0]])
+        for index in indexes_by_query[query]:
+            if track is not None:
+                new_matches.append((tracks[index], track))
+            yield index, track
+
+    await map_tracks(cache, new_matches)
+
+
+async def resolve_tracks(
+    cache: Redis,
+    tracks: List[Track],
+    platform: PlaylistSource,
+    concurrency: int = SEARCH_CONCURRENCY,
+    retry_unmatched: bool = False,
+) -> List[Optional[Track]]:
+    """find the matching track of every track, see `iter_resolved_tracks`
+
+    Args:
+        cache (Redis): redis connection
+        tracks (List[Track]): tracks from the source playlist
+        platform (PlaylistSource): platform to find the tracks on
+        concurrency (int, optional): maximum number of searches in flight.
+        retry_unmatched (bool, optional): search again for unmatched tracks.
+
+    Returns:
+        List[Optional[Track]]: matching tracks, in the same order as `tracks`
+    """
+    resolved_tracks: List[Optional[Track]] = [None] * len(tracks)
+    async for index, track in iter_resolved_tracks(cache, tracks, platform, concurrency, retry_unmatched):
+        resolved_tracks[index] = track
+    return resolved_tracks
+
+
+async def iter_converted_tracks(
+    cache: Redis, playlist: Playlist, platform: PlaylistSource, retry_unmatched: bool = False
+) -> AsyncIterator[Tuple[int, Optional[Track]]]:
+    """find the matching track of every track of a playlist, reusing its last conversion
+
+    The conversion is cached per source playlist and target platform. When the
+    source playlist is unchanged the cached matches are returned as is, otherwise
+    only the tracks that were not matched before are resolved.
+
+    Args:
+        cache (Redis): redis connection
+        playlist (Playlist): source playlist
+        platform (PlaylistSource): platform to convert the playlist to
+        retry_unmatched (bool, optional): resolve again the tracks that were not
+            matched or matched with a low similarity last time.
+
+    Yields:
+        Tuple[int, Optional[Track]]: index of the source track and its matching track
+    """
+    if not playlist.id:
+        async for index, track in iter_resolved_tracks(
+                cache, playlist.tracks, platform, retry_unmatched=retry_unmatched):
+            yield index, track
+        return
+
+    access_log.record_conversion(playlist, platform)
+    version = get_playlist_version(playlist)
+    source_keys = [get_track_key(track) for track in playlist.tracks]
+    conversion = await get_cached_conversion(cache, playlist, platform)
+    if conversion is not None and conversion.version == version and not retry_unmatched:
+        for index, track in enumerate(conversion.matches):
+            yield index, track
+        return
+
+    previous_matches: Dict[str, Track] = {}
+    if conversion is not None:
+        previous_matches = {key: track for key, track in zip(conversion.source_keys, conversion.matches)
+                            if track is not None}
+    if retry_unmatched:
+        sources = {key: track for key, track in zip(source_keys, playlist.tracks)}
+        previous_matches = {key: track for key, track in previous_matches.items()
+                            if key in sources
+                            and calculate_similarity(sources[key], track) >= TRACK_MAP_MIN_SIMILARITY}
+
+    matches: List[Optional[Track]] = [None] * len(source_keys)
+    new_indexes: List[int] = []
+    for index, key in enumerate(source_keys):
+        if key in previous_matches:
+            matches[index] = previous_matches[key]
+            yield index, matches[index]
+        else:
+            new_indexes.append(index)
+
+    new_tracks = [playlist.tracks[index] for index in new_indexes]
+    async for new_index, track in iter_resolved_tracks(
+            cache, new_tracks, platform, retry_unmatched=retry_unmatched):
+        matches[new_indexes[new_index]] = track
+        yield new_indexes[new_index], track
+
+    await cache_conversion(cache, playlist, platform, ConversionResult(
+        version=version,
+        source_keys=source_keys,
+        matches=matches,
+    ))
+
+
+async def convert_tracks(
+    cache: Redis, playlist: Playlist, platform: PlaylistSource, retry_unmatched: bool = False
+) -> List[Optional[Track]]:
+    """find the matching track of every track of a playlist, see `iter_converted_tracks`
+
+    Args:
+        cache (Redis): redis connection
+        playlist (Playlist): source playlist
+        platform (PlaylistSource): platform to convert the playlist to
+        retry_unmatched (bool, optional): resolve again the unmatched tracks.
+
+    Returns:
+        List[Optional[Track]]: matching tracks, in the same order as `playlist.tracks`
+    """
+    matches: List[Optional[Track]] = [None] * len(playlist.tracks)
+    async for index, track in iter_converted_tracks(cache, playlist, platform, retry_unmatched):
+        matches[index] = track
+    return matches
+
+
+async def convert_playlists(
+    cache: Redis, playlists: List[Playlist], platform: PlaylistSource, retry_unmatched: bool = False
+) -> Tuple[List[List[Optional[Track]]], int]:
+    """find the matching track of every track of several playlists, resolving tracks
+    found in more than one playlist once
+
+    Tracks are deduplicated by their search query on the target platform. The
+    conversion of each playlist is cached like `convert_tracks` does.
+
+    Args:
+        cache (Redis): redis connection
+        playlists (List[Playlist]): source playlists
+        platform (PlaylistSource): platform to convert the playlists to
+        retry_unmatched (bool, optional): search again for unmatched tracks.
+
+    Returns:
+        Tuple[List[List[Optional[Track]]], int]: matching tracks of each playlist, in
+            the same order as its tracks, and the number of distinct tracks
+    """
+    unique_tracks: Dict[str, Track] = {}
+    for playlist in playlists:
+        for track in playlist.tracks:
+            unique_tracks.setdefault(get_search_query(track, platform), track)
+
+    queries = list(unique_tracks)
+    resolved_tracks = await resolve_tracks(
+        cache, list(unique_tracks.values()), platform, retry_unmatched=retry_unmatched)
+    matches_by_query = dict(zip(queries, resolved_tracks))
+
+    conversions: List[List[Optional[Track]]] = []
+    for playlist in playlists:
+        matches = [matches_by_query[get_search_query(track, platform)]
+                   for track in playlist.tracks]
+        conversions.append(matches)
+        if playlist.id:
+            access_log.record_conversion(playlist, platform)
+            await cache_conversion(cache, playlist, platform, ConversionResult(
+                version=get_playlist_version(playlist),
+                source_keys=[get_track_key(track) for track in playlist.tracks],
+                matches=matches,
+            ))
+    return conversions, len(queries)
+
+
+class ConversionTotals:
+    """Running duration, track count and similarity of a converted playlist
+
+    """
+
+    def __init__(self) -> None:
+        self.duration = 0
+        self.track_count = 0
+        self.total_similarity = 0.0
+
+    def add(self, source_track: Track, track: Track, similarity: Optional[float] = None) -> None:
+        self.duration += track.duration
+        self.track_count += 1
+        if similarity is None:
+            similarity = calculate_similarity(source_track, track)
+        self.total_similarity += similarity
+
+    @property
+    def similarity(self) -> float:
+        """average similarity as a percentage
+
+        """
+        if self.track_count == 0:
+            return 0
+        return (self.total_similarity / self.track_count / 4) * 100
+
+
+def build_converted_playlist(
+    source_tracks: List[Track],
+    resolved_tracks: List[Optional[Track]],
+    platform: PlaylistSource,
+) -> Playlist:
+    """build the converted playlist from the resolved tracks
+
+    Args:
+        source_tracks (List[Track]): tracks from the source playlist
+        resolved_tracks (List[Optional[Track]]): matching track of each source track
+        platform (PlaylistSource): platform the playlist was converted to
+
+    Returns:
+        Playlist: converted playlist
+    """
+    pairs = [(gotten_track, track) for gotten_track, track in zip(source_tracks, resolved_tracks)
+             if track is not None]
+    # every pair is scored in one batch
+    with time_stage(SCORE, f"{len(pairs)} tracks"):
+        similarities = score_pairs([gotten_track for gotten_track, _ in pairs],
+                                   [track for _, track in pairs])
+
+    tracks: List[Track] = []
+    totals = ConversionTotals()
+    for (gotten_track, track), similarity in zip(pairs, similarities):
+        tracks.append(track)
+        totals.add(gotten_track, track, float(similarity))
+
+    return Playlist(
+        id="",
+        title="",
+        description="",
+        thumbnail="",
+        author="",
+        duration=totals.duration,
+        track_count=totals.track_count,
+        tracks=tracks,
+        platform=platform,
+        similarity=totals.similarity,
+    )
@@ -0,0 +1,68 @@
+import os
+from typing import Optional
+import redis.asyncio as redis
+
+from app.constants import (
+    REDIS_CONNECT_TIMEOUT,
+    REDIS_HEALTH_CHECK_INTERVAL,
+    REDIS_MAX_CONNECTIONS,
+    REDIS_SOCKET_TIMEOUT,
+)
+
+
+class RedisPool:
+    """Process-wide asyncio redis connection pool
+
+    The pool is opened on app startup and closed on shutdown, every redis client
+    handed out borrows its connections from it.
+    """
+
+    def __init__(self, url: Optional[str]) -> None:
+        self.url = url
+        self._pool: Optional[redis.ConnectionPool] = None
+
+    def open(self) -> redis.ConnectionPool:
+        """create the connection pool if it does not exist yet
+
+        Returns:
+            redis.ConnectionPool: connection pool
+        """
+        if self._pool is None:
+            self._pool = redis.ConnectionPool.from_url(
+                self.url or "redis://localhost:6379/0",
+                max_connections=REDIS_MAX_CONNECTIONS,
+                socket_timeout=REDIS_SOCKET_TIMEOUT,
+                socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+                health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+            )
+        return self._pool
+
+    def client(self) -> redis.Redis:
+        """get a redis client backed by the shared pool
+
+        Returns:
+            redis.Redis: redis client
+        """
+        return redis.Redis(connection_pool=self.open())
+
+    async def ping(self) -> bool:
+        """check that redis is reachable
+
+        Returns:
+            bool: True if redis answered the ping
+        """
+        try:
+            return bool(await self.client().ping())
+        except (redis.RedisError, OSError):
+            return False
+
+    async def close(self) -> None:
+        """disconnect every pooled connection
+
+        """
+        if self._pool is not None:
+            await self._pool.aclose()
+            self._pool = None
+
+
+redis_pool = RedisPool(os.getenv("REDIS_URL"))
@@ -0,0 +1,215 @@
+import asyncio
+import random
+from time import monotonic
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+from app.constants import UPSTREAM_MAX_RETRY_AFTER
+from app.metrics import upstream_concurrency, upstream_in_flight
+
+R = TypeVar("R")
+
+
+class TokenBucket:
+    """Token bucket limiting how many calls start per second
+
+    """
+
+    def __init__(self, rate: float, capacity: float, clock: Callable[[], float] = monotonic) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.updated_at = clock()
+
+    def _refill(self) -> None:
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens +
+                          (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_acquire(self) -> bool:
+        """take a token if one is available
+
+        Returns:
+            bool: True if a token was taken
+        """
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def available(self) -> float:
+        """number of tokens available right now
+
+        Returns:
+            float: available tokens
+        """
+        self._refill()
+        return self.tokens
+
+    async def acquire(self) -> None:
+        """wait for a token and take it
+
+        """
+        while not self.try_acquire():
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class UpstreamScheduler:
+    """Schedule calls to one upstream API without getting rate limited
+
+    Calls are started at most `rate` per second (token bucket) and only `window`
+    of them run at the same time. The window grows while calls succeed within
+    `target_latency` and shrinks when they get slow or fail with an error that
+    `get_retry_after` recognises as retryable. Those calls are retried with jittered
+    exponential backoff, honouring the upstream's Retry-After; a rate limited
+    response pauses every call to the upstream until then. Waits never exceed
+    `backoff_max`, and a Retry-After longer than `max_retry_after` fails the call
+    at once (pausing the upstream for `max_retry_after` only).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        rate: float,
+        burst: float,
+        get_retry_after: Callable[[Exception], Optional[float]],
+        min_concurrency: int = 1,
+        max_concurrency: int = 32,
+        initial_concurrency: int = 8,
+        target_latency: float = 1.0,
+        max_retries: int = 3,
+        backoff_base: float = 0.5,
+        backoff_max: float = 30.0,
+        max_retry_after: float = UPSTREAM_MAX_RETRY_AFTER,
+    ) -> None:
+        self.name = name
+        self.bucket = TokenBucket(rate, burst)
+        self.get_retry_after = get_retry_after
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.window = float(initial_concurrency)
+        self.target_latency = target_latency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_retry_after = max_retry_after
+
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self._condition = asyncio.Condition()
+
+        upstream_in_flight.labels(upstream=name).set_function(lambda: self.in_flight)
+        upstream_concurrency.labels(upstream=name).set_function(lambda: self.window)
+
+    def _on_success(self, latency: float) -> None:
+        if latency > self.target_latency:
+            self.window = max(self.min_concurrency, self.window * 0.9)
+        else:
+            self.window = min(self.max_concurrency,
+                              self.window + 1 / self.window)
+
+    def _on_error(self) -> None:
+        self.window = max(self.min_concurrency, self.window / 2)
+
+    def _backoff(self, attempt: int, retry_after: float) -> float:
+        backoff = max(retry_after, self.backoff_base * 2 ** attempt)
+        return min(self.backoff_max, backoff + random.uniform(0, self.backoff_base))
+
+    def _pause(self, delay: float) -> None:
+        # the upstream asked every client call to wait
+        self.paused_until = max(self.paused_until, monotonic() + delay)
+
+    async def _acquire_slot(self) -> None:
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.window))
+            self.in_flight += 1
+
+    async def _release_slot(self) -> None:
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    async def run(self, func: Callable[[], Awaitable[R]]) -> R:
+        """run a call to the upstream
+
+        Args:
+            func (Callable[[], Awaitable[R]]): coroutine function making the call
+
+        Returns:
+            R: result of the call
+        """
+        attempt = 0
+        while True:
+            pause = self.paused_until - monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+            await self.bucket.acquire()
+            await self._acquire_slot()
+            started_at = monotonic()
+            try:
+                result = await func()
+            except Exception as e:
+                retry_after = self.get_retry_after(e)
+                if retry_after is not None:
+                    # only throttling and overload shrink the window, not bad requests
+                    self._on_error()
+                if retry_after is None or attempt >= self.max_retries:
+                    raise
+                if retry_after > self.max_retry_after:
+                    # failing is better than holding every caller (and search lock) that long
+                    self._pause(self.max_retry_after)
+                    raise
+                delay = self._backoff(attempt, retry_after)
+                if retry_after > 0:
+                    self._pause(delay)
+                attempt += 1
+            else:
+                self._on_success(monotonic() - started_at)
+                return result
+            finally:
+                await self._release_slot()
+            await asyncio.sleep(delay)
+
+    def is_idle(self, share: float) -> bool:
+        """whether the upstream has spare capacity for background calls
+
+        Args:
+            share (float): share of the concurrency window that may be in flight
+
+        Returns:
+            bool: True if fewer calls than `share` of the window are in flight, the
+                upstream is not paused and a call can start right away
+        """
+        return (self.in_flight < self.window * share
+                and self.paused_until <= monotonic()
+                and self.bucket.available() >= 1)
+
+    def stats(self) -> Dict[str, float]:
+        """current concurrency window and calls in flight
+
+        Returns:
+            Dict[str, float]: scheduler state
+        """
+        return {
+            "window": self.window,
+            "in_flight": self.in_flight,
+            "tokens": self.bucket.tokens,
+            "paused_for": max(0.0, self.paused_until - monotonic()),
+        }
+
+
+def parse_retry_after(value: Optional[str]) -> float:
+    """parse a Retry-After header in seconds
+
+    Args:
+        value (Optional[str]): header value
+
+    Returns:
+        float: seconds to wait, 0 when missing or not a number of seconds
+    """
+    try:
+        return max(0.0, float(value or 0))
+    except ValueError:
+        return 0.0
@@ -1,11 +1,286 @@
 import os
-import spotipy as sp
-from spotipy.oauth2 import SpotifyClientCredentials
+import asyncio
+from importlib.util import find_spec
+from time import monotonic
+from typing import Any, AsyncIterator, Dict, List, Optional
 
-spotify_auth_manager = SpotifyClientCredentials(
+import httpx
+
+from app.constants import (
+    PLAYLIST_PAGE_CONCURRENCY,
+    SPOTIFY_MAX_CONNECTIONS,
+    SPOTIFY_MAX_KEEPALIVE_CONNECTIONS,
+    SPOTIFY_RATE_LIMIT,
+    SPOTIFY_TIMEOUT,
+    SPOTIFY_TOKEN_REFRESH_MARGIN,
+)
+from app.services.scheduler import UpstreamScheduler, parse_retry_after
+from app.utils.concurrency import iter_in_order_with_concurrency
+
+SPOTIFY_API_URL = "https://api.spotify.com/v1"
+SPOTIFY_TOKEN_URL = "https://accounts.spotify.com/api/token"
+# maximum number of items the playlist items endpoint returns per page
+SPOTIFY_PLAYLIST_PAGE_SIZE = 100
+# maximum number of ids the several tracks endpoint accepts
+SPOTIFY_TRACKS_BATCH_SIZE = 50
+
+
+class SpotifyException(Exception):
+    """Exception raised when the Spotify Web API returns an error
+
+    """
+
+    def __init__(self, http_status: int, msg: str, headers: Optional[Dict[str, str]] = None) -> None:
+        self.http_status = http_status
+        self.msg = msg
+        self.headers = headers or {}
+        super().__init__(f"http status: {http_status}, {msg}")
+
+
+def get_spotify_retry_after(error: Exception) -> Optional[float]:
+    """tell the scheduler whether a failed call can be retried
+
+    Args:
+        error (Exception): error raised by the call
+
+    Returns:
+        Optional[float]: seconds spotify asked to wait (Retry-After), None if the call must not be retried
+    """
+    if isinstance(error, SpotifyException):
+        if error.http_status == 429:
+            return parse_retry_after(error.headers.get("retry-after")) or 1.0
+        if error.http_status >= 500:
+            return 0.0
+        return None
+    if isinstance(error, httpx.TransportError):
+        return 0.0
+    return None
+
+
+class AsyncSpotify:
+    """Asyncio client for the Spotify Web API using the client credentials flow
+
+    A single pooled `httpx.AsyncClient` is kept for the life of the client, and the
+    access token is refreshed in the background shortly before it expires.
+    """
+
+    def __init__(
+        self,
+        client_id: Optional[str],
+        client_secret: Optional[str],
+        api_url: str = SPOTIFY_API_URL,
+        token_url: str = SPOTIFY_TOKEN_URL,
+        http2: Optional[bool] = None,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        scheduler: Optional[UpstreamScheduler] = None,
+    ) -> None:
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.api_url = api_url
+        self.token_url = token_url
+        # HTTP/2 needs the optional `h2` package
+        self.http2 = find_spec("h2") is not None if http2 is None else http2
+        self.transport = transport
+        self.scheduler = scheduler
+
+        self._client: Optional[httpx.AsyncClient] = None
+        self._token: Optional[str] = None
+        self._token_expires_at = 0.0
+        self._token_lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                http2=self.http2,
+                transport=self.transport,
+                timeout=SPOTIFY_TIMEOUT,
+                limits=httpx.Limits(
+                    max_connections=SPOTIFY_MAX_CONNECTIONS,
+                    max_keepalive_connections=SPOTIFY_MAX_KEEPALIVE_CONNECTIONS,
+                ),
+            )
+        return self._client
+
+    async def _fetch_token(self) -> None:
+        response = await self.client.post(
+            self.token_url,
+            data={"grant_type": "client_credentials"},
+            auth=(self.client_id or "", self.client_secret or ""),
+        )
+        if response.status_code != 200:
+            raise SpotifyException(
+                response.status_code, "could not get access token", dict(response.headers))
+        payload = response.json()
+        self._token = payload["access_token"]
+        self._token_expires_at = monotonic() + payload.get("expires_in", 3600)
+
+    async def _refresh_token_forever(self) -> None:
+        while True:
+            delay = self._token_expires_at - monotonic() - SPOTIFY_TOKEN_REFRESH_MARGIN
+            await asyncio.sleep(max(delay, 1))
+            try:
+                async with self._token_lock:
+                    await self._fetch_token()
+            except (httpx.HTTPError, SpotifyException):
+                # the next request will fetch a token itself
+                await asyncio.sleep(1)
+
+    async def get_token(self, force: bool = False) -> str:
+        """get a valid access token, fetching a new one when needed
+
+        Args:
+            force (bool, optional): fetch a new token even if the current one is valid.
+
+        Returns:
+            str: access token
+        """
+        async with self._token_lock:
+            if force or self._token is None or monotonic() >= self._token_expires_at:
+                await self._fetch_token()
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(
+                self._refresh_token_forever())
+        return self._token  # type: ignore
+
+    async def _get(self, path: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        params = {key: value for key, value in (params or {}).items()
+                  if value is not None}
+        if self.scheduler is None:
+            return await self._request(path, params)
+        return await self.scheduler.run(lambda: self._request(path, params))
+
+    async def _request(self, path: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        token = await self.get_token()
+        response = await self.client.get(
+            f"{self.api_url}/{path}", params=params, headers={"Authorization": f"Bearer {token}"})
+        if response.status_code == 401:
+            # token was revoked or expired early
+            token = await self.get_token(force=True)
+            response = await self.client.get(
+                f"{self.api_url}/{path}", params=params, headers={"Authorization": f"Bearer {token}"})
+        if response.status_code >= 400:
+            try:
+                msg = response.json().get("error", {}).get("message", "")
+            except ValueError:
+                msg = response.text
+            raise SpotifyException(
+                response.status_code, msg, dict(response.headers))
+        return response.json()
+
+    async def search(self, q: str, type: str = "track", limit: int = 10, offset: int = 0, market: Optional[str] = None) -> Dict[str, Any]:
+        """search for an item
+
+        Args:
+            q (str): search query
+            type (str, optional): comma separated item types e.g. "track".
+            limit (int, optional): number of items to return.
+            offset (int, optional): index of the first item to return.
+            market (Optional[str], optional): ISO 3166-1 alpha-2 country code.
+
+        Returns:
+            Dict[str, Any]: search result
+        """
+        return await self._get("search", {"q": q, "type": type, "limit": limit, "offset": offset, "market": market})
+
+    async def tracks(self, ids: List[str], market: Optional[str] = None) -> Dict[str, Any]:
+        """get several tracks by id
+
+        Args:
+            ids (List[str]): spotify track ids (max 50)
+            market (Optional[str], optional): ISO 3166-1 alpha-2 country code.
+
+        Returns:
+            Dict[str, Any]: tracks, null for ids that do not exist
+        """
+        return await self._get("tracks", {"ids": ",".join(ids), "market": market})
+
+    async def playlist(self, playlist_id: str, fields: Optional[str] = None, market: Optional[str] = None) -> Dict[str, Any]:
+        """get a playlist along with the first page of its items
+
+        Args:
+            playlist_id (str): spotify playlist id
+            fields (Optional[str], optional): fields filter e.g. "snapshot_id".
+            market (Optional[str], optional): ISO 3166-1 alpha-2 country code.
+
+        Returns:
+            Dict[str, Any]: playlist
+        """
+        return await self._get(f"playlists/{playlist_id}", {"fields": fields, "market": market})
+
+    async def playlist_items(
+        self,
+        playlist_id: str,
+        offset: int = 0,
+        limit: int = SPOTIFY_PLAYLIST_PAGE_SIZE,
+        fields: Optional[str] = None,
+        market: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """get one page of a playlist's items
+
+        Args:
+            playlist_id (str): spotify playlist id
+            offset (int, optional): index of the first item to return.
+            limit (int, optional): number of items to return (max 100).
+            fields (Optional[str], optional): fields filter.
+            market (Optional[str], optional): ISO 3166-1 alpha-2 country code.
+
+        Returns:
+            Dict[str, Any]: paging object of playlist items
+        """
+        return await self._get(
+            f"playlists/{playlist_id}/tracks",
+            {"offset": offset, "limit": limit, "fields": fields, "market": market},
+        )
+
+    async def iter_playlist_item_pages(
+        self,
+        playlist_id: str,
+        total: int,
+        start: int = SPOTIFY_PLAYLIST_PAGE_SIZE,
+        concurrency: int = PLAYLIST_PAGE_CONCURRENCY,
+    ) -> AsyncIterator[List[Dict[str, Any]]]:
+        """fetch the pages of a playlist's items concurrently, yielding them in order
+
+        Args:
+            playlist_id (str): spotify playlist id
+            total (int): total number of items in the playlist
+            start (int, optional): offset of the first item to fetch, usually the
+                size of the page returned along with the playlist.
+            concurrency (int, optional): maximum number of pages fetched at the same time.
+
+        Yields:
+            List[Dict[str, Any]]: items of each page
+        """
+        async def fetch_page(offset: int) -> List[Dict[str, Any]]:
+            page = await self.playlist_items(playlist_id, offset=offset)
+            return page.get("items") or []
+
+        offsets = range(start, total, SPOTIFY_PLAYLIST_PAGE_SIZE)
+        async for items in iter_in_order_with_concurrency(offsets, fetch_page, concurrency):
+            yield items
+
+    async def close(self) -> None:
+        """stop refreshing the token and close the connection pool
+
+        """
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+spotify_scheduler = UpstreamScheduler(
+    "spotify",
+    rate=SPOTIFY_RATE_LIMIT,
+    burst=SPOTIFY_RATE_LIMIT * 2,
+    get_retry_after=get_spotify_retry_after,
+)
+spotify = AsyncSpotify(
     client_id=os.getenv("SPOTIPY_CLIENT_ID"),
     client_secret=os.getenv("SPOTIPY_CLIENT_SECRET"),
+    scheduler=spotify_scheduler,
 )
-spotify = sp.Spotify(auth_manager=spotify_auth_manager)
-
-SpotifyException = sp.exceptions.SpotifyException
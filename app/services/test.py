@@ -0,0 +1,268 @@
+import asyncio
+import threading
+import time
+import unittest
+import unittest.mock
+from typing import Dict, List
+
+import httpx
+from starlette.concurrency import run_in_threadpool
+
+from app.services.cache import RedisPool
+from app.services.scheduler import TokenBucket, UpstreamScheduler
+from app.services.spotify import AsyncSpotify, SpotifyException, get_spotify_retry_after
+from app.services import youtube
+from app.services.youtube import get_youtube_retry_after
+
+
+class SpotifyStub:
+    """Local stand-in for the Spotify accounts and Web API servers
+
+    """
+
+    def __init__(self, total_items: int = 0) -> None:
+        self.total_items = total_items
+        self.token_requests = 0
+        self.requests: List[httpx.Request] = []
+        self.revoked_tokens: Dict[str, bool] = {}
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        if request.url.path == "/api/token":
+            self.token_requests += 1
+            return httpx.Response(200, json={
+                "access_token": f"token-{self.token_requests}",
+                "token_type": "Bearer",
+                "expires_in": 3600,
+            })
+
+        token = request.headers.get("Authorization", "").removeprefix("Bearer ")
+        if self.revoked_tokens.get(token):
+            return httpx.Response(401, json={"error": {"status": 401, "message": "The access token expired"}})
+
+        path = request.url.path.removeprefix("/v1/")
+        if path == "search":
+            return httpx.Response(200, json={"tracks": {"items": [{"name": request.url.params["q"]}]}})
+        if path == "playlists/missing":
+            return httpx.Response(404, json={"error": {"status": 404, "message": "Not found."}})
+        if path.endswith("/tracks"):
+            offset = int(request.url.params["offset"])
+            limit = int(request.url.params["limit"])
+            end = min(offset + limit, self.total_items)
+            return httpx.Response(200, json={
+                "items": [{"track": {"id": str(index)}} for index in range(offset, end)],
+                "total": self.total_items,
+                "next": None if end >= self.total_items else "next-page",
+            })
+        if path.startswith("playlists/"):
+            return httpx.Response(200, json={"id": path.split("/")[1], "snapshot_id": "snapshot"})
+        return httpx.Response(404)
+
+
+def create_stub_client(stub: SpotifyStub) -> AsyncSpotify:
+    return AsyncSpotify(
+        client_id="client",
+        client_secret="secret",
+        api_url="http://spotify.local/v1",
+        token_url="http://spotify.local/api/token",
+        http2=False,
+        transport=httpx.MockTransport(stub.handler),
+    )
+
+
+class TestAsyncSpotify(unittest.IsolatedAsyncioTestCase):
+    async def test_search_reuses_token(self):
+        stub = SpotifyStub()
+        spotify = create_stub_client(stub)
+        try:
+            first = await spotify.search("first", type="track", limit=1)
+            second = await spotify.search("second", type="track", limit=1)
+        finally:
+            await spotify.close()
+
+        self.assertEqual(first["tracks"]["items"][0]["name"], "first")
+        self.assertEqual(second["tracks"]["items"][0]["name"], "second")
+        self.assertEqual(stub.token_requests, 1)
+        self.assertEqual(stub.requests[-1].url.params["limit"], "1")
+
+    async def test_refreshes_revoked_token(self):
+        stub = SpotifyStub()
+        spotify = create_stub_client(stub)
+        try:
+            await spotify.get_token()
+            stub.revoked_tokens["token-1"] = True
+            playlist = await spotify.playlist("playlist_id", fields="snapshot_id")
+        finally:
+            await spotify.close()
+
+        self.assertEqual(playlist["snapshot_id"], "snapshot")
+        self.assertEqual(stub.token_requests, 2)
+
+    async def test_error_raises_spotify_exception(self):
+        stub = SpotifyStub()
+        spotify = create_stub_client(stub)
+        try:
+            with self.assertRaises(SpotifyException) as context:
+                await spotify.playlist("missing")
+        finally:
+            await spotify.close()
+
+        self.assertEqual(context.exception.http_status, 404)
+
+    async def test_playlist_item_pages_in_order(self):
+        stub = SpotifyStub(total_items=450)
+        spotify = create_stub_client(stub)
+        try:
+            pages = [page async for page in spotify.iter_playlist_item_pages(
+                "playlist_id", total=450, concurrency=2)]
+        finally:
+            await spotify.close()
+
+        self.assertEqual([len(page) for page in pages], [100, 100, 100, 50])
+        self.assertEqual([item["track"]["id"] for page in pages for item in page],
+                         [str(index) for index in range(100, 450)])
+
+
+class TestRedisPool(unittest.IsolatedAsyncioTestCase):
+    async def test_clients_share_one_pool(self):
+        pool = RedisPool("redis://127.0.0.1:1/0")
+        try:
+            self.assertIs(pool.client().connection_pool,
+                          pool.client().connection_pool)
+        finally:
+            await pool.close()
+
+    async def test_ping_unreachable_redis(self):
+        pool = RedisPool("redis://127.0.0.1:1/0")
+        try:
+            self.assertFalse(await pool.ping())
+        finally:
+            await pool.close()
+
+
+def create_scheduler(**kwargs) -> UpstreamScheduler:
+    options = {
+        "rate": 1000,
+        "burst": 1000,
+        "get_retry_after": get_spotify_retry_after,
+        "initial_concurrency": 4,
+        "backoff_base": 0.001,
+    }
+    options.update(kwargs)
+    return UpstreamScheduler("test", **options)
+
+
+class TestUpstreamScheduler(unittest.IsolatedAsyncioTestCase):
+    def test_token_bucket(self):
+        now = 0.0
+        bucket = TokenBucket(rate=2, capacity=2, clock=lambda: now)
+        self.assertTrue(bucket.try_acquire())
+        self.assertTrue(bucket.try_acquire())
+        self.assertFalse(bucket.try_acquire())
+        now = 0.5
+        self.assertTrue(bucket.try_acquire())
+        self.assertFalse(bucket.try_acquire())
+
+    async def test_retries_rate_limited_call(self):
+        scheduler = create_scheduler()
+        attempts = 0
+
+        async def call() -> str:
+            nonlocal attempts
+            attempts += 1
+            if attempts == 1:
+                raise SpotifyException(429, "rate limited", {"retry-after": "0.01"})
+            return "ok"
+
+        self.assertEqual(await scheduler.run(call), "ok")
+        self.assertEqual(attempts, 2)
+        # the failure halved the window
+        self.assertEqual(scheduler.window, 2.5)
+
+    async def test_long_retry_after_fails_at_once(self):
+        scheduler = create_scheduler(max_retry_after=1)
+        call = unittest.mock.AsyncMock(side_effect=SpotifyException(429, "rate limited", {"retry-after": "3600"}))
+
+        with self.assertRaises(SpotifyException):
+            await scheduler.run(call)
+        call.assert_awaited_once()
+        # the upstream is only paused for the longest wait allowed
+        self.assertLessEqual(scheduler.stats()["paused_for"], 1)
+
+    def test_backoff_is_capped(self):
+        scheduler = create_scheduler(backoff_max=2)
+        self.assertLessEqual(scheduler._backoff(10, 1), 2)
+        self.assertLessEqual(scheduler._backoff(0, 5), 2)
+
+    async def test_does_not_retry_client_errors(self):
+        scheduler = create_scheduler()
+        call = unittest.mock.AsyncMock(side_effect=SpotifyException(404, "not found"))
+
+        with self.assertRaises(SpotifyException):
+            await scheduler.run(call)
+        call.assert_awaited_once()
+        # a bad request says nothing about the upstream load
+        self.assertEqual(scheduler.window, 4)
+
+    async def test_window_limits_concurrency(self):
+        scheduler = create_scheduler(initial_concurrency=2, max_concurrency=2)
+        in_flight = 0
+        max_in_flight = 0
+
+        async def call() -> None:
+            nonlocal in_flight, max_in_flight
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+
+        await asyncio.gather(*(scheduler.run(call) for _ in range(6)))
+        self.assertEqual(max_in_flight, 2)
+
+    async def test_is_idle(self):
+        scheduler = create_scheduler(initial_concurrency=4)
+        started = asyncio.Event()
+        release = asyncio.Event()
+
+        async def call() -> None:
+            started.set()
+            await release.wait()
+
+        self.assertTrue(scheduler.is_idle(0.5))
+        calls = [asyncio.create_task(scheduler.run(call)) for _ in range(2)]
+        await started.wait()
+        await asyncio.sleep(0)
+        # half of the window is in flight
+        self.assertFalse(scheduler.is_idle(0.5))
+        self.assertTrue(scheduler.is_idle(1))
+        release.set()
+        await asyncio.gather(*calls)
+
+    def test_youtube_retry_after(self):
+        self.assertEqual(get_youtube_retry_after(
+            Exception("Server returned HTTP 429: Too Many Requests.\n")), 1.0)
+        self.assertEqual(get_youtube_retry_after(
+            Exception("Server returned HTTP 503: Unavailable.\n")), 0.0)
+        self.assertIsNone(get_youtube_retry_after(
+            Exception("Server returned HTTP 404: Not Found.\n")))
+
+
+class TestYoutube(unittest.IsolatedAsyncioTestCase):
+    async def test_client_is_created_once_off_the_event_loop(self):
+        loop_thread = threading.get_ident()
+        created_in: List[int] = []
+
+        def create_client() -> unittest.mock.Mock:
+            created_in.append(threading.get_ident())
+            time.sleep(0.05)
+            client = unittest.mock.Mock()
+            client.search.return_value = []
+            return client
+
+        with unittest.mock.patch("app.services.youtube.ytmusic", None), \
+                unittest.mock.patch("ytmusicapi.YTMusic", side_effect=create_client):
+            await asyncio.gather(youtube.search("query", "songs", 1),
+                                 run_in_threadpool(youtube.get_ytmusic))
+
+        self.assertEqual(len(created_in), 1)
+        self.assertNotEqual(created_in[0], loop_thread)
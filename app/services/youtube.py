@@ -1,3 +1,93 @@
-from ytmusicapi import YTMusic
+import re
+import threading
+from typing import TYPE_CHECKING, List, Optional
+from starlette.concurrency import run_in_threadpool
 
-ytmusic = YTMusic()
+from app.constants import YOUTUBE_RATE_LIMIT
+from app.services.scheduler import UpstreamScheduler
+
+if TYPE_CHECKING:
+    from ytmusicapi import YTMusic
+
+# created on first use (or by the startup warmup), importing ytmusicapi slows down cold starts
+ytmusic: Optional["YTMusic"] = None
+# the client is created from the threadpool, by searches and the warmup at once
+ytmusic_lock = threading.Lock()
+
+# ytmusicapi only reports the status code in the message of a plain Exception
+HTTP_STATUS_PATTERN = re.compile(r"Server returned HTTP (\d{3})")
+
+
+def get_youtube_retry_after(error: Exception) -> Optional[float]:
+    """tell the scheduler whether a failed call can be retried
+
+    Args:
+        error (Exception): error raised by the call
+
+    Returns:
+        Optional[float]: seconds to wait, None if the call must not be retried
+    """
+    match = HTTP_STATUS_PATTERN.search(str(error))
+    if match is None:
+        return None
+    status = int(match.group(1))
+    if status == 429:
+        # no Retry-After is exposed, pause every call for a second
+        return 1.0
+    if status >= 500:
+        return 0.0
+    return None
+
+
+def get_ytmusic() -> "YTMusic":
+    """get the youtube music client, creating it on first use
+
+    Blocking on first use, call it from the threadpool.
+
+    Returns:
+        YTMusic: youtube music client
+    """
+    global ytmusic
+    if ytmusic is None:
+        with ytmusic_lock:
+            if ytmusic is None:
+                from ytmusicapi import YTMusic
+                ytmusic = YTMusic()
+    return ytmusic
+
+
+youtube_scheduler = UpstreamScheduler(
+    "youtube",
+    rate=YOUTUBE_RATE_LIMIT,
+    burst=YOUTUBE_RATE_LIMIT * 2,
+    get_retry_after=get_youtube_retry_after,
+)
+
+
+async def search(query: str, filter: str, limit: int) -> List[dict]:
+    """search youtube music without blocking the event loop
+
+    Args:
+        query (str): search query
+        filter (str): result type e.g. "songs"
+        limit (int): number of results
+
+    Returns:
+        List[dict]: search results
+    """
+    return await youtube_scheduler.run(
+        lambda: run_in_threadpool(lambda: get_ytmusic().search(query, filter, limit=limit)))
+
+
+async def get_playlist(playlist_id: str, limit: Optional[int] = None) -> dict:
+    """get a youtube music playlist without blocking the event loop
+
+    Args:
+        playlist_id (str): youtube music playlist id
+        limit (Optional[int], optional): number of tracks, None follows every continuation.
+
+    Returns:
+        dict: playlist
+    """
+    return await youtube_scheduler.run(
+        lambda: run_in_threadpool(lambda: get_ytmusic().get_playlist(playlistId=playlist_id, limit=limit)))
@@ -0,0 +1,883 @@
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+from time import monotonic
+from typing import Dict, List, Optional
+from unittest.mock import AsyncMock, patch
+
+from fastapi.testclient import TestClient
+
+from app.codec import (
+    decode_conversion,
+    decode_playlist,
+    decode_search,
+    decode_track,
+    encode_conversion,
+    encode_playlist,
+    encode_search,
+    encode_track,
+)
+from app.constants import (
+    NEGATIVE_CACHE_EXPIRY,
+    REFRESH_MIN_HITS,
+    SEARCH_CANDIDATES,
+    SONG_CACHE_EXPIRY,
+    TRACK_MAP_EXPIRY,
+)
+from app.dependencies import create_redis, fetch_playlist_from_url
+from app.jobs import InMemoryJobStore, JobManager
+from app.main import app
+from app.dependencies import PlaylistNotFound
+from app.models.main import (
+    CachedSearch,
+    ConversionResult,
+    ConvertPlaylist,
+    JobStatus,
+    Playlist,
+    PlaylistSource,
+    Track,
+    TrackView,
+)
+from app.resolver import (
+    build_converted_playlist,
+    convert_tracks,
+    resolve_tracks,
+    search_and_cache_track,
+    search_track,
+    search_track_once,
+)
+from app.track_index import TrackIndex
+from app.track_cache import cache_searches, cache_tracks, get_cached_tracks, track_memory_cache
+from app.profiling import is_admin_token
+from app.popularity import CONVERSIONS, SEARCHES, AccessLog, decay_popularity, get_popularity_key
+from app.metrics import refresher_errors
+from app.refresh import prewarm, refresh_popular, run_refresher
+from app.services.spotify import SpotifyException
+from app.warmup import Warmup
+from app.compression import negotiate_encoding
+from app.utils.parse_track import parse_spotify_track_data, parse_youtube_track_data
+from app.testing import FakeRedis
+from app.utils.test import SPOTIFY_MOCK_TRACK, YOUTUBE_MOCK_TRACK
+
+
+class TestCodec(unittest.TestCase):
+    def setUp(self):
+        self.track = parse_spotify_track_data(SPOTIFY_MOCK_TRACK)
+        self.playlist = Playlist(
+            id="playlist_id", title="Playlist", description="", thumbnail="", author="owner",
+            duration=self.track.duration, track_count=1, tracks=[self.track],
+            platform=PlaylistSource.SPOTIFY, similarity=None, snapshot_id="snapshot",
+        )
+
+    def test_round_trip(self):
+        conversion = ConversionResult(
+            version="snapshot", source_keys=["a", "b"], matches=[self.track, None])
+
+        self.assertEqual(decode_track(encode_track(self.track)), self.track)
+        self.assertEqual(decode_playlist(encode_playlist(self.playlist)), self.playlist)
+        self.assertEqual(decode_conversion(encode_conversion(conversion)), conversion)
+        self.assertEqual(decode_track(encode_track(self.track)).platform, PlaylistSource.SPOTIFY)
+
+    def test_search_round_trip(self):
+        for search in [CachedSearch(self.track, 3.5), CachedSearch(self.track), CachedSearch(None)]:
+            self.assertEqual(decode_search(encode_search(search)), search)
+        # tracks cached before similarities were stored
+        self.assertEqual(decode_search(encode_track(self.track)), CachedSearch(self.track))
+        self.assertEqual(decode_search(self.track.model_dump_json()), CachedSearch(self.track))
+
+    def test_legacy_and_unknown_versions(self):
+        # values cached as JSON objects are still read
+        self.assertEqual(decode_track(self.track.model_dump_json()), self.track)
+        self.assertEqual(decode_playlist(self.playlist.model_dump_json().encode()), self.playlist)
+        # values of another codec version are cache misses
+        self.assertIsNone(decode_track(b'[0, "id"]'))
+
+
+class TestTrackCache(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        track_memory_cache.clear()
+
+    async def test_round_trip_in_one_call_each(self):
+        cache = FakeRedis()
+        spotify_track = parse_spotify_track_data(SPOTIFY_MOCK_TRACK)
+        youtube_track = parse_youtube_track_data(YOUTUBE_MOCK_TRACK)
+
+        await cache_tracks(cache, [("a", spotify_track), ("b", youtube_track)])
+        tracks = await get_cached_tracks(cache, ["a", "missing", "b"])
+
+        self.assertEqual(tracks, [spotify_track, None, youtube_track])
+        self.assertEqual(cache.calls, ["pipeline", "pipeline"])
+
+    async def test_memory_cache_in_front_of_redis(self):
+        cache = FakeRedis()
+        track = parse_spotify_track_data(SPOTIFY_MOCK_TRACK)
+        cache._setex("a", 60, track.model_dump_json())
+
+        self.assertEqual(await get_cached_tracks(cache, ["a"]), [track])
+        self.assertEqual(await get_cached_tracks(cache, ["a"]), [track])
+        # the second lookup never reaches redis
+        self.assertEqual(cache.calls, ["pipeline"])
+
+    async def test_memory_cache_expires_with_redis(self):
+        cache = FakeRedis()
+        track = parse_spotify_track_data(SPOTIFY_MOCK_TRACK)
+        cache._setex("a", 2, track.model_dump_json())
+
+        await get_cached_tracks(cache, ["a"])
+        expires_at, _ = track_memory_cache._entries["a"]
+        self.assertLessEqual(expires_at - monotonic(), 2)
+
+
+class TestResolver(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        track_memory_cache.clear()
+
+    async def test_only_misses_are_searched(self):
+        cache = FakeRedis()
+        source = parse_youtube_track_data(YOUTUBE_MOCK_TRACK)
+        other_source = source.model_copy(
+            update={"spotify_search_query": "unknown"})
+        cached = parse_spotify_track_data(SPOTIFY_MOCK_TRACK)
+        await cache_tracks(cache, [(source.spotify_search_query, cached)])
+        cache.calls.clear()
+
+        search = AsyncMock(return_value=None)
+        with patch("app.resolver.search_track", search):
+            tracks = await resolve_tracks(
+                cache, [source, other_source, source], PlaylistSource.SPOTIFY)
+
+        self.assertEqual(tracks, [cached, None, cached])
+        search.assert_awaited_once_with("unknown", PlaylistSource.SPOTIFY, other_source)
+        # the cached match is served from memory, only the miss reaches redis
+        self.assertEqual(cache.calls, ["mget", "pipeline", "set", "pipeline", "pipeline"])
+
+    async def test_unmatched_searches_are_cached(self):
+        cache = FakeRedis()
+        source = parse_youtube_track_data(YOUTUBE_MOCK_TRACK)
+        match = parse_spotify_track_data(SPOTIFY_MOCK_TRACK)
+
+        search = AsyncMock(return_value=None)
+        with patch("app.resolver.search_track", search):
+            self.assertEqual(await resolve_tracks(cache, [source], PlaylistSource.SPOTIFY), [None])
+            self.assertEqual(await resolve_tracks(cache, [source], PlaylistSource.SPOTIFY), [None])
+        search.assert_awaited_once()
+        self.assertEqual(cache.expiry[source.spotify_search_query], NEGATIVE_CACHE_EXPIRY)
+
+        search = AsyncMock(return_value=match)
+        with patch("app.resolver.search_track", search):
+            tracks = await resolve_tracks(
+                cache, [source], PlaylistSource.SPOTIFY, retry_unmatched=True)
+        self.assertEqual(tracks, [match])
+        search.assert_awaited_once()
+
+    async def test_low_similarity_matches_are_retried(self):
+        cache = FakeRedis()
+        source = parse_youtube_track_data(YOUTUBE_MOCK_TRACK)
+        match = parse_spotify_track_data(SPOTIFY_MOCK_TRACK)
+        await cache_searches(cache, [(source.spotify_search_query, CachedSearch(match, 0.5))])
+
+        search = AsyncMock(return_value=match)
+        with patch("app.resolver.search_track", search):
+            await resolve_tracks(cache, [source], PlaylistSource.SPOTIFY)
+            search.assert_not_awaited()
+            await resolve_tracks(cache, [source], PlaylistSource.SPOTIFY, retry_unmatched=True)
+        search.assert_awaited_once()
+
+    async def test_concurrent_searches_are_shared(self):
+        cache = FakeRedis()
+        source = parse_youtube_track_data(YOUTUBE_MOCK_TRACK)
+        match = parse_spotify_track_data(SPOTIFY_MOCK_TRACK)
+
+        async def search_track(query: str, platform: PlaylistSource, source_track: Track) -> Optional[Track]:
+            await asyncio.sleep(0.01)
+            return match
+
+        search = AsyncMock(side_effect=search_track)
+        with patch("app.resolver.search_track", search):
+            results = await asyncio.gather(
+                resolve_tracks(cache, [source], PlaylistSource.SPOTIFY),
+                resolve_tracks(cache, [source], PlaylistSource.SPOTIFY),
+            )
+
+        self.assertEqual(results, [[match], [match]])
+        search.assert_awaited_once()
+        # the search lock is released
+        self.assertEqual([key for key in cache.store if key.startswith("lock:")], [])
+
+    async def test_retries_do_not_join_normal_searches(self):
+        cache = FakeRedis()
+        source = parse_youtube_track_data(YOUTUBE_MOCK_TRACK)
+
+        async def search_and_cache_track(*args) -> Optional[Track]:
+            await asyncio.sleep(0.01)
+            return None
+
+        search = AsyncMock(side_effect=search_and_cache_track)
+        with patch("app.resolver.search_and_cache_track", search):
+            await asyncio.gather(*(
+                search_track_once(cache, source.spotify_search_query, PlaylistSource.SPOTIFY, source, retry)
+                for retry in (False, True, False)
+            ))
+        self.assertEqual(search.await_count, 2)
+
+    async def test_waits_for_search_locked_by_another_worker(self):
+        cache = FakeRedis()
+        source = parse_youtube_track_data(YOUTUBE_MOCK_TRACK)
+        match = parse_spotify_track_data(SPOTIFY_MOCK_TRACK)
+        query = source.spotify_search_query
+        await cache.set(f"lock:search:SPOTIFY:{query}", 1, nx=True)
+
+        async def other_worker():
+            await asyncio.sleep(0.1)
+            cache._setex(query, 60, match.model_dump_json())
+            cache._delete(f"lock:search:SPOTIFY:{query}")
+
+        search = AsyncMock(return_value=None)
+        with patch("app.resolver.search_track", search):
+            tracks, _ = await asyncio.gather(
+                resolve_tracks(cache, [source], PlaylistSource.SPOTIFY),
+                other_worker(),
+            )
+
+        self.assertEqual(tracks, [match])
+        search.assert_not_awaited()
+
+    async def test_failed_search_releases_lock(self):
+        cache = FakeRedis()
+        source = parse_youtube_track_data(YOUTUBE_MOCK_TRACK)
+
+        search = AsyncMock(side_effect=RuntimeError("upstream error"))
+        with patch("app.resolver.search_track", search):
+            with self.assertRaises(RuntimeError):
+                await search_and_cache_track(cache, source.spotify_search_query, PlaylistSource.SPOTIFY, source)
+
+        self.assertEqual(list(cache.store), [])
+
+    async def test_search_picks_most_similar_candidate(self):
+        source = parse_spotify_track_data(SPOTIFY_MOCK_TRACK)
+        other = {**SPOTIFY_MOCK_TRACK, "id": "other", "name": "Other"}
+
+        search = AsyncMock(return_value={"tracks": {"items": [other, SPOTIFY_MOCK_TRACK]}})
+        with patch("app.resolver.spotify.search", search):
+            track = await search_track(source.spotify_search_query, PlaylistSource.SPOTIFY, source)
+
+        self.assertEqual(track, source)
+        self.assertEqual(search.await_args.kwargs["limit"], SEARCH_CANDIDATES)
+
+    def test_build_converted_playlist(self):
+        source = parse_youtube_track_data(YOUTUBE_MOCK_TRACK)
+        found = parse_spotify_track_data(SPOTIFY_MOCK_TRACK)
+
+        playlist = build_converted_playlist(
+            [source, source], [found, None], PlaylistSource.SPOTIFY)
+
+        self.assertEqual(playlist.tracks, [found])
+        self.assertEqual(playlist.track_count, 1)
+        self.assertEqual(playlist.duration, found.duration)
+        self.assertEqual(playlist.similarity, (0.5 / 4) * 100)
+
+
+def create_spotify_playlist(snapshot_id: str) -> dict:
+    return {
+        "id": "playlist_id",
+        "name": "Playlist",
+        "description": "",
+        "images": [{"url": ""}],
+        "owner": {"display_name": "owner"},
+        "snapshot_id": snapshot_id,
+        "tracks": {"items": [{"track": SPOTIFY_MOCK_TRACK}], "total": 1},
+    }
+
+
+class TestTrackMap(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        track_memory_cache.clear()
+
+    def forget_searches(self, cache: FakeRedis) -> None:
+        # only the track id index is left
+        for key in [key for key in cache.store if not key.startswith("trackmap:")]:
+            del cache.store[key]
+        track_memory_cache.clear()
+
+    async def resolve_twice(self, source: Track, match: Track, platform: PlaylistSource) -> List[Optional[Track]]:
+        cache = FakeRedis()
+        with patch("app.resolver.search_track", AsyncMock(return_value=match)):
+            await resolve_tracks(cache, [source], platform)
+        self.forget_searches(cache)
+        # the mappings expire
+        self.assertTrue(all(cache.expiry[key] == TRACK_MAP_EXPIRY for key in cache.store))
+        search = AsyncMock(return_value=None)
+        with patch("app.resolver.search_track", search):
+            tracks = await resolve_tracks(cache, [source], platform)
+        search.assert_not_awaited()
+        return tracks
+
+    async def test_known_youtube_track(self):
+        source = parse_spotify_track_data(SPOTIFY_MOCK_TRACK)
+        match = parse_youtube_track_data(YOUTUBE_MOCK_TRACK).model_copy(
+            update={"title": source.title, "album": source.album, "artists": source.artists})
+
+        self.assertEqual(await self.resolve_twice(source, match, PlaylistSource.YOUTUBE), [match])
+
+    async def test_known_spotify_track_fetched_in_bulk(self):
+        source = parse_youtube_track_data(YOUTUBE_MOCK_TRACK)
+        match = parse_spotify_track_data({**SPOTIFY_MOCK_TRACK, "name": source.title,
+                                          "album": {**SPOTIFY_MOCK_TRACK["album"], "name": source.album}})
+
+        tracks = AsyncMock(return_value={"tracks": [SPOTIFY_MOCK_TRACK]})
+        with patch("app.track_map.spotify.tracks", tracks):
+            self.assertEqual(
+                (await self.resolve_twice(source, match, PlaylistSource.SPOTIFY))[0].id, match.id)
+        tracks.assert_awaited_once_with([match.id])
+
+    async def test_known_spotify_track_cached_search_is_not_fetched(self):
+        cache = FakeRedis()
+        source = parse_youtube_track_data(YOUTUBE_MOCK_TRACK)
+        match = parse_spotify_track_data(SPOTIFY_MOCK_TRACK)
+        with patch("app.resolver.search_track", AsyncMock(return_value=match)):
+            await resolve_tracks(cache, [source], PlaylistSource.SPOTIFY)
+
+        tracks = AsyncMock()
+        with patch("app.track_map.spotify.tracks", tracks):
+            self.assertEqual(await resolve_tracks(cache, [source], PlaylistSource.SPOTIFY), [match])
+        tracks.assert_not_awaited()
+
+    async def test_failed_bulk_fetch_falls_back_to_search(self):
+        cache = FakeRedis()
+        source = parse_youtube_track_data(YOUTUBE_MOCK_TRACK)
+        match = parse_spotify_track_data(SPOTIFY_MOCK_TRACK)
+        with patch("app.resolver.search_track", AsyncMock(return_value=match)):
+            await resolve_tracks(cache, [source], PlaylistSource.SPOTIFY)
+        self.forget_searches(cache)
+
+        search = AsyncMock(return_value=match)
+        with patch("app.track_map.spotify.tracks", AsyncMock(side_effect=SpotifyException(503, "unavailable"))), \
+                patch("app.resolver.search_track", search):
+            self.assertEqual(await resolve_tracks(cache, [source], PlaylistSource.SPOTIFY), [match])
+        search.assert_awaited_once()
+
+
+class TestConversionCache(unittest.IsolatedAsyncioTestCase):
+    async def test_only_added_tracks_are_resolved(self):
+        cache = FakeRedis()
+        first = parse_spotify_track_data(SPOTIFY_MOCK_TRACK)
+        second = first.model_copy(update={"id": "second"})
+        match = parse_youtube_track_data(YOUTUBE_MOCK_TRACK)
+        playlist = Playlist(
+            id="playlist_id", title="", description="", thumbnail="", author="",
+            duration=0, track_count=1, tracks=[first], platform=PlaylistSource.SPOTIFY,
+            similarity=0, snapshot_id="first",
+        )
+
+        resolved: List[List[Track]] = []
+
+        async def iter_resolved_tracks(cache, tracks: List[Track], platform: PlaylistSource,
+                                       retry_unmatched: bool = False):
+            resolved.append(tracks)
+            for index in range(len(tracks)):
+                yield index, match
+
+        with patch("app.resolver.iter_resolved_tracks", iter_resolved_tracks):
+            self.assertEqual(await convert_tracks(cache, playlist, PlaylistSource.YOUTUBE), [match])
+            self.assertEqual(await convert_tracks(cache, playlist, PlaylistSource.YOUTUBE), [match])
+            playlist = playlist.model_copy(
+                update={"tracks": [first, second], "snapshot_id": "second"})
+            self.assertEqual(await convert_tracks(cache, playlist, PlaylistSource.YOUTUBE), [match, match])
+
+        self.assertEqual(resolved, [[first], [second]])
+
+
+class TestPlaylistCache(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        track_memory_cache.clear()
+
+    async def test_spotify_playlist_revalidated_with_snapshot(self):
+        cache = FakeRedis()
+        snapshot_id = "first"
+
+        async def playlist(playlist_id: str, fields: Optional[str] = None) -> dict:
+            if fields == "snapshot_id":
+                return {"snapshot_id": snapshot_id}
+            return create_spotify_playlist(snapshot_id)
+
+        async def iter_playlist_item_pages(playlist_id: str, total: int, start: int):
+            # the whole playlist fits in the first page
+            for _ in range(start, total):
+                yield []
+
+        spotify = AsyncMock()
+        spotify.playlist.side_effect = playlist
+        spotify.iter_playlist_item_pages = iter_playlist_item_pages
+        url = "https://open.spotify.com/playlist/playlist_id"
+        with patch("app.dependencies.spotify", spotify), \
+                patch("app.dependencies.create_redis", return_value=cache):
+            first = await fetch_playlist_from_url(url)
+            second = await fetch_playlist_from_url(url)
+            snapshot_id = "second"
+            third = await fetch_playlist_from_url(url)
+
+        self.assertEqual(first, second)
+        self.assertEqual(third.snapshot_id, "second")
+        fields = [call.kwargs.get("fields")
+                  for call in spotify.playlist.await_args_list]
+        self.assertEqual(fields, [None, "snapshot_id", "snapshot_id", None])
+
+
+class TestGeneratePlaylistStream(unittest.TestCase):
+    def setUp(self):
+        track_memory_cache.clear()
+        cache = FakeRedis()
+        app.dependency_overrides[create_redis] = lambda: cache
+
+    def tearDown(self):
+        app.dependency_overrides.clear()
+
+    def test_streams_tracks_then_summary(self):
+        source = parse_youtube_track_data(YOUTUBE_MOCK_TRACK)
+        match = parse_spotify_track_data(SPOTIFY_MOCK_TRACK)
+        playlist = Playlist(
+            id="", title="", description="", thumbnail="", author="",
+            duration=0, track_count=2, tracks=[source, source.model_copy(update={"spotify_search_query": "unknown"})],
+            platform=PlaylistSource.YOUTUBE, similarity=0,
+        )
+
+        async def search_track(query: str, platform: PlaylistSource, source_track: Track) -> Optional[Track]:
+            return None if query == "unknown" else match
+
+        with patch("app.main.fetch_playlist_from_url", AsyncMock(return_value=playlist)), \
+                patch("app.resolver.search_track", search_track):
+            response = TestClient(app).post("/generate-playlist/stream", json={
+                "playlist_url": "https://music.youtube.com/playlist?list=playlist_id",
+                "convert_to": "SPOTIFY",
+            })
+
+        self.assertEqual(response.status_code, 200)
+        records = [json.loads(line) for line in response.text.splitlines()]
+        tracks = sorted(records[:-1], key=lambda record: record["index"])
+        self.assertEqual([record["track"] and record["track"]["id"] for record in tracks],
+                         [match.id, None])
+        self.assertEqual(records[-1], {
+            "type": "summary",
+            "platform": "SPOTIFY",
+            "duration": match.duration,
+            "track_count": 1,
+            "similarity": (0.5 / 4) * 100,
+        })
+
+
+class TestJobs(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        track_memory_cache.clear()
+
+    async def run_job(self, fetch_playlist: AsyncMock):
+        manager = JobManager(InMemoryJobStore(), workers=2)
+        manager.start()
+        match = parse_spotify_track_data(SPOTIFY_MOCK_TRACK)
+        try:
+            with patch("app.jobs.fetch_playlist_from_url", fetch_playlist), \
+                    patch("app.jobs.create_redis", return_value=FakeRedis()), \
+                    patch("app.resolver.search_track", AsyncMock(return_value=match)):
+                job = await manager.submit(ConvertPlaylist(
+                    playlist_url="https://music.youtube.com/playlist?list=playlist_id",
+                    convert_to=PlaylistSource.SPOTIFY,
+                ))
+                self.assertEqual(job.status, JobStatus.PENDING)
+                await manager._queue.join()
+        finally:
+            await manager.stop()
+        return await manager.store.get(job.id)
+
+    async def test_job_completes(self):
+        source = parse_youtube_track_data(YOUTUBE_MOCK_TRACK)
+        playlist = Playlist(
+            id="", title="", description="", thumbnail="", author="",
+            duration=0, track_count=1, tracks=[source], platform=PlaylistSource.YOUTUBE,
+            similarity=0,
+        )
+
+        job = await self.run_job(AsyncMock(return_value=playlist))
+
+        self.assertEqual(job.status, JobStatus.COMPLETED)
+        self.assertEqual((job.total, job.resolved), (1, 1))
+        self.assertEqual(job.playlist.track_count, 1)
+
+    async def test_job_fails(self):
+        job = await self.run_job(AsyncMock(
+            side_effect=PlaylistNotFound(PlaylistSource.YOUTUBE)))
+
+        self.assertEqual(job.status, JobStatus.FAILED)
+        self.assertEqual(job.error, "Playlist not found on PlaylistSource.YOUTUBE")
+
+    async def test_unfinished_jobs_fail_on_stop(self):
+        manager = JobManager(InMemoryJobStore(), workers=1)
+        manager.start()
+        data = ConvertPlaylist(
+            playlist_url="https://music.youtube.com/playlist?list=playlist_id",
+            convert_to=PlaylistSource.SPOTIFY,
+        )
+        async def fetch_forever(playlist_url: str) -> Playlist:
+            await asyncio.Event().wait()
+
+        with patch("app.jobs.fetch_playlist_from_url", fetch_forever), \
+                patch("app.jobs.create_redis", return_value=FakeRedis()):
+            running = await manager.submit(data)
+            queued = await manager.submit(data)
+            await asyncio.sleep(0.01)
+            await manager.stop()
+
+        for job in (running, queued):
+            job = await manager.store.get(job.id)
+            self.assertEqual(job.status, JobStatus.FAILED)
+            self.assertIn("interrupted", job.error)
+
+
+class TestMetrics(unittest.TestCase):
+    def test_request_and_stage_metrics(self):
+        client = TestClient(app)
+        client.get("/")
+        with patch("app.resolver.spotify.search", AsyncMock(return_value={"tracks": {"items": []}})):
+            asyncio.run(search_track("query", PlaylistSource.SPOTIFY))
+
+        response = client.get("/metrics")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('http_request_duration_seconds_count{method="GET",route="/",status="200"}',
+                      response.text)
+        self.assertIn('stage_duration_seconds_count{stage="search"}', response.text)
+        self.assertIn("http_requests_in_flight 1.0", response.text)
+
+
+class TestProfiling(unittest.TestCase):
+    def setUp(self):
+        track_memory_cache.clear()
+        cache = FakeRedis()
+        app.dependency_overrides[create_redis] = lambda: cache
+
+    def tearDown(self):
+        app.dependency_overrides.clear()
+
+    def test_profile_is_opt_in_and_readable_by_admins(self):
+        source = parse_youtube_track_data(YOUTUBE_MOCK_TRACK)
+        playlist = Playlist(
+            id="", title="", description="", thumbnail="", author="",
+            duration=0, track_count=1, tracks=[source],
+            platform=PlaylistSource.YOUTUBE, similarity=0,
+        )
+        body = {
+            "playlist_url": "https://music.youtube.com/playlist?list=playlist_id",
+            "convert_to": "SPOTIFY",
+        }
+        client = TestClient(app)
+
+        with patch("app.profiling.ADMIN_TOKEN", "secret"), \
+                patch("app.main.fetch_playlist_from_url", AsyncMock(return_value=playlist)), \
+                patch("app.resolver.spotify.search", AsyncMock(return_value={"tracks": {"items": [SPOTIFY_MOCK_TRACK]}})):
+            profiled = client.post("/generate-playlist", json=body,
+                                   headers={"X-Profile": "secret"})
+            unprofiled = client.post("/generate-playlist", json=body)
+            forbidden = client.get("/admin/profiles")
+            listed = client.get("/admin/profiles", headers={"X-Admin-Token": "secret"})
+            read = client.get(f"/admin/profiles/{profiled.headers['X-Profile-Id']}",
+                              headers={"X-Admin-Token": "secret"})
+
+        self.assertNotIn("X-Profile-Id", unprofiled.headers)
+        self.assertEqual(forbidden.status_code, 403)
+        self.assertEqual(listed.json()[0]["id"], profiled.headers["X-Profile-Id"])
+        profile = read.json()
+        self.assertEqual(profile["name"], "generate_playlist")
+        self.assertIn("cumulative", profile["stats"])
+        self.assertEqual([event["stage"] for event in profile["trace"]
+                          if event["detail"] == source.spotify_search_query], ["search", "parse", "score"])
+
+    def test_non_ascii_tokens_are_rejected(self):
+        client = TestClient(app)
+        with patch("app.profiling.ADMIN_TOKEN", "secret"):
+            response = client.get("/admin/profiles", headers={"X-Admin-Token": "café".encode()})
+            self.assertFalse(is_admin_token("café"))
+        self.assertEqual(response.status_code, 403)
+
+
+class TestWarmup(unittest.IsolatedAsyncioTestCase):
+    async def test_failed_clients_are_retried(self):
+        attempts = 0
+
+        async def flaky() -> None:
+            nonlocal attempts
+            attempts += 1
+            if attempts == 1:
+                raise ConnectionError("unreachable")
+
+        warmup = Warmup({"flaky": flaky, "ok": AsyncMock()})
+        task = asyncio.create_task(warmup.run(retry_interval=0.1))
+        await asyncio.sleep(0.01)
+        self.assertFalse(warmup.ready)
+        self.assertEqual(warmup.status()["flaky"], {"warm": False, "error": "unreachable"})
+
+        await task
+        self.assertTrue(warmup.ready)
+        self.assertEqual(attempts, 2)
+        warmup.steps["ok"].assert_awaited_once()
+
+    def test_ready_endpoint(self):
+        with patch("app.main.warmup", Warmup({"redis": AsyncMock()})) as warmup:
+            self.assertEqual(TestClient(app).get("/ready").status_code, 503)
+            asyncio.run(warmup.run())
+            response = TestClient(app).get("/ready")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"ready": True, "clients": {"redis": {"warm": True, "error": None}}})
+
+
+class TestGeneratePlaylists(unittest.TestCase):
+    def setUp(self):
+        track_memory_cache.clear()
+        cache = FakeRedis()
+        app.dependency_overrides[create_redis] = lambda: cache
+
+    def tearDown(self):
+        app.dependency_overrides.clear()
+
+    def test_tracks_shared_by_playlists_are_resolved_once(self):
+        source = parse_youtube_track_data(YOUTUBE_MOCK_TRACK)
+        other_source = source.model_copy(update={"id": "other", "spotify_search_query": "other"})
+        match = parse_spotify_track_data(SPOTIFY_MOCK_TRACK)
+
+        def create_playlist(tracks: List[Track]) -> Playlist:
+            return Playlist(
+                id="", title="", description="", thumbnail="", author="",
+                duration=0, track_count=len(tracks), tracks=tracks,
+                platform=PlaylistSource.YOUTUBE, similarity=0,
+            )
+
+        playlists = {
+            "https://music.youtube.com/playlist?list=first": create_playlist([source, other_source]),
+            "https://music.youtube.com/playlist?list=second": create_playlist([other_source, source, source]),
+        }
+
+        async def fetch_playlist(url: str) -> Playlist:
+            return playlists[url]
+
+        search = AsyncMock(return_value=match)
+        with patch("app.main.fetch_playlist_from_url", fetch_playlist), \
+                patch("app.resolver.search_track", search):
+            response = TestClient(app).post("/generate-playlists", json={
+                "playlist_urls": [*playlists, "https://open.spotify.com/playlist/same-platform"],
+                "convert_to": "SPOTIFY",
+            })
+
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body["unique_track_count"], 2)
+        self.assertEqual(search.await_count, 2)
+        first, second, invalid = body["playlists"]
+        self.assertEqual((first["playlist"]["track_count"], second["playlist"]["track_count"]), (2, 3))
+        self.assertEqual(second["playlist"]["duration"], match.duration * 3)
+        self.assertIsNone(invalid["playlist"])
+        self.assertIn("same platform", invalid["error"])
+
+
+class TestRefresh(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        track_memory_cache.clear()
+        self.source = parse_youtube_track_data(YOUTUBE_MOCK_TRACK)
+        self.match = parse_spotify_track_data(SPOTIFY_MOCK_TRACK)
+
+    async def test_popular_searches_are_refreshed_before_they_expire(self):
+        cache = FakeRedis()
+        query = self.source.spotify_search_query
+        await cache_tracks(cache, [(query, self.match), ("other", self.match)])
+        access_log = AccessLog()
+        access_log.record_search(query, PlaylistSource.SPOTIFY, self.source)
+        for _ in range(2):
+            access_log.record_search(query, PlaylistSource.SPOTIFY)
+        access_log.record_search("other", PlaylistSource.SPOTIFY)
+        await access_log.flush(cache)
+        self.assertEqual(cache.zsets[get_popularity_key(SEARCHES)],
+                         {f"SPOTIFY:{query}": 3, "SPOTIFY:other": 1})
+
+        search = AsyncMock(return_value=self.match)
+        with patch("app.resolver.search_track", search):
+            # not expiring soon
+            self.assertEqual(await refresh_popular(cache), 0)
+            cache.expiry[query] = cache.expiry["other"] = 60
+            with patch("app.refresh.is_idle", return_value=False):
+                self.assertEqual(await refresh_popular(cache), 0)
+            self.assertEqual(await refresh_popular(cache), 1)
+
+        # "other" is not popular
+        search.assert_awaited_once_with(query, PlaylistSource.SPOTIFY, self.source)
+        self.assertEqual(cache.expiry[query], SONG_CACHE_EXPIRY)
+
+    async def test_refresher_logs_failures_and_closes_its_client(self):
+        cache = FakeRedis()
+        cache.aclose = AsyncMock()
+        errors = refresher_errors._value.get()
+        with patch("app.refresh.create_redis", return_value=cache), \
+                patch("app.refresh.refresh_once", AsyncMock(side_effect=RuntimeError("bug"))), \
+                self.assertLogs("app.refresh", "ERROR"):
+            task = asyncio.create_task(run_refresher(interval=0.01))
+            await asyncio.sleep(0.05)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+        self.assertGreater(refresher_errors._value.get(), errors)
+        cache.aclose.assert_awaited_once()
+
+    async def test_decay(self):
+        cache = FakeRedis()
+        cache.zsets[get_popularity_key(SEARCHES)] = {"popular": 8, "rare": 1}
+        cache.zsets[get_popularity_key(CONVERSIONS)] = {"popular": 4, "less": 2}
+        await decay_popularity(cache, max_entries=1)
+        self.assertEqual(cache.zsets[get_popularity_key(SEARCHES)], {"popular": 4})
+        self.assertEqual(cache.zsets[get_popularity_key(CONVERSIONS)], {"popular": 2})
+
+    async def test_prewarm(self):
+        cache = FakeRedis()
+        playlist = Playlist(
+            id="playlist_id", title="", description="", thumbnail="", author="",
+            duration=0, track_count=1, tracks=[self.source],
+            platform=PlaylistSource.YOUTUBE, similarity=0,
+        )
+
+        async def fetch_playlist(url: str) -> Playlist:
+            if url != "https://music.youtube.com/playlist?list=playlist_id":
+                raise PlaylistNotFound(PlaylistSource.YOUTUBE)
+            return playlist
+
+        with patch("app.refresh.fetch_playlist_from_url", fetch_playlist), \
+                patch("app.resolver.search_track", AsyncMock(return_value=self.match)):
+            results = await prewarm(cache, ["https://music.youtube.com/playlist?list=playlist_id",
+                                            "https://music.youtube.com/playlist?list=missing"])
+
+        self.assertEqual([(result.convert_to, result.track_count, result.error) for result in results], [
+            (PlaylistSource.SPOTIFY, 1, None),
+            (None, 0, "playlist does not exist"),
+        ])
+        self.assertIn("conversion:YOUTUBE:playlist_id:SPOTIFY", cache.store)
+        self.assertEqual(cache.zsets[get_popularity_key(CONVERSIONS)],
+                         {"conversion:YOUTUBE:playlist_id:SPOTIFY": 2 * REFRESH_MIN_HITS})
+
+
+class TestPlaylistView(unittest.TestCase):
+    def setUp(self):
+        track = parse_spotify_track_data(SPOTIFY_MOCK_TRACK)
+        self.tracks = [track.model_copy(update={"id": str(index)}) for index in range(3)]
+        self.playlist = Playlist(
+            id="playlist_id", title="Playlist", description="", thumbnail="", author="owner",
+            duration=0, track_count=3, tracks=self.tracks,
+            platform=PlaylistSource.SPOTIFY, similarity=None, snapshot_id="snapshot",
+        )
+
+    def get_playlist(self, headers: Optional[Dict[str, str]] = None, **view):
+        async def fetch_playlist(url: str) -> Playlist:
+            return self.playlist
+
+        with patch("app.main.fetch_playlist_from_url", fetch_playlist):
+            return TestClient(app).post("/get-playlist", headers=headers, json={
+                "url": "https://open.spotify.com/playlist/playlist_id", **view})
+
+    def test_pages(self):
+        first = self.get_playlist(limit=2).json()
+        self.assertEqual([track["id"] for track in first["tracks"]], ["0", "1"])
+        self.assertEqual(first["track_count"], 3)
+
+        second = self.get_playlist(limit=2, cursor=first["next_cursor"]).json()
+        self.assertEqual([track["id"] for track in second["tracks"]], ["2"])
+        self.assertIsNone(second["next_cursor"])
+
+        self.assertEqual(self.get_playlist(cursor="not a cursor").status_code, 400)
+        self.playlist = self.playlist.model_copy(update={"snapshot_id": "changed"})
+        self.assertEqual(self.get_playlist(cursor=first["next_cursor"]).status_code, 409)
+
+    def test_fields(self):
+        body = self.get_playlist(fields=["id", "title"]).json()
+        self.assertEqual(body["tracks"][0], {"id": "0", "title": self.tracks[0].title})
+        self.assertEqual(body["title"], "Playlist")
+        self.assertEqual(self.get_playlist(fields=["unknown"]).status_code, 422)
+
+    def test_compression(self):
+        for accept_encoding, encoding in [("gzip", "gzip"), ("gzip, br", "br"), ("identity", None)]:
+            response = self.get_playlist(headers={"Accept-Encoding": accept_encoding})
+            self.assertEqual(response.headers.get("content-encoding"), encoding)
+            # the client decompresses the body
+            self.assertEqual(len(response.json()["tracks"]), 3)
+        # too small to be worth compressing
+        response = self.get_playlist(headers={"Accept-Encoding": "gzip"}, fields=["id"])
+        self.assertIsNone(response.headers.get("content-encoding"))
+
+    def test_negotiate_encoding(self):
+        self.assertEqual(negotiate_encoding("gzip, deflate, br"), "br")
+        self.assertEqual(negotiate_encoding("br;q=0.5, gzip"), "gzip")
+        self.assertEqual(negotiate_encoding("*"), "br")
+        self.assertEqual(negotiate_encoding("br;q=0, *;q=0.1"), "gzip")
+        self.assertIsNone(negotiate_encoding("identity"))
+        self.assertIsNone(negotiate_encoding(""))
+
+    def test_schema(self):
+        self.assertEqual(set(TrackView.model_fields), set(Track.model_fields))
+        schema = app.openapi()
+        components = schema["components"]["schemas"]
+        response = schema["paths"]["/get-playlist"]["post"]["responses"]["200"]["content"]["application/json"]
+        self.assertEqual(response["schema"]["$ref"], "#/components/schemas/PlaylistPage")
+        # only the endpoints that page and project their tracks take the parameters
+        self.assertNotIn("limit", components["GeneratePlaylistStream"]["properties"])
+        self.assertIn("fields", components["GeneratePlaylistStream"]["properties"])
+        self.assertNotIn("fields", components["ConvertPlaylist"]["properties"])
+
+
+class TestTrackIndex(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        track_memory_cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.index = TrackIndex(os.path.join(directory.name, "track_index.db"))
+        self.addCleanup(self.index.close)
+        self.track = parse_spotify_track_data(SPOTIFY_MOCK_TRACK)
+        # the same song on youtube music, from another album and credited with a feature
+        self.source = self.track.model_copy(update={
+            "id": "youtube_id",
+            "title": f"{self.track.title} (feat. Someone)",
+            "album": "Another album",
+            "platform": PlaylistSource.YOUTUBE,
+        })
+
+    async def test_find(self):
+        self.assertIsNone(await self.index.find(self.source, PlaylistSource.SPOTIFY))
+        await self.index.add([self.track, self.source])
+        # added again, replacing the indexed track
+        await self.index.add([self.track])
+
+        self.assertEqual(await self.index.find(self.source, PlaylistSource.SPOTIFY), self.track)
+        self.assertEqual(await self.index.find(self.track, PlaylistSource.YOUTUBE), self.source)
+        # a different duration as well is not close enough
+        other = self.source.model_copy(update={"duration": self.source.duration + 60_000})
+        self.assertIsNone(await self.index.find(other, PlaylistSource.SPOTIFY))
+        # titles sharing no words are not found
+        other = self.source.model_copy(update={"title": "And"})
+        self.assertIsNone(await self.index.find(other, PlaylistSource.SPOTIFY))
+
+    async def test_indexed_tracks_are_not_searched(self):
+        cache = FakeRedis()
+        await self.index.add([self.track])
+
+        search = AsyncMock(return_value=None)
+        with patch("app.resolver.track_index", self.index), patch("app.resolver.search_track", search):
+            tracks = await resolve_tracks(cache, [self.source], PlaylistSource.SPOTIFY)
+
+        self.assertEqual(tracks, [self.track])
+        search.assert_not_awaited()
+        # cached under its search query for the next time
+        self.assertEqual(await get_cached_tracks(cache, [self.source.spotify_search_query]), [self.track])
+
+    async def test_add_later(self):
+        self.index.add_later([self.track])
+        await self.index.wait_for_writes()
+        self.assertEqual(await self.index.find(self.source, PlaylistSource.SPOTIFY), self.track)
+
+    async def test_disabled_without_path(self):
+        index = TrackIndex(None)
+        self.assertFalse(index.enabled)
+        await index.add([self.track])
+        self.assertIsNone(await index.find(self.track, PlaylistSource.SPOTIFY))
@@ -0,0 +1,177 @@
+"""In-memory fakes shared by the tests and the benchmarks"""
+from typing import Dict, List, Optional, Tuple
+
+
+class FakePipeline:
+    def __init__(self, redis: "FakeRedis") -> None:
+        self.redis = redis
+        self.commands: List[Tuple[str, tuple]] = []
+
+    def __len__(self) -> int:
+        return len(self.commands)
+
+    def setex(self, name: str, time: int, value: str) -> "FakePipeline":
+        self.commands.append(("setex", (name, time, value)))
+        return self
+
+    def delete(self, *names: str) -> "FakePipeline":
+        self.commands.append(("delete", names))
+        return self
+
+    def ttl(self, name: str) -> "FakePipeline":
+        self.commands.append(("ttl", (name,)))
+        return self
+
+    def pttl(self, name: str) -> "FakePipeline":
+        self.commands.append(("pttl", (name,)))
+        return self
+
+    def mget(self, names: List[str]) -> "FakePipeline":
+        self.commands.append(("mget", (names,)))
+        return self
+
+    def zincrby(self, name: str, amount: float, value: str) -> "FakePipeline":
+        self.commands.append(("zincrby", (name, amount, value)))
+        return self
+
+    def zunionstore(self, dest: str, keys: Dict[str, float]) -> "FakePipeline":
+        self.commands.append(("zunionstore", (dest, keys)))
+        return self
+
+    def zremrangebyscore(self, name: str, min: str, max: str) -> "FakePipeline":
+        self.commands.append(("zremrangebyscore", (name, min, max)))
+        return self
+
+    def zremrangebyrank(self, name: str, min: int, max: int) -> "FakePipeline":
+        self.commands.append(("zremrangebyrank", (name, min, max)))
+        return self
+
+    async def execute(self) -> list:
+        self.redis.calls.append("pipeline")
+        results = []
+        for command, args in self.commands:
+            results.append(getattr(self.redis, f"_{command}")(*args))
+        self.commands = []
+        return results
+
+
+class FakeRedis:
+    """In-memory stand-in for the few redis commands the app uses
+
+    """
+
+    def __init__(self) -> None:
+        self.store: Dict[str, bytes] = {}
+        self.expiry: Dict[str, int] = {}
+        self.zsets: Dict[str, Dict[str, float]] = {}
+        self.calls: List[str] = []
+
+    def _setex(self, name: str, time: int, value: str) -> bool:
+        self.store[name] = value.encode() if isinstance(value, str) else value
+        self.expiry[name] = time
+        return True
+
+    def _ttl(self, name: str) -> int:
+        if name not in self.store:
+            return -2
+        return self.expiry.get(name, -1)
+
+    def _pttl(self, name: str) -> int:
+        ttl = self._ttl(name)
+        return ttl * 1000 if ttl >= 0 else ttl
+
+    def _mget(self, names: List[str]) -> List[Optional[bytes]]:
+        return [self.store.get(name) for name in names]
+
+    def _zincrby(self, name: str, amount: float, value: str) -> float:
+        zset = self.zsets.setdefault(name, {})
+        zset[value] = zset.get(value, 0) + amount
+        return zset[value]
+
+    def _zunionstore(self, dest: str, keys: Dict[str, float]) -> int:
+        # only the weighted copy of a single set is supported
+        [(name, weight)] = keys.items()
+        self.zsets[dest] = {value: score * weight for value, score in self.zsets.get(name, {}).items()}
+        return len(self.zsets[dest])
+
+    def _zremrangebyscore(self, name: str, min: str, max: str) -> int:
+        # only "-inf" to an exclusive "(max" is supported
+        zset = self.zsets.get(name, {})
+        removed = [value for value, score in zset.items() if score < float(max.lstrip("("))]
+        for value in removed:
+            del zset[value]
+        return len(removed)
+
+    def _zremrangebyrank(self, name: str, min: int, max: int) -> int:
+        zset = self.zsets.get(name, {})
+        ranked = sorted(zset, key=zset.__getitem__)
+        removed = ranked[min:len(ranked) + max + 1 if max < 0 else max + 1]
+        for value in removed:
+            del zset[value]
+        return len(removed)
+
+    def _delete(self, *names: str) -> int:
+        deleted = 0
+        for name in names:
+            if self.store.pop(name, None) is not None:
+                deleted += 1
+        return deleted
+
+    async def get(self, name: str) -> Optional[bytes]:
+        self.calls.append("get")
+        return self.store.get(name)
+
+    async def mget(self, names: List[str]) -> List[Optional[bytes]]:
+        self.calls.append("mget")
+        return self._mget(names)
+
+    async def setex(self, name: str, time: int, value: str) -> bool:
+        self.calls.append("setex")
+        return self._setex(name, time, value)
+
+    async def set(self, name: str, value, nx: bool = False, px: Optional[int] = None) -> Optional[bool]:
+        self.calls.append("set")
+        if nx and name in self.store:
+            return None
+        self.store[name] = str(value).encode()
+        return True
+
+    async def exists(self, *names: str) -> int:
+        self.calls.append("exists")
+        return sum(name in self.store for name in names)
+
+    async def delete(self, *names: str) -> int:
+        self.calls.append("delete")
+        return self._delete(*names)
+
+    async def expire(self, name: str, time: int) -> bool:
+        self.calls.append("expire")
+        if name not in self.store:
+            return False
+        self.expiry[name] = time
+        return True
+
+    async def zadd(self, name: str, mapping: Dict[str, float], gt: bool = False) -> int:
+        self.calls.append("zadd")
+        zset = self.zsets.setdefault(name, {})
+        for value, score in mapping.items():
+            if not gt or value not in zset or score > zset[value]:
+                zset[value] = score
+        return len(mapping)
+
+    async def zrevrangebyscore(
+        self, name: str, max: str, min: float, start: int = 0, num: Optional[int] = None
+    ) -> List[bytes]:
+        self.calls.append("zrevrangebyscore")
+        zset = self.zsets.get(name, {})
+        values = sorted((value for value, score in zset.items() if score >= min),
+                        key=zset.__getitem__, reverse=True)
+        return [value.encode() for value in values[start:None if num is None else start + num]]
+
+    async def zrem(self, name: str, *values: str) -> int:
+        self.calls.append("zrem")
+        zset = self.zsets.get(name, {})
+        return sum(zset.pop(value, None) is not None for value in values)
+
+    def pipeline(self, transaction: bool = True) -> FakePipeline:
+        return FakePipeline(self)
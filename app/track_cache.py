@@ -0,0 +1,120 @@
+from typing import Iterable, List, Optional, Tuple
+from redis.asyncio import Redis
+
+from app.codec import decode_search, encode_search
+from app.metrics import CACHE_GET, CACHE_SET, count_cache_lookups, time_stage
+from app.constants import (
+    NEGATIVE_CACHE_EXPIRY,
+    SONG_CACHE_EXPIRY,
+    TRACK_MEMORY_CACHE_EXPIRY,
+    TRACK_MEMORY_CACHE_SIZE,
+)
+from app.models.main import CachedSearch, Track
+from app.utils.lru import TTLCache
+
+# L1 cache of searches keyed by search query, redis is the L2 behind it
+track_memory_cache: TTLCache[str, CachedSearch] = TTLCache(
+    maxsize=TRACK_MEMORY_CACHE_SIZE, ttl=TRACK_MEMORY_CACHE_EXPIRY)
+
+
+async def get_cached_searches(cache: Redis, queries: List[str]) -> List[Optional[CachedSearch]]:
+    """look up the cached search of every search query
+
+    Queries are looked up in memory first, the remaining ones are fetched from
+    redis with a single MGET, pipelined with their remaining TTL, and kept in memory
+    for the next lookup, no longer than redis keeps them.
+
+    Args:
+        cache (Redis): redis connection
+        queries (List[str]): search queries (cache keys)
+
+    Returns:
+        List[Optional[CachedSearch]]: cached search of each query, None on a cache miss
+    """
+    searches: List[Optional[CachedSearch]] = [
+        track_memory_cache.get(query) for query in queries]
+    missed_indexes = [index for index, search in enumerate(searches)
+                      if search is None]
+    count_cache_lookups("memory", len(queries) - len(missed_indexes), len(missed_indexes))
+    if len(missed_indexes) == 0:
+        return searches
+
+    missed_queries = [queries[index] for index in missed_indexes]
+    pipeline = cache.pipeline(transaction=False)
+    pipeline.mget(missed_queries)
+    for query in missed_queries:
+        pipeline.pttl(query)
+    with time_stage(CACHE_GET, f"{len(missed_indexes)} tracks"):
+        cached_songs, *remaining_ttls = await pipeline.execute()
+    hits = 0
+    for index, cached_song, remaining_ttl in zip(missed_indexes, cached_songs, remaining_ttls):
+        search = decode_search(cached_song) if cached_song is not None else None
+        if search is not None:
+            searches[index] = search
+            hits += 1
+            # -1: the key does not expire, -2: it expired since the MGET
+            if remaining_ttl != -2:
+                ttl = get_memory_expiry(search)
+                if remaining_ttl >= 0:
+                    ttl = min(ttl, remaining_ttl / 1000)
+                track_memory_cache.set(queries[index], search, ttl=ttl)
+    count_cache_lookups("redis", hits, len(missed_indexes) - hits)
+    return searches
+
+
+async def get_cached_tracks(cache: Redis, queries: List[str]) -> List[Optional[Track]]:
+    """look up the cached track of every search query, see `get_cached_searches`
+
+    Args:
+        cache (Redis): redis connection
+        queries (List[str]): search queries (cache keys)
+
+    Returns:
+        List[Optional[Track]]: cached track of each query, None on a cache miss or
+            when the search found nothing
+    """
+    return [search.track if search is not None else None
+            for search in await get_cached_searches(cache, queries)]
+
+
+def get_expiry(search: CachedSearch) -> int:
+    return SONG_CACHE_EXPIRY if search.track is not None else NEGATIVE_CACHE_EXPIRY
+
+
+def get_memory_expiry(search: CachedSearch) -> int:
+    return min(get_expiry(search), TRACK_MEMORY_CACHE_EXPIRY)
+
+
+async def cache_searches(cache: Redis, searches: Iterable[Tuple[str, CachedSearch]], delete: Iterable[str] = ()) -> None:
+    """cache searches under their search query in one pipelined round-trip, searches
+    that found nothing expire after `NEGATIVE_CACHE_EXPIRY`
+
+    Args:
+        cache (Redis): redis connection
+        searches (Iterable[Tuple[str, CachedSearch]]): (search query, search) pairs
+        delete (Iterable[str], optional): keys to delete in the same round-trip e.g. locks.
+    """
+    pipeline = cache.pipeline(transaction=False)
+    for query, search in searches:
+        track_memory_cache.set(query, search, ttl=get_memory_expiry(search))
+        pipeline.setex(
+            name=query,
+            time=get_expiry(search),
+            value=encode_search(search),
+        )
+    for key in delete:
+        pipeline.delete(key)
+    if len(pipeline) > 0:
+        with time_stage(CACHE_SET, f"{len(pipeline)} commands"):
+            await pipeline.execute()
+
+
+async def cache_tracks(cache: Redis, tracks: Iterable[Tuple[str, Track]], delete: Iterable[str] = ()) -> None:
+    """cache tracks under their search query in one pipelined round-trip
+
+    Args:
+        cache (Redis): redis connection
+        tracks (Iterable[Tuple[str, Track]]): (search query, track) pairs
+        delete (Iterable[str], optional): keys to delete in the same round-trip e.g. locks.
+    """
+    await cache_searches(cache, ((query, CachedSearch(track)) for query, track in tracks), delete)
@@ -0,0 +1,197 @@
+import asyncio
+import re
+import sqlite3
+import threading
+from typing import Iterable, List, Optional, Set
+
+from starlette.concurrency import run_in_threadpool
+
+from app.codec import decode_track, encode_track
+from app.constants import TRACK_INDEX_CANDIDATES, TRACK_INDEX_MIN_SIMILARITY, TRACK_INDEX_PATH
+from app.metrics import CACHE_GET, CACHE_SET, count_cache_lookups, time_stage
+from app.models.main import PlaylistSource, Track
+from app.utils.fingerprint import get_fingerprint
+from app.utils.scoring import best_match
+
+# words of a title or artist name, as the unicode61 tokenizer splits them
+WORD_PATTERN = re.compile(r"\w+")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tracks (
+    rowid INTEGER PRIMARY KEY,
+    platform TEXT NOT NULL,
+    id TEXT NOT NULL,
+    title TEXT NOT NULL,
+    artists TEXT NOT NULL,
+    data BLOB NOT NULL,
+    UNIQUE (platform, id)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS tracks_fts USING fts5(
+    title, artists, content='tracks', content_rowid='rowid',
+    tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS tracks_insert AFTER INSERT ON tracks BEGIN
+    INSERT INTO tracks_fts (rowid, title, artists) VALUES (new.rowid, new.title, new.artists);
+END;
+CREATE TRIGGER IF NOT EXISTS tracks_update AFTER UPDATE ON tracks BEGIN
+    INSERT INTO tracks_fts (tracks_fts, rowid, title, artists) VALUES ('delete', old.rowid, old.title, old.artists);
+    INSERT INTO tracks_fts (rowid, title, artists) VALUES (new.rowid, new.title, new.artists);
+END;
+"""
+
+UPSERT = """
+INSERT INTO tracks (platform, id, title, artists, data) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (platform, id) DO UPDATE SET
+    title = excluded.title, artists = excluded.artists, data = excluded.data
+"""
+
+# CROSS JOIN makes SQLite look up the full-text index first. Candidates are scored
+# afterwards, so they are not ranked (bm25 is slow on common words).
+SEARCH = """
+SELECT tracks.data FROM tracks_fts CROSS JOIN tracks ON tracks.rowid = tracks_fts.rowid
+WHERE tracks_fts MATCH ? AND tracks.platform = ?
+LIMIT ?
+"""
+
+
+def get_match_expression(track: Track) -> Optional[str]:
+    """build the FTS5 query of the tracks sharing every word of the title and of the
+    main artist of a track
+
+    Args:
+        track (Track): track to find
+
+    Returns:
+        Optional[str]: FTS5 MATCH expression, None if the title has no words
+    """
+    fingerprint = get_fingerprint(track)
+    title_words = WORD_PATTERN.findall(fingerprint.title)
+    artist_words = WORD_PATTERN.findall(track.artists.split(", ")[0].casefold())
+    if len(title_words) == 0:
+        return None
+    # every word is quoted, words like "and" or "near" are FTS5 operators otherwise
+    expression = "title : (" + " ".join(f'"{word}"' for word in title_words) + ")"
+    if len(artist_words) > 0:
+        expression += " AND artists : (" + " ".join(f'"{word}"' for word in artist_words) + ")"
+    return expression
+
+
+class TrackIndex:
+    """Local full-text index (SQLite FTS5) of the tracks seen on every platform
+
+    The track cache only hits on the exact search query, the index finds a track
+    by the words of its normalized title and main artist, so a different album name
+    or "feat." variant still finds it without searching upstream. SQLite calls are
+    blocking, they run in the threadpool with one connection per thread.
+    """
+
+    def __init__(self, path: Optional[str]) -> None:
+        self.path = path
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        # writes started by `add_later` that are not done yet
+        self._writes: Set[asyncio.Task] = set()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def _connect(self) -> sqlite3.Connection:
+        connection: Optional[sqlite3.Connection] = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            with self._lock:
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.execute("PRAGMA synchronous=NORMAL")
+                connection.executescript(SCHEMA)
+                self._connections.append(connection)
+            self._local.connection = connection
+        return connection
+
+    def _add(self, tracks: List[Track]) -> None:
+        connection = self._connect()
+        with connection:
+            connection.executemany(UPSERT, [
+                (track.platform.value, track.id, get_fingerprint(track).title, track.artists, encode_track(track))
+                for track in tracks
+            ])
+
+    def _search(self, expression: str, platform: PlaylistSource, limit: int) -> List[Track]:
+        rows = self._connect().execute(SEARCH, (expression, platform.value, limit)).fetchall()
+        return [track for track in (decode_track(data) for data, in rows) if track is not None]
+
+    async def add(self, tracks: Iterable[Track]) -> None:
+        """add tracks to the index, replacing the ones already in it
+
+        Args:
+            tracks (Iterable[Track]): tracks from a platform, tracks without an id are skipped
+        """
+        tracks = [track for track in tracks if track.id]
+        if not self.enabled or len(tracks) == 0:
+            return
+        with time_stage(CACHE_SET, f"index {len(tracks)} tracks"):
+            try:
+                await run_in_threadpool(self._add, tracks)
+            except sqlite3.Error:
+                # the index is best effort, the track caches still have the tracks
+                pass
+
+    def add_later(self, tracks: Iterable[Track]) -> None:
+        """add tracks to the index in the background, off the request path, see `add`
+
+        Args:
+            tracks (Iterable[Track]): tracks from a platform
+        """
+        if not self.enabled:
+            return
+        task = asyncio.create_task(self.add(list(tracks)))
+        self._writes.add(task)
+        task.add_done_callback(self._writes.discard)
+
+    async def wait_for_writes(self) -> None:
+        """wait for the writes started by `add_later`
+
+        """
+        await asyncio.gather(*self._writes, return_exceptions=True)
+
+    async def find(self, source_track: Track, platform: PlaylistSource,
+                   min_similarity: float = TRACK_INDEX_MIN_SIMILARITY) -> Optional[Track]:
+        """find a track of another platform in the index
+
+        The tracks sharing the title and main artist words are scored like search
+        results, the best one is only returned if it is similar enough to trust
+        without searching upstream.
+
+        Args:
+            source_track (Track): track to find
+            platform (PlaylistSource): platform to find it on
+            min_similarity (float, optional): lowest similarity of a match.
+
+        Returns:
+            Optional[Track]: matching track, None when the index has no close enough track
+        """
+        if not self.enabled:
+            return None
+        expression = get_match_expression(source_track)
+        if expression is None:
+            return None
+        with time_stage(CACHE_GET, "index"):
+            try:
+                candidates = await run_in_threadpool(self._search, expression, platform, TRACK_INDEX_CANDIDATES)
+            except sqlite3.Error:
+                candidates = []
+        match = best_match(source_track, candidates)
+        found = match is not None and match.similarity >= min_similarity
+        count_cache_lookups("index", int(found), int(not found))
+        return match.track if found else None
+
+    def close(self) -> None:
+        with self._lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections = []
+        self._local = threading.local()
+
+
+track_index = TrackIndex(TRACK_INDEX_PATH)
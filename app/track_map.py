@@ -0,0 +1,145 @@
+import json
+from typing import Dict, Iterable, List, Optional, Tuple
+import httpx
+from redis.asyncio import Redis
+
+from app.codec import decode_track, encode_track
+from app.constants import PLAYLIST_PAGE_CONCURRENCY, TRACK_MAP_EXPIRY, TRACK_MAP_MIN_SIMILARITY
+from app.metrics import CACHE_GET, CACHE_SET, count_cache_lookups, time_stage
+from app.models.main import PlaylistSource, Track
+from app.services.spotify import SPOTIFY_TRACKS_BATCH_SIZE, SpotifyException, spotify
+from app.track_cache import get_cached_searches
+from app.utils.concurrency import gather_with_concurrency
+from app.utils.parse_track import calculate_similarity, get_search_query, parse_spotify_track_data
+
+
+def get_track_map_key(source: PlaylistSource, target: PlaylistSource, track_id: str) -> str:
+    return f"trackmap:{source.value}:{target.value}:{track_id}"
+
+
+def get_mapped_track_key(platform: PlaylistSource, track_id: str) -> str:
+    return f"trackmap:tracks:{platform.value}:{track_id}"
+
+
+async def fetch_spotify_tracks(ids: List[str]) -> Dict[str, Track]:
+    """fetch spotify tracks by id, 50 ids per request
+
+    Args:
+        ids (List[str]): spotify track ids
+
+    Returns:
+        Dict[str, Track]: tracks by id, ids that no longer exist or whose batch
+            failed are left out
+    """
+    batches = [ids[start:start + SPOTIFY_TRACKS_BATCH_SIZE]
+               for start in range(0, len(ids), SPOTIFY_TRACKS_BATCH_SIZE)]
+
+    async def fetch_batch(batch: List[str]) -> List[Optional[dict]]:
+        try:
+            return (await spotify.tracks(batch)).get("tracks") or []
+        except (httpx.HTTPError, SpotifyException):
+            # the tracks of the batch are searched for instead
+            return []
+
+    tracks: Dict[str, Track] = {}
+    for batch in await gather_with_concurrency(batches, fetch_batch, PLAYLIST_PAGE_CONCURRENCY):
+        for found_track in batch:
+            if found_track is not None:
+                track = parse_spotify_track_data(found_track)
+                tracks[track.id] = track
+    return tracks
+
+
+async def get_mapped_tracks(cache: Redis, tracks: List[Track], platform: PlaylistSource) -> List[Optional[Track]]:
+    """find tracks that were already matched to a track of another platform
+
+    The track id index is read with a single MGET. Known spotify
+    tracks are then taken from the search cache, the ones it does not have are
+    fetched in bulk by id. Known youtube music tracks are read from the index.
+
+    Args:
+        cache (Redis): redis connection
+        tracks (List[Track]): tracks from the source playlist
+        platform (PlaylistSource): platform the tracks were matched on
+
+    Returns:
+        List[Optional[Track]]: matched track of each track, None if unknown
+    """
+    target_ids: List[Optional[str]] = [None] * len(tracks)
+    indexes = [index for index, track in enumerate(tracks) if track.id]
+    if len(indexes) > 0:
+        with time_stage(CACHE_GET):
+            entries = await cache.mget([
+                get_track_map_key(tracks[index].platform, platform, tracks[index].id) for index in indexes])
+        hits = 0
+        for index, entry in zip(indexes, entries):
+            mapping = json.loads(entry) if entry is not None else None
+            if mapping is not None and mapping["similarity"] >= TRACK_MAP_MIN_SIMILARITY:
+                target_ids[index] = mapping["id"]
+                hits += 1
+        count_cache_lookups("trackmap", hits, len(indexes) - hits)
+
+    unique_ids = list(dict.fromkeys(
+        target_id for target_id in target_ids if target_id is not None))
+    if len(unique_ids) == 0:
+        return [None] * len(tracks)
+
+    if platform == PlaylistSource.SPOTIFY:
+        found_tracks = {}
+        mapped_indexes = [index for index, target_id in enumerate(target_ids) if target_id is not None]
+        cached_searches = await get_cached_searches(
+            cache, [get_search_query(tracks[index], platform) for index in mapped_indexes])
+        for index, cached_search in zip(mapped_indexes, cached_searches):
+            if cached_search is not None and cached_search.track is not None \
+                    and cached_search.track.id == target_ids[index]:
+                found_tracks[cached_search.track.id] = cached_search.track
+        found_tracks.update(await fetch_spotify_tracks(
+            [target_id for target_id in unique_ids if target_id not in found_tracks]))
+    else:
+        with time_stage(CACHE_GET):
+            stored_tracks = await cache.mget([get_mapped_track_key(platform, target_id) for target_id in unique_ids])
+        found_tracks = {}
+        for target_id, stored_track in zip(unique_ids, stored_tracks):
+            track = decode_track(stored_track) if stored_track is not None else None
+            if track is not None:
+                found_tracks[target_id] = track
+    return [found_tracks.get(target_id) if target_id is not None else None
+            for target_id in target_ids]
+
+
+async def map_tracks(cache: Redis, matches: Iterable[Tuple[Track, Track]]) -> None:
+    """remember which track of the other platform each track was matched to (both ways)
+
+    Mappings expire after `TRACK_MAP_EXPIRY`, matching a track again sets it again.
+    Youtube music tracks are stored along with them since youtube music has no
+    endpoint to fetch several tracks by id.
+
+    Args:
+        cache (Redis): redis connection
+        matches (Iterable[Tuple[Track, Track]]): (source track, matched track) pairs
+    """
+    pipeline = cache.pipeline(transaction=False)
+    for source_track, track in matches:
+        if not source_track.id or not track.id:
+            continue
+        similarity = calculate_similarity(source_track, track)
+        pipeline.setex(
+            get_track_map_key(source_track.platform, track.platform, source_track.id),
+            TRACK_MAP_EXPIRY,
+            json.dumps({"id": track.id, "similarity": similarity}),
+        )
+        pipeline.setex(
+            get_track_map_key(track.platform, source_track.platform, track.id),
+            TRACK_MAP_EXPIRY,
+            json.dumps({"id": source_track.id, "similarity": similarity}),
+        )
+        for mapped_track in (source_track, track):
+            if mapped_track.platform == PlaylistSource.YOUTUBE:
+                pipeline.setex(
+                    get_mapped_track_key(PlaylistSource.YOUTUBE, mapped_track.id),
+                    TRACK_MAP_EXPIRY,
+                    encode_track(mapped_track),
+                )
+    if len(pipeline) > 0:
+        with time_stage(CACHE_SET):
+            await pipeline.execute()
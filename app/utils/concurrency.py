@@ -0,0 +1,81 @@
+import asyncio
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Tuple, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+async def gather_with_concurrency(
+    items: Iterable[T], func: Callable[[T], Awaitable[R]], limit: int
+) -> List[R]:
+    """Run `func` over every item with at most `limit` calls in flight
+
+    Args:
+        items (Iterable[T]): items to process
+        func (Callable[[T], Awaitable[R]]): coroutine function applied to each item
+        limit (int): maximum number of concurrent calls
+
+    Returns:
+        List[R]: results in the same order as `items`
+    """
+    semaphore = asyncio.Semaphore(max(limit, 1))
+
+    async def run(item: T) -> R:
+        async with semaphore:
+            return await func(item)
+
+    return list(await asyncio.gather(*(run(item) for item in items)))
+
+
+async def iter_with_concurrency(
+    items: Iterable[T], func: Callable[[T], Awaitable[R]], limit: int
+) -> AsyncIterator[Tuple[int, R]]:
+    """Run `func` over every item with at most `limit` calls in flight, yielding
+    results as soon as they are ready
+
+    Args:
+        items (Iterable[T]): items to process
+        func (Callable[[T], Awaitable[R]]): coroutine function applied to each item
+        limit (int): maximum number of concurrent calls
+
+    Yields:
+        Tuple[int, R]: index of the item and its result, in completion order
+    """
+    semaphore = asyncio.Semaphore(max(limit, 1))
+
+    async def run(index: int, item: T) -> Tuple[int, R]:
+        async with semaphore:
+            return index, await func(item)
+
+    tasks = [asyncio.ensure_future(run(index, item))
+             for index, item in enumerate(items)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        # consumer stopped early or failed, don't leave work running
+        for task in tasks:
+            task.cancel()
+
+
+async def iter_in_order_with_concurrency(
+    items: Iterable[T], func: Callable[[T], Awaitable[R]], limit: int
+) -> AsyncIterator[R]:
+    """Run `func` over every item with at most `limit` calls in flight, yielding
+    results in the order of `items` as soon as all the previous ones are ready
+
+    Args:
+        items (Iterable[T]): items to process
+        func (Callable[[T], Awaitable[R]]): coroutine function applied to each item
+        limit (int): maximum number of concurrent calls
+
+    Yields:
+        R: result of each item, in the same order as `items`
+    """
+    ready: Dict[int, R] = {}
+    next_index = 0
+    async for index, result in iter_with_concurrency(items, func, limit):
+        ready[index] = result
+        while next_index in ready:
+            yield ready.pop(next_index)
+            next_index += 1
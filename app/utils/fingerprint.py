@@ -0,0 +1,69 @@
+from typing import FrozenSet, NamedTuple
+
+from app.models.main import Track
+from app.utils.parser import remove_feat_suffix
+
+
+class TrackFingerprint(NamedTuple):
+    """Normalized parts of a track that matching compares
+
+    A tuple (no instance dict), built once per track by `get_fingerprint`.
+    """
+    # casefolded title without its "feat." suffix
+    title: str
+    artists: FrozenSet[str]
+    # number of artists as listed, duplicates included
+    artist_count: int
+    # length of the joined artist names
+    artists_length: int
+    # casefolded album name
+    album: str
+    # duration in milliseconds
+    duration: int
+
+    @property
+    def key(self) -> str:
+        """stable key of the fingerprint, tracks with the same key are the same song
+
+        """
+        return "\x1f".join((self.title, ",".join(sorted(self.artists)), self.album, str(self.duration // 1000)))
+
+
+def create_fingerprint(track: Track) -> TrackFingerprint:
+    artists = track.artists.strip().split(", ")
+    return TrackFingerprint(
+        title=remove_feat_suffix(track.title).casefold().strip(),
+        artists=frozenset(artists),
+        artist_count=len(artists),
+        artists_length=len(track.artists),
+        album=track.album.casefold().strip(),
+        duration=track.duration,
+    )
+
+
+def get_fingerprint(track: Track) -> TrackFingerprint:
+    """get the fingerprint of a track, it is built on first use and kept on the track
+
+    Args:
+        track (Track): track to fingerprint
+
+    Returns:
+        TrackFingerprint: normalized track
+    """
+    fingerprint = track._fingerprint
+    if fingerprint is None:
+        fingerprint = create_fingerprint(track)
+        track._fingerprint = fingerprint
+    return fingerprint
+
+
+def artists_match(fingerprint1: TrackFingerprint, fingerprint2: TrackFingerprint) -> bool:
+    """whether every artist of the track with fewer artists is an artist of the other track
+
+    Tracks listing the same number of artists always match, as they always have.
+    """
+    if fingerprint1.artist_count == fingerprint2.artist_count:
+        return True
+    if fingerprint1.artist_count < fingerprint2.artist_count:
+        return fingerprint1.artists <= fingerprint2.artists
+    return fingerprint2.artists <= fingerprint1.artists
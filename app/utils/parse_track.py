@@ -1,8 +1,7 @@
 from app.constants import DEFAULT_THUMBNAIL
 from app.models.main import PlaylistSource, Track
-import re
 
-from app.utils.parser import remove_feat_suffix
+from app.utils.fingerprint import artists_match, create_fingerprint, get_fingerprint
 
 
 def parse_spotify_track_data(track: dict) -> Track:
@@ -37,7 +36,7 @@ def parse_spotify_track_data(track: dict) -> Track:
     youtube_search_query = f'"{title}" by {first_artist}'
     spotify_search_query = f"{title} artist:{first_artist} album:{album_name}"
 
-    return Track(
+    parsed_track = Track(
         id=track_id,
         title=title,
         url=f"https://open.spotify.com/track/{track_id}",
@@ -50,6 +49,8 @@ def parse_spotify_track_data(track: dict) -> Track:
         spotify_search_query=spotify_search_query,
         youtube_search_query=youtube_search_query,
     )
+    parsed_track._fingerprint = create_fingerprint(parsed_track)
+    return parsed_track
 
 
 def parse_youtube_track_data(track: dict) -> Track:
@@ -84,7 +85,7 @@ def parse_youtube_track_data(track: dict) -> Track:
     spotify_search_query = f"{title} artist:{first_artist} album:{album_name}"
     youtube_search_query = f'"{title}" by {first_artist}'
 
-    return Track(
+    parsed_track = Track(
         id=track_id,
         title=title,
         url=f"https://music.youtube.com/watch?v={track_id}",
@@ -97,6 +98,23 @@ def parse_youtube_track_data(track: dict) -> Track:
         spotify_search_query=spotify_search_query,
         youtube_search_query=youtube_search_query,
     )
+    parsed_track._fingerprint = create_fingerprint(parsed_track)
+    return parsed_track
+
+
+def get_search_query(track: Track, platform: PlaylistSource) -> str:
+    """get the query used to search for a track on a platform
+
+    Args:
+        track (Track): track from the source playlist
+        platform (PlaylistSource): platform the track is searched on
+
+    Returns:
+        str: search query (also used as the cache key)
+    """
+    if platform == PlaylistSource.SPOTIFY:
+        return track.spotify_search_query
+    return track.youtube_search_query
 
 
 def calculate_similarity(track1: Track, track2: Track) -> float:
@@ -109,35 +127,25 @@ def calculate_similarity(track1: Track, track2: Track) -> float:
     Returns:
         float: Similarity score
     """
+    fingerprint1 = get_fingerprint(track1)
+    fingerprint2 = get_fingerprint(track2)
     similarity = 0
 
     # if has same title
-    if remove_feat_suffix(track1.title).casefold().strip() == remove_feat_suffix(track2.title).casefold().strip():
+    if fingerprint1.title == fingerprint2.title:
         similarity += 1
 
     # if has same main artist
-    track1_artists = track1.artists.strip().split(", ")
-    track2_artists = track2.artists.strip().split(", ")
-
-    similarity_by_deep_eq = True
-
-    more_artists = track1_artists if len(track1_artists) > len(
-        track2_artists) else track2_artists
-    less_artists = track1_artists if len(track1_artists) < len(
-        track2_artists) else track2_artists
-    for artist in less_artists:
-        if artist not in more_artists:
-            similarity_by_deep_eq = False
-    if len(track1.artists) == len(track2.artists):
+    if fingerprint1.artists_length == fingerprint2.artists_length:
         similarity += 0.5
-    if similarity_by_deep_eq:
+    if artists_match(fingerprint1, fingerprint2):
         similarity += 0.5
 
     # if album name is the same
-    if track1.album.casefold().strip() == track2.album.casefold().strip():
+    if fingerprint1.album == fingerprint2.album:
         similarity += 1
 
     # if duration is within 3 seconds of each other
-    if abs(track1.duration - track2.duration) <= 2000:
+    if abs(fingerprint1.duration - fingerprint2.duration) <= 2000:
         similarity += 1
     return similarity
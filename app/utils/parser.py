@@ -3,6 +3,11 @@ from app.models.main import PlaylistInitInfo, PlaylistSource
 from urllib.parse import urlparse, parse_qs
 import re
 
+# everything after "feat." or "(feat."
+FEAT_SUFFIX_PATTERN = re.compile(r'\sfeat\..*$', flags=re.IGNORECASE)
+PARENTHESIZED_FEAT_SUFFIX_PATTERN = re.compile(
+    r'\(feat\..*$', flags=re.IGNORECASE)
+
 
 def get_playlist_source(url: str) -> Optional[PlaylistInitInfo]:
     parsed_url = urlparse(url)
@@ -20,10 +25,25 @@ def get_playlist_source(url: str) -> Optional[PlaylistInitInfo]:
         return None
 
 
+def get_playlist_url(source: PlaylistSource, playlist_id: str) -> str:
+    """build the url of a playlist, the inverse of `get_playlist_source`
+
+    Args:
+        source (PlaylistSource): platform of the playlist
+        playlist_id (str): playlist id on the platform
+
+    Returns:
+        str: playlist url
+    """
+    if source == PlaylistSource.YOUTUBE:
+        return f"https://music.youtube.com/playlist?list={playlist_id}"
+    return f"https://open.spotify.com/playlist/{playlist_id}"
+
+
 def remove_feat_suffix(text):
     # Remove characters after "feat"
-    text = re.sub(r'\sfeat\..*$', '', text, flags=re.IGNORECASE)
+    text = FEAT_SUFFIX_PATTERN.sub('', text)
     # Remove characters after "(feat"
-    text = re.sub(r'\(feat\..*$', '', text, flags=re.IGNORECASE)
+    text = PARENTHESIZED_FEAT_SUFFIX_PATTERN.sub('', text)
 
     return text.strip()
@@ -0,0 +1,100 @@
+import enum
+from typing import NamedTuple, Optional, Sequence
+
+import numpy as np
+
+from app.models.main import Track
+from app.utils.fingerprint import artists_match, get_fingerprint
+
+# highest score of `calculate_similarity`
+MAX_SIMILARITY = 4
+
+
+class MatchQuality(enum.Enum):
+    EXACT = 'EXACT'
+    GOOD = 'GOOD'
+    PARTIAL = 'PARTIAL'
+    POOR = 'POOR'
+
+
+class Match(NamedTuple):
+    track: Track
+    similarity: float
+    quality: MatchQuality
+
+
+def get_match_quality(similarity: float) -> MatchQuality:
+    if similarity >= MAX_SIMILARITY:
+        return MatchQuality.EXACT
+    if similarity >= 3:
+        return MatchQuality.GOOD
+    if similarity >= 2:
+        return MatchQuality.PARTIAL
+    return MatchQuality.POOR
+
+
+def score_pairs(tracks1: Sequence[Track], tracks2: Sequence[Track]) -> np.ndarray:
+    """score many pairs of tracks at once, same scores as `calculate_similarity`
+
+    Args:
+        tracks1 (Sequence[Track]): first track of each pair
+        tracks2 (Sequence[Track]): second track of each pair
+
+    Returns:
+        np.ndarray: similarity score of each pair (0 to 4)
+    """
+    if len(tracks1) == 0:
+        return np.zeros(0)
+
+    fingerprints1 = [get_fingerprint(track) for track in tracks1]
+    fingerprints2 = [get_fingerprint(track) for track in tracks2]
+    pairs = list(zip(fingerprints1, fingerprints2))
+
+    same_title = np.fromiter((fingerprint1.title == fingerprint2.title for fingerprint1, fingerprint2 in pairs),
+                             dtype=bool, count=len(pairs))
+    same_artists_length = np.fromiter((fingerprint1.artists_length == fingerprint2.artists_length
+                                       for fingerprint1, fingerprint2 in pairs), dtype=bool, count=len(pairs))
+    same_artists = np.fromiter((artists_match(fingerprint1, fingerprint2) for fingerprint1, fingerprint2 in pairs),
+                               dtype=bool, count=len(pairs))
+    same_album = np.fromiter((fingerprint1.album == fingerprint2.album for fingerprint1, fingerprint2 in pairs),
+                             dtype=bool, count=len(pairs))
+
+    durations1 = np.fromiter((fingerprint.duration for fingerprint in fingerprints1),
+                             dtype=np.int64, count=len(fingerprints1))
+    durations2 = np.fromiter((fingerprint.duration for fingerprint in fingerprints2),
+                             dtype=np.int64, count=len(fingerprints2))
+    same_duration = np.abs(durations1 - durations2) <= 2000
+
+    return (same_title + 0.5 * same_artists_length + 0.5 * same_artists
+            + same_album + same_duration).astype(float)
+
+
+def score_candidates(track: Track, candidates: Sequence[Track]) -> np.ndarray:
+    """score every candidate match of one track
+
+    Args:
+        track (Track): track to match
+        candidates (Sequence[Track]): possible matches e.g. search results
+
+    Returns:
+        np.ndarray: similarity score of each candidate (0 to 4)
+    """
+    return score_pairs([track] * len(candidates), candidates)
+
+
+def best_match(track: Track, candidates: Sequence[Track]) -> Optional[Match]:
+    """pick the candidate most similar to a track, the first one wins a tie
+
+    Args:
+        track (Track): track to match
+        candidates (Sequence[Track]): possible matches in search ranking order
+
+    Returns:
+        Optional[Match]: best candidate with its score and match quality, None without candidates
+    """
+    if len(candidates) == 0:
+        return None
+    scores = score_candidates(track, candidates)
+    best = int(np.argmax(scores))
+    similarity = float(scores[best])
+    return Match(candidates[best], similarity, get_match_quality(similarity))
@@ -0,0 +1,43 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Generic, TypeVar
+
+R = TypeVar("R")
+
+
+class SingleFlight(Generic[R]):
+    """Coalesce concurrent calls with the same key into a single call
+
+    The first caller of a key starts the call, every caller that arrives while it
+    is in flight waits for and gets the same result (or exception).
+    """
+
+    def __init__(self) -> None:
+        self._calls: Dict[str, "asyncio.Task[R]"] = {}
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key: str, func: Callable[[], Awaitable[R]]) -> R:
+        """run `func` unless a call with the same key is already in flight
+
+        Args:
+            key (str): key identifying the call
+            func (Callable[[], Awaitable[R]]): coroutine function to run
+
+        Returns:
+            R: result of the (shared) call
+        """
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        # a cancelled caller must not cancel the call for the others
+        return await asyncio.shield(task)
+
+    def _forget(self, key: str, task: "asyncio.Task[R]") -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            # mark the exception as retrieved even if every caller went away
+            task.exception()
@@ -1,4 +1,10 @@
+import asyncio
 import unittest
+from app.utils.concurrency import gather_with_concurrency
+from app.utils.lru import TTLCache
+from app.utils.singleflight import SingleFlight
+from app.utils.fingerprint import get_fingerprint
+from app.utils.scoring import MatchQuality, best_match, get_match_quality, score_candidates, score_pairs
 from app.utils.parser import get_playlist_source, remove_feat_suffix
 from app.utils.parse_track import calculate_similarity, parse_spotify_track_data, parse_youtube_track_data
 from app.models.main import PlaylistSource, Track
@@ -244,3 +250,128 @@ class TestObjectParser(unittest.TestCase):
         self.assertEqual(calculate_similarity(
             youtube_track, spotify_track), 0.5)
         pass
+
+
+class TestConcurrency(unittest.IsolatedAsyncioTestCase):
+    async def test_gather_keeps_order_and_limit(self):
+        in_flight = 0
+        max_in_flight = 0
+
+        async def work(item: int) -> int:
+            nonlocal in_flight, max_in_flight
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+            # later items finish first
+            await asyncio.sleep((10 - item) / 1000)
+            in_flight -= 1
+            return item * 2
+
+        results = await gather_with_concurrency(range(10), work, 3)
+        self.assertEqual(results, [item * 2 for item in range(10)])
+        self.assertEqual(max_in_flight, 3)
+
+
+class TestTTLCache(unittest.TestCase):
+    def test_lru_eviction(self):
+        cache: TTLCache[str, int] = TTLCache(maxsize=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.set("c", 3)
+
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_expiry(self):
+        now = 0.0
+        cache: TTLCache[str, int] = TTLCache(maxsize=2, ttl=10, clock=lambda: now)
+        cache.set("a", 1)
+        now = 9
+        self.assertEqual(cache.get("a"), 1)
+        now = 10
+        self.assertIsNone(cache.get("a"))
+
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["expirations"], stats["size"]),
+                         (1, 1, 1, 0))
+
+
+class TestSingleFlight(unittest.IsolatedAsyncioTestCase):
+    async def test_concurrent_calls_share_one_result(self):
+        flight: SingleFlight[int] = SingleFlight()
+        calls = 0
+
+        async def work() -> int:
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return calls
+
+        results = await asyncio.gather(*(flight.do("key", work) for _ in range(5)))
+        self.assertEqual(results, [1] * 5)
+        self.assertEqual(len(flight), 0)
+        # a later call runs again
+        self.assertEqual(await flight.do("key", work), 2)
+
+    async def test_exception_is_shared(self):
+        flight: SingleFlight[int] = SingleFlight()
+
+        async def work() -> int:
+            await asyncio.sleep(0.01)
+            raise ValueError("failed")
+
+        results = await asyncio.gather(*(flight.do("key", work) for _ in range(2)), return_exceptions=True)
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+
+
+class TestScoring(unittest.TestCase):
+    def setUp(self):
+        self.spotify_track = parse_spotify_track_data(SPOTIFY_MOCK_TRACK)
+        self.youtube_track = parse_youtube_track_data(YOUTUBE_MOCK_TRACK)
+
+    def test_scores_match_calculate_similarity(self):
+        candidates = [
+            self.youtube_track,
+            self.spotify_track,
+            self.spotify_track.model_copy(update={"duration": self.spotify_track.duration + 5000}),
+            self.spotify_track.model_copy(update={"artists": "Xanemusic, Someone"}),
+            self.spotify_track.model_copy(update={"title": "Other (feat. Someone)"}),
+        ]
+        for source in (self.spotify_track, self.youtube_track):
+            self.assertEqual(list(score_candidates(source, candidates)),
+                             [calculate_similarity(source, candidate) for candidate in candidates])
+        self.assertEqual(list(score_pairs([], [])), [])
+
+    def test_best_match(self):
+        worse = self.spotify_track.model_copy(update={"album": "Other"})
+        match = best_match(self.spotify_track, [worse, self.spotify_track, self.spotify_track])
+
+        self.assertEqual(match.track, self.spotify_track)
+        self.assertEqual((match.similarity, match.quality), (4, MatchQuality.EXACT))
+        self.assertEqual(get_match_quality(2.5), MatchQuality.PARTIAL)
+        self.assertIsNone(best_match(self.spotify_track, []))
+
+
+class TestFingerprint(unittest.TestCase):
+    def test_built_once_when_parsed(self):
+        track = parse_spotify_track_data(SPOTIFY_MOCK_TRACK)
+        fingerprint = get_fingerprint(track)
+
+        self.assertIs(track._fingerprint, fingerprint)
+        self.assertIs(get_fingerprint(track), fingerprint)
+        self.assertEqual(fingerprint.title, "who is she")
+        self.assertEqual(fingerprint.artists, frozenset(["Xanemusic"]))
+        # the fingerprint is not serialized nor compared
+        self.assertNotIn("_fingerprint", track.model_dump())
+        self.assertEqual(Track(**track.model_dump()), track)
+
+    def test_copy_with_update_gets_new_fingerprint(self):
+        track = parse_spotify_track_data(SPOTIFY_MOCK_TRACK)
+        copy = track.model_copy(update={"title": "Who Is She (feat. Someone)"})
+
+        self.assertIsNone(copy._fingerprint)
+        self.assertEqual(get_fingerprint(copy).key, get_fingerprint(track).key)
+        self.assertNotEqual(get_fingerprint(copy.model_copy(update={"album": "Other"})).key,
+                            get_fingerprint(track).key)
@@ -0,0 +1,79 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from app.constants import WARMUP_RETRY_INTERVAL
+from app.services import youtube
+from app.services.cache import redis_pool
+from app.services.spotify import spotify
+
+
+async def warm_redis() -> None:
+    # the ping opens the first pooled connection
+    if not await redis_pool.ping():
+        raise ConnectionError("redis is unreachable")
+
+
+async def warm_spotify() -> None:
+    # fetching the token opens the connection pool and starts the background refresh
+    await spotify.get_token()
+
+
+async def warm_youtube() -> None:
+    await run_in_threadpool(youtube.get_ytmusic)
+
+
+class Warmup:
+    """Warm up the service clients in parallel after startup
+
+    The app serves requests while warming up, `ready` tells when every client is warm.
+    """
+
+    def __init__(self, steps: Dict[str, Callable[[], Awaitable[None]]]) -> None:
+        self.steps = steps
+        self.errors: Dict[str, Optional[str]] = {name: None for name in steps}
+        self.warm: Dict[str, bool] = {name: False for name in steps}
+
+    @property
+    def ready(self) -> bool:
+        return all(self.warm.values())
+
+    async def _run_step(self, name: str) -> None:
+        try:
+            await self.steps[name]()
+        except Exception as e:
+            # a client that failed to warm up is warmed up on first use instead
+            self.errors[name] = str(e) or type(e).__name__
+        else:
+            self.warm[name] = True
+            self.errors[name] = None
+
+    async def run(self, retry_interval: float = WARMUP_RETRY_INTERVAL) -> None:
+        """warm up every client at the same time, retrying the ones that failed until all are warm
+
+        Args:
+            retry_interval (float, optional): seconds between attempts.
+        """
+        while True:
+            await asyncio.gather(*(self._run_step(name) for name, warm in self.warm.items()
+                                   if not warm))
+            if self.ready:
+                return
+            await asyncio.sleep(retry_interval)
+
+    def status(self) -> Dict[str, Dict[str, object]]:
+        """warm state and last warmup error of every client
+
+        Returns:
+            Dict[str, Dict[str, object]]: status by client
+        """
+        return {name: {"warm": self.warm[name], "error": self.errors[name]}
+                for name in self.steps}
+
+
+warmup = Warmup({
+    "redis": warm_redis,
+    "spotify": warm_spotify,
+    "youtube": warm_youtube,
+})
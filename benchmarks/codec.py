@@ -0,0 +1,39 @@
+"""Per-track cost of the track cache codec
+
+Compares the cache codec with the JSON + pydantic validation it replaced.
+
+    python -m benchmarks.codec
+"""
+import json
+import timeit
+
+from app.codec import decode_track, encode_track
+from app.models.main import Track
+from app.utils.parse_track import parse_spotify_track_data
+from app.utils.test import SPOTIFY_MOCK_TRACK
+
+ROUNDS = 20000
+
+
+def report(name: str, seconds: float) -> None:
+    print(f"{name:<34} {seconds / ROUNDS * 1e6:8.2f} us/track")
+
+
+def main() -> None:
+    track = parse_spotify_track_data(SPOTIFY_MOCK_TRACK)
+    json_value = track.model_dump_json()
+    codec_value = encode_track(track)
+    print(f"encoded size: json {len(json_value)} bytes, codec {len(codec_value)} bytes")
+
+    report("encode model_dump_json (before)",
+           timeit.timeit(track.model_dump_json, number=ROUNDS))
+    report("encode codec (after)",
+           timeit.timeit(lambda: encode_track(track), number=ROUNDS))
+    report("decode json.loads + Track (before)",
+           timeit.timeit(lambda: Track(**json.loads(json_value)), number=ROUNDS))
+    report("decode codec (after)",
+           timeit.timeit(lambda: decode_track(codec_value), number=ROUNDS))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""Local stand-ins for Spotify and YouTube Music replaying recorded responses
+
+The responses are built from the recorded payloads in `app/utils/test.py`, one
+song of the catalog per track, so every search finds its song on the other
+platform.
+"""
+import asyncio
+import random
+import re
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+import httpx
+
+from app.utils.test import SPOTIFY_MOCK_TRACK, YOUTUBE_MOCK_TRACK
+
+SPOTIFY_QUERY_PATTERN = re.compile(r"^(.*) artist:")
+YOUTUBE_QUERY_PATTERN = re.compile(r'^"(.*)" by ')
+
+
+class Faults:
+    """Latency and error rate of a fake upstream
+
+    """
+
+    def __init__(self, latency: float = 0.05, jitter: float = 0.02, error_rate: float = 0.0, seed: int = 0) -> None:
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+
+    def delay(self) -> float:
+        return max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+
+    def fails(self) -> bool:
+        return self.random.random() < self.error_rate
+
+
+class Catalog:
+    """Songs known to both fake upstreams
+
+    """
+
+    def __init__(self, size: int) -> None:
+        self.size = size
+
+    def spotify_track(self, index: int) -> dict:
+        return {
+            **SPOTIFY_MOCK_TRACK,
+            "id": f"spotify{index:06d}",
+            "name": f"Song {index}",
+            "artists": [{**SPOTIFY_MOCK_TRACK["artists"][0], "name": f"Artist {index % 97}"}],
+            "album": {**SPOTIFY_MOCK_TRACK["album"], "name": f"Album {index % 211}"},
+            "duration_ms": 150000 + index % 60 * 1000,
+        }
+
+    def youtube_track(self, index: int) -> dict:
+        return {
+            **YOUTUBE_MOCK_TRACK,
+            "videoId": f"youtube{index:05d}",
+            "title": f"Song {index}",
+            "artists": [{**YOUTUBE_MOCK_TRACK["artists"][0], "name": f"Artist {index % 97}"}],
+            "album": {**YOUTUBE_MOCK_TRACK["album"], "name": f"Album {index % 211}"},
+            "duration_seconds": 150 + index % 60,
+        }
+
+    def find(self, title: Optional[str]) -> Optional[int]:
+        if title is None or not title.startswith("Song "):
+            return None
+        index = int(title[len("Song "):])
+        return index if 0 <= index < self.size else None
+
+    def candidates(self, index: Optional[int], limit: int) -> List[int]:
+        # the song itself is not always the first result, like on the real platforms
+        if index is None:
+            return []
+        decoys = [(index + offset) % self.size for offset in range(1, limit)]
+        return (decoys[:1] + [index] + decoys[1:])[:limit]
+
+
+class FakeSpotifyApi:
+    """`httpx.MockTransport` handler for the Spotify Web API endpoints the app calls
+
+    """
+
+    def __init__(self, catalog: Catalog, faults: Faults) -> None:
+        self.catalog = catalog
+        self.faults = faults
+        self.calls: Counter = Counter()
+
+    def playlist_items(self, size: int, offset: int, limit: int) -> List[dict]:
+        return [{"track": self.catalog.spotify_track(index)}
+                for index in range(offset, min(size, offset + limit))]
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        params = request.url.params
+        if path.endswith("/api/token"):
+            return httpx.Response(200, json={"access_token": "token", "expires_in": 3600})
+
+        endpoint = path.split("/v1/")[-1]
+        if endpoint.startswith("playlists/"):
+            endpoint = "playlist_items" if endpoint.endswith("/tracks") else "playlist"
+        self.calls[endpoint] += 1
+        await asyncio.sleep(self.faults.delay())
+        if self.faults.fails():
+            return httpx.Response(503, json={"error": {"message": "service unavailable"}})
+
+        if endpoint == "search":
+            match = SPOTIFY_QUERY_PATTERN.match(params.get("q", ""))
+            index = self.catalog.find(match.group(1) if match else None)
+            items = [self.catalog.spotify_track(candidate) for candidate in
+                     self.catalog.candidates(index, int(params.get("limit", 10)))]
+            return httpx.Response(200, json={"tracks": {"items": items}})
+        if endpoint == "tracks":
+            ids = params.get("ids", "").split(",")
+            return httpx.Response(200, json={"tracks": [
+                self.catalog.spotify_track(int(track_id[len("spotify"):])) for track_id in ids]})
+
+        playlist_id = path.split("/playlists/")[-1].split("/")[0]
+        size = int(playlist_id[len("bench"):])
+        if endpoint == "playlist_items":
+            return httpx.Response(200, json={"items": self.playlist_items(
+                size, int(params.get("offset", 0)), int(params.get("limit", 100)))})
+        return httpx.Response(200, json={
+            "id": playlist_id,
+            "name": f"Benchmark {size}",
+            "description": "",
+            "images": [{"url": ""}],
+            "owner": {"display_name": "benchmark"},
+            "snapshot_id": f"snapshot{size}",
+            "tracks": {"items": self.playlist_items(size, 0, 100), "total": size},
+        })
+
+
+class FakeYTMusic:
+    """Stand-in for `ytmusicapi.YTMusic`, blocking like the real client
+
+    """
+
+    def __init__(self, catalog: Catalog, faults: Faults) -> None:
+        self.catalog = catalog
+        self.faults = faults
+        self.calls: Counter = Counter()
+
+    def _call(self, name: str) -> None:
+        self.calls[name] += 1
+        time.sleep(self.faults.delay())
+        if self.faults.fails():
+            raise Exception("Server returned HTTP 503: Service Unavailable.")
+
+    def search(self, query: str, filter: Optional[str] = None, limit: int = 20) -> List[dict]:
+        self._call("search")
+        match = YOUTUBE_QUERY_PATTERN.match(query)
+        index = self.catalog.find(match.group(1) if match else None)
+        return [self.catalog.youtube_track(candidate)
+                for candidate in self.catalog.candidates(index, limit)]
+
+    def get_playlist(self, playlistId: str, limit: Optional[int] = 100) -> Dict:
+        self._call("get_playlist")
+        size = int(playlistId[len("PLbench"):])
+        return {
+            "id": playlistId,
+            "title": f"Benchmark {size}",
+            "description": "",
+            "thumbnails": [{"url": ""}],
+            "author": {"name": "benchmark"},
+            "duration_seconds": 0,
+            "trackCount": size,
+            "tracks": [self.catalog.youtube_track(index) for index in range(size)],
+        }
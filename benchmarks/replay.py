@@ -0,0 +1,199 @@
+"""Offline replay benchmark of `/get-playlist` and `/generate-playlist`
+
+Spotify and YouTube Music are replaced by the local fakes of
+`benchmarks/fakes.py` and redis by the in-memory fake of the tests, so runs
+only measure the app. Upstream rate limits are lifted unless `--rate-limit`
+is passed.
+
+    python -m benchmarks.replay --sizes 10 100 1000 --requests 5 --latency 0.05
+"""
+import argparse
+import asyncio
+from contextlib import ExitStack
+from time import perf_counter
+from typing import Callable, Dict, List, Optional
+from unittest.mock import patch
+
+import httpx
+import numpy as np
+from prometheus_client import REGISTRY
+
+from app.dependencies import create_redis
+from app.main import app
+from app.models.main import PlaylistSource
+from app.services.scheduler import TokenBucket
+from app.services.spotify import spotify, spotify_scheduler
+from app.services.youtube import youtube_scheduler
+from app.testing import FakeRedis
+from app.track_cache import track_memory_cache
+from benchmarks.fakes import Catalog, Faults, FakeSpotifyApi, FakeYTMusic
+
+PLAYLIST_URLS: Dict[PlaylistSource, Callable[[int], str]] = {
+    PlaylistSource.SPOTIFY: lambda size: f"https://open.spotify.com/playlist/bench{size}",
+    PlaylistSource.YOUTUBE: lambda size: f"https://music.youtube.com/playlist?list=PLbench{size}",
+}
+
+
+class Upstreams:
+    """Fake upstreams and redis the app is pointed at during a run
+
+    """
+
+    def __init__(self, size: int, faults: Faults) -> None:
+        catalog = Catalog(size)
+        self.spotify = FakeSpotifyApi(catalog, faults)
+        self.ytmusic = FakeYTMusic(catalog, faults)
+        self.cache = FakeRedis()
+
+    def calls(self) -> Dict[str, int]:
+        return {
+            **{f"spotify.{name}": count for name, count in self.spotify.calls.items()},
+            **{f"youtube.{name}": count for name, count in self.ytmusic.calls.items()},
+        }
+
+    def flush(self) -> None:
+        self.cache.store.clear()
+        track_memory_cache.clear()
+
+
+def count_lookups(cache: str, result: str) -> float:
+    return REGISTRY.get_sample_value("cache_lookups_total", {"cache": cache, "result": result}) or 0.0
+
+
+def count_searched_queries() -> float:
+    """number of search queries no cache answered, from the app's cache lookup counters
+
+    Every query missing from the track cache is looked up in the track index (when
+    enabled) and searched for upstream otherwise, however many times the upstream
+    call is retried.
+
+    Returns:
+        float: search queries that reached the upstream so far
+    """
+    return count_lookups("redis", "miss") - count_lookups("index", "hit")
+
+
+def summarize(name: str, latencies: List[float], elapsed: float, tracks: int,
+              calls: int, searched: Optional[float]) -> Dict[str, str]:
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    return {
+        "scenario": name,
+        "p50 ms": f"{p50:.1f}",
+        "p95 ms": f"{p95:.1f}",
+        "p99 ms": f"{p99:.1f}",
+        "tracks/s": f"{tracks / elapsed:.0f}",
+        "upstream calls": f"{calls / len(latencies):.1f}",
+        "cache hit ratio": f"{1 - searched / tracks:.2f}" if searched is not None else "-",
+    }
+
+
+async def run_scenario(
+    client: httpx.AsyncClient,
+    upstreams: Upstreams,
+    name: str,
+    path: str,
+    body: dict,
+    size: int,
+    requests: int,
+    cold: bool,
+) -> Dict[str, str]:
+    latencies: List[float] = []
+    calls_before = sum(upstreams.calls().values())
+    searched_before = count_searched_queries()
+    started_at = perf_counter()
+    for _ in range(requests):
+        if cold:
+            upstreams.flush()
+        request_started_at = perf_counter()
+        response = await client.post(path, json=body)
+        latencies.append(perf_counter() - request_started_at)
+        response.raise_for_status()
+    elapsed = perf_counter() - started_at
+
+    searched = count_searched_queries() - searched_before
+    return summarize(
+        name,
+        latencies,
+        elapsed,
+        size * requests,
+        sum(upstreams.calls().values()) - calls_before,
+        searched if path == "/generate-playlist" else None,
+    )
+
+
+async def run_size(size: int, source: PlaylistSource, args: argparse.Namespace) -> List[Dict[str, str]]:
+    upstreams = Upstreams(size, Faults(args.latency, args.jitter, args.error_rate, args.seed))
+    convert_to = PlaylistSource.YOUTUBE if source == PlaylistSource.SPOTIFY else PlaylistSource.SPOTIFY
+    url = PLAYLIST_URLS[source](size)
+    prefix = f"{source.value.lower()}->{convert_to.value.lower()} {size}"
+
+    with ExitStack() as stack:
+        stack.enter_context(patch("app.dependencies.create_redis", lambda: upstreams.cache))
+        stack.enter_context(patch("app.services.youtube.ytmusic", upstreams.ytmusic))
+        stack.enter_context(patch.object(spotify, "transport", httpx.MockTransport(upstreams.spotify)))
+        app.dependency_overrides[create_redis] = lambda: upstreams.cache
+        await spotify.close()
+
+        transport = httpx.ASGITransport(app=app)  # type: ignore
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+            generate = {"playlist_url": url, "convert_to": convert_to.value}
+            rows = [
+                await run_scenario(client, upstreams, f"{prefix} get-playlist cold", "/get-playlist",
+                                   {"url": url}, size, args.requests, cold=True),
+                await run_scenario(client, upstreams, f"{prefix} get-playlist warm", "/get-playlist",
+                                   {"url": url}, size, args.requests, cold=False),
+                await run_scenario(client, upstreams, f"{prefix} generate cold", "/generate-playlist",
+                                   generate, size, args.requests, cold=True),
+                await run_scenario(client, upstreams, f"{prefix} generate warm", "/generate-playlist",
+                                   generate, size, args.requests, cold=False),
+            ]
+
+        app.dependency_overrides.pop(create_redis, None)
+        await spotify.close()
+    return rows
+
+
+def print_table(rows: List[Dict[str, str]]) -> None:
+    columns = list(rows[0])
+    widths = [max(len(column), *(len(row[column]) for row in rows)) for column in columns]
+    print("  ".join(column.ljust(width) for column, width in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(row[column].ljust(width) for column, width in zip(columns, widths)))
+
+
+async def main(args: argparse.Namespace) -> None:
+    if not args.rate_limit:
+        for scheduler in (spotify_scheduler, youtube_scheduler):
+            scheduler.bucket = TokenBucket(1e9, 1e9)
+
+    sources = [PlaylistSource.SPOTIFY, PlaylistSource.YOUTUBE] if args.source == "both" \
+        else [PlaylistSource(args.source.upper())]
+    rows: List[Dict[str, str]] = []
+    for size in args.sizes:
+        for source in sources:
+            rows.extend(await run_size(size, source, args))
+    print_table(rows)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000],
+                        help="playlist sizes in tracks")
+    parser.add_argument("--requests", type=int, default=5,
+                        help="requests per scenario")
+    parser.add_argument("--source", choices=["spotify", "youtube", "both"], default="both",
+                        help="platform of the source playlists")
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="mean upstream latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.02,
+                        help="upstream latency jitter in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="share of upstream calls failing with a 503")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--rate-limit", action="store_true",
+                        help="keep the configured upstream rate limits")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
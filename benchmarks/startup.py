@@ -0,0 +1,54 @@
+"""Cold start cost of the app
+
+Every run starts a fresh interpreter, imports `app.main` and serves `/`,
+then warms up the youtube music client the way the startup warmup does.
+
+    python -m benchmarks.startup --runs 5
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+RUN = """
+import asyncio, json
+from time import perf_counter
+started_at = perf_counter()
+from app.main import app
+imported_at = perf_counter()
+import httpx
+from app.services import youtube
+
+async def first_request():
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        (await client.get("/")).raise_for_status()
+
+asyncio.run(first_request())
+served_at = perf_counter()
+youtube.get_ytmusic()
+warm_at = perf_counter()
+print(json.dumps({
+    "import app.main": imported_at - started_at,
+    "first response": served_at - started_at,
+    "youtube client warmup": warm_at - served_at,
+}))
+"""
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    runs = [json.loads(subprocess.run([sys.executable, "-c", RUN], check=True,
+                                      capture_output=True, text=True).stdout)
+            for _ in range(args.runs)]
+    for name in runs[0]:
+        timings = [run[name] * 1000 for run in runs]
+        print(f"{name:<24} median {statistics.median(timings):8.1f} ms  max {max(timings):8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
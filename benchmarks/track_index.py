@@ -0,0 +1,68 @@
+"""Lookup cost of the local track index
+
+Indexes synthetic tracks and times `TrackIndex.find` for tracks in the index
+under another album name and a "feat." title, and for tracks missing from it.
+
+    python -m benchmarks.track_index --tracks 100000
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+from time import perf_counter
+from typing import List
+
+from app.models.main import PlaylistSource, Track
+from app.track_index import TrackIndex
+from app.utils.parse_track import parse_spotify_track_data
+from app.utils.test import SPOTIFY_MOCK_TRACK
+
+BATCH_SIZE = 1000
+
+
+def create_tracks(count: int) -> List[Track]:
+    track = parse_spotify_track_data(SPOTIFY_MOCK_TRACK)
+    return [track.model_copy(update={
+        "id": f"id{index}",
+        "title": f"song {index} of benchmark",
+        "artists": f"artist {index % 5000}",
+        "duration": 120_000 + index % 120_000,
+    }) for index in range(count)]
+
+
+async def main(args: argparse.Namespace) -> None:
+    tracks = create_tracks(args.tracks)
+    with tempfile.TemporaryDirectory() as directory:
+        index = TrackIndex(os.path.join(directory, "track_index.db"))
+        started_at = perf_counter()
+        for start in range(0, len(tracks), BATCH_SIZE):
+            await index.add(tracks[start:start + BATCH_SIZE])
+        print(f"indexed {len(tracks)} tracks in {perf_counter() - started_at:.2f}s")
+
+        step = max(1, len(tracks) // args.lookups)
+        sources = [track.model_copy(update={
+            "id": f"source{track.id}",
+            "title": f"{track.title} (feat. Someone)",
+            "album": "another album",
+            "platform": PlaylistSource.YOUTUBE,
+        }) for track in tracks[::step][:args.lookups]]
+        missing = [source.model_copy(update={"title": f"missing {source.title}"}) for source in sources]
+
+        for name, lookups in (("hit", sources), ("miss", missing)):
+            started_at = perf_counter()
+            found = [await index.find(source, PlaylistSource.SPOTIFY) for source in lookups]
+            elapsed = perf_counter() - started_at
+            hits = sum(track is not None for track in found)
+            print(f"{name:<5} {elapsed / len(lookups) * 1e6:8.1f} us/lookup, {hits}/{len(lookups)} found")
+        index.close()
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tracks", type=int, default=100_000, help="indexed tracks")
+    parser.add_argument("--lookups", type=int, default=1000, help="lookups timed")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))